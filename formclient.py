@@ -2,23 +2,37 @@
 import threading
 import asyncio
 import json
+import queue
 from pathlib import Path
 import logging
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
 from wowclient import WowClient  # must be in the same folder or on PYTHONPATH
+from wowlog import ring, setup_logging
 
-logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+setup_logging(logging.INFO)
 
 
 class FormClientApp:
+    LOG_LINES = 8
+    EVENT_INTERVAL = 50  # ms between drains of the client thread's event queue
+    STATS_INTERVAL = 1.0  # seconds between counter snapshots from the client thread
+
     def __init__(self, root: tk.Tk):
         self.root = root
         self.root.title("WoW Bot Client Controller")
 
         self.client: WowClient | None = None
         self.thread: threading.Thread | None = None
+        # everything the client thread has to tell the GUI goes through here, as (kind, value);
+        # only the Tk thread takes from it (_drain_events), so widgets are never touched elsewhere
+        self.events = queue.SimpleQueue()
+        self._connected = False
+        self._stopping = False
+        self._link = ""
+        self._last_key = ""
+        self._counts = ""
 
         main = ttk.Frame(root, padding=10)
         main.grid(sticky="nsew")
@@ -48,9 +62,33 @@ class FormClientApp:
         self.status_var = tk.StringVar(value="Stopped")
         ttk.Label(main, textvariable=self.status_var).grid(column=1, row=5, sticky="w", pady=(10, 0))
 
+        ttk.Label(main, text="Keys:").grid(column=0, row=6, sticky="w", pady=(10, 0))
+        self.keys_var = tk.StringVar(value="-")
+        ttk.Label(main, textvariable=self.keys_var).grid(column=1, row=6, columnspan=2, sticky="w", pady=(10, 0))
+
+        # Recent log lines
+        self.log_text = tk.Text(main, height=self.LOG_LINES, width=80, state="disabled")
+        self.log_text.grid(column=0, row=7, columnspan=3, sticky="nsew", pady=(10, 0))
+        self._log_seen = 0
+
         for i in range(3):
             main.columnconfigure(i, weight=1)
 
+        self._update_log()
+        self._drain_events()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def _update_log(self):
+        # the ring buffer is filled by the logging thread; show its tail when something new arrived
+        if ring.total != self._log_seen:
+            self._log_seen = ring.total
+            self.log_text.config(state="normal")
+            self.log_text.delete("1.0", "end")
+            self.log_text.insert("end", "\n".join(ring.recent(self.LOG_LINES)))
+            self.log_text.see("end")
+            self.log_text.config(state="disabled")
+        self.root.after(500, self._update_log)
+
     def browse_cfg(self):
         path = filedialog.askopenfilename(title="Select windows.json", filetypes=[("JSON files", "*.json"), ("All files", "*.*")])
         if path:
@@ -83,44 +121,88 @@ class FormClientApp:
         cfg_path = self.cfg_var.get().strip() or "windows.json"
 
         # instantiate client
-        self.client = WowClient(host=host, port=port, cfg_path=cfg_path)
+        client = self.client = WowClient(host=host, port=port, cfg_path=cfg_path)
+        client.on_event = lambda kind, value: self.events.put((kind, value))
 
         # start asyncio client in background thread
         def run_client():
             try:
-                asyncio.run(self.client.run())
+                asyncio.run(self._run(client))
             except Exception as e:
                 logging.exception("Client thread exception: %s", e)
             finally:
-                # ensure UI is updated when thread ends
-                self.root.after(0, self._on_thread_exit)
+                # the Tk thread resets the UI when it sees this
+                self.events.put(("exited", client))
 
         self.thread = threading.Thread(target=run_client, daemon=True)
         self.thread.start()
 
         self.start_btn.config(state="disabled")
         self.stop_btn.config(state="normal")
-        self.status_var.set("Starting...")
-
-        # poll to update status while running
-        self.root.after(200, self._update_status)
+        self.status_var.set("Connecting...")
+        self._stopping = False
+
+    async def _run(self, client: WowClient):
+        # runs on the client thread: counters are read there and sent over as plain dicts
+        async def snapshots():
+            while True:
+                await asyncio.sleep(self.STATS_INTERVAL)
+                self.events.put(("stats", {"link": client.link.summary(), "presses": client.presses,
+                                           "received": client.received, "missing": client.missing,
+                                           "reconnects": client.reconnects, "layout": client.layout.version}))
+
+        task = asyncio.create_task(snapshots())
+        try:
+            await client.run()
+        finally:
+            task.cancel()
 
     def stop_client(self):
         if not self.client:
             return
         self.status_var.set("Stopping...")
-        # request shutdown
+        self.stop_btn.config(state="disabled")
+        self._stopping = True
+        # cancels the client's tasks on its own loop, even if run() is still starting up; the
+        # thread then ends and posts "exited"
+        self.client.stop_threadsafe()
+
+    def on_close(self):
+        if self.client:
+            self.client.stop_threadsafe()
+            if self.thread:
+                self.thread.join(timeout=2)
+        self.root.destroy()
+
+    def _drain_events(self):
         try:
-            self.client.running = False
-        except Exception:
+            while True:
+                kind, value = self.events.get_nowait()
+                if kind == "exited":
+                    if value is self.client:
+                        self._on_thread_exit()
+                    continue
+                if kind == "connected":
+                    self._connected, self._link = True, ""
+                elif kind == "disconnected":
+                    self._connected = False
+                elif kind == "key":
+                    self._last_key = value
+                elif kind == "stats":
+                    link = value["link"]
+                    if link["samples"]:
+                        self._link = (f" - RTT {link['rtt_ms']:.1f} ms (jitter {link['jitter_ms']:.1f}), "
+                                      f"offset {link['offset_ms']:+.1f} ms")
+                    self._counts = (f"{value['received']} received, {value['presses']} pressed, "
+                                    f"{value['missing']} missing, {value['reconnects']} reconnects, "
+                                    f"layout v{value['layout']}")
+                self.keys_var.set(f"last {self._last_key or '-'}" + (f" - {self._counts}" if self._counts else ""))
+                if self.client and not self._stopping:
+                    self.status_var.set("Connected" + self._link if self._connected
+                                        else "Connection Failed - Retrying...")
+        except queue.Empty:
             pass
-
-        # try to join thread briefly
-        if self.thread:
-            self.thread.join(timeout=2)
-
-        # if still alive, leave it as daemon; update UI
-        self._on_thread_exit()
+        self.root.after(self.EVENT_INTERVAL, self._drain_events)
 
     def _on_thread_exit(self):
         self.start_btn.config(state="normal")
@@ -128,27 +210,9 @@ class FormClientApp:
         self.status_var.set("Offline")
         self.client = None
         self.thread = None
-
-    def _update_status(self):
-        if self.thread and self.thread.is_alive():
-            if self.client:
-                try:
-                    # Check if client has active connection
-                    if hasattr(self.client, '_writer') and self.client._writer:
-                        self.status_var.set("Connected")
-                    else:
-                        self.status_var.set("Connection Failed - Retrying...")
-                except Exception:
-                    self.status_var.set("Connection Failed - Retrying...")
-            else:
-                self.status_var.set("Starting...")
-            self.root.after(500, self._update_status)
-        else:
-            # thread died or not started
-            if self.client and not self.thread:
-                self.status_var.set("Offline")
-            elif not self.client:
-                self.status_var.set("Offline")
+        self._connected, self._stopping = False, False
+        self._link = self._last_key = self._counts = ""
+        self.keys_var.set("-")
 
 def main():
     root = tk.Tk()
@@ -1,19 +1,35 @@
 import threading
 import asyncio
 import logging
+import queue
+import sys
 import tkinter as tk
+from pathlib import Path
 from tkinter import ttk
+from wowlog import ring, setup_logging
 from wowserver import WowServer
 
-logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+# groups.json is read from the server's own folder, not the working directory: next to
+# formserver.py, or next to the executable of a PyInstaller build (whose __file__ is unpacked
+# to a temporary folder)
+APP_DIR = Path(sys.executable if getattr(sys, "frozen", False) else __file__).resolve().parent
 
 class FormServerApp:
+    LOG_LINES = 8
+    EVENT_INTERVAL = 50  # ms between drains of the server thread's event queue
+    STATS_INTERVAL = 1.0  # seconds between latency snapshots from the server thread
+
     def __init__(self, root: tk.Tk):
         self.root = root
         self.root.title("WoW Bot Server Controller")
 
         self.server: WowServer | None = None
         self.thread: threading.Thread | None = None
+        # everything the server thread has to tell the GUI goes through here, as (kind, value);
+        # only the Tk thread takes from it (_drain_events), so widgets are never touched elsewhere
+        self.events = queue.SimpleQueue()
+        self._clients = 0
+        self._published = 0
 
         main = ttk.Frame(root, padding=10)
         main.grid(sticky="nsew")
@@ -44,15 +60,28 @@ class FormServerApp:
         self.key_var = tk.StringVar(value="None")
         ttk.Label(main, textvariable=self.key_var).grid(column=1, row=4, sticky="w", pady=(10, 0))
 
+        # Per-client keypress-to-follower-press latency
+        ttk.Label(main, text="Latency p50/p95/p99:").grid(column=0, row=5, sticky="nw", pady=(10, 0))
+        self.latency_var = tk.StringVar(value="-")
+        ttk.Label(main, textvariable=self.latency_var, justify="left").grid(column=1, row=5, sticky="w", pady=(10, 0))
+
         # Help text
         help_text = "Press keys 1-6, x, y, í, 0, q, e, r, g, f, u, t to send commands\nPress '-' to pause, ',' to resume"
-        ttk.Label(main, text=help_text).grid(column=0, row=5, columnspan=2, pady=(10, 0))
+        ttk.Label(main, text=help_text).grid(column=0, row=6, columnspan=2, pady=(10, 0))
+
+        # Recent log lines
+        self.log_text = tk.Text(main, height=self.LOG_LINES, width=80, state="disabled")
+        self.log_text.grid(column=0, row=7, columnspan=2, sticky="nsew", pady=(10, 0))
+        self._log_seen = 0
 
         for i in range(2):
             main.columnconfigure(i, weight=1)
 
         # Update IP address
         self.update_ip()
+        self._update_log()
+        self._drain_events()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def update_ip(self):
         import socket
@@ -71,6 +100,17 @@ class FormServerApp:
         except Exception:
             self.ip_var.set("Could not detect IP")
 
+    def _update_log(self):
+        # the ring buffer is filled by the logging thread; show its tail when something new arrived
+        if ring.total != self._log_seen:
+            self._log_seen = ring.total
+            self.log_text.config(state="normal")
+            self.log_text.delete("1.0", "end")
+            self.log_text.insert("end", "\n".join(ring.recent(self.LOG_LINES)))
+            self.log_text.see("end")
+            self.log_text.config(state="disabled")
+        self.root.after(500, self._update_log)
+
     def start_server(self):
         if self.thread and self.thread.is_alive():
             return
@@ -81,16 +121,16 @@ class FormServerApp:
             self.status_var.set("Invalid port number")
             return
 
-        self.server = WowServer()
-        self.server.port = port
+        server = self.server = self.make_server(port)
+        server.on_event = lambda kind, value: self.events.put((kind, value))
 
         def run_server():
             try:
-                asyncio.run(self.server.start())
+                asyncio.run(self._serve(server))
             except Exception as e:
                 logging.exception("Server thread exception: %s", e)
             finally:
-                self.root.after(0, self._on_thread_exit)
+                self.events.put(("exited", server))
 
         self.thread = threading.Thread(target=run_server, daemon=True)
         self.thread.start()
@@ -99,46 +139,95 @@ class FormServerApp:
         self.stop_btn.config(state="normal")
         self.status_var.set("Starting...")
 
-        self.root.after(200, self._update_status)
+    async def _serve(self, server: WowServer):
+        # runs on the server thread: latency figures are read there and sent over as plain dicts
+        async def snapshots():
+            while True:
+                await asyncio.sleep(self.STATS_INTERVAL)
+                self.events.put(("stats", (server.latency_summary(["total"]), server.client_stats(),
+                                           server.published)))
+
+        task = asyncio.create_task(snapshots())
+        try:
+            await server.start()
+        finally:
+            task.cancel()
 
     def stop_server(self):
         if not self.server:
             return
         self.status_var.set("Stopping...")
+        self.stop_btn.config(state="disabled")
+        # closes the listening socket and all connections on the server's loop (or, if the
+        # thread has not got that far yet, keeps it from serving); the thread then posts "exited"
+        self.server.stop_threadsafe()
+
+    def on_close(self):
+        if self.server:
+            self.server.stop_threadsafe()
+            if self.thread:
+                self.thread.join(timeout=2)
+        self.root.destroy()
+
+    def _drain_events(self):
         try:
-            self.server.running = False
-        except Exception:
+            while True:
+                kind, value = self.events.get_nowait()
+                if kind == "key":
+                    self._published += 1
+                    self.key_var.set(value)
+                elif kind == "clients":
+                    self._clients = value
+                elif kind == "listening":
+                    self.port_var.set(str(value))
+                elif kind == "stats":
+                    summary, links, self._published = value
+                    self.latency_var.set(self._format_latency(summary, links))
+                elif kind == "stopped":
+                    continue  # "exited" follows once the thread is done
+                elif kind == "exited":
+                    if value is self.server:
+                        self._on_thread_exit()
+                    continue
+                if self.server:
+                    self.status_var.set(f"Running - {self._clients} follower(s), {self._published} key(s) sent")
+        except queue.Empty:
             pass
-
-        if self.thread:
-            self.thread.join(timeout=2)
-
-        self._on_thread_exit()
+        self.root.after(self.EVENT_INTERVAL, self._drain_events)
 
     def _on_thread_exit(self):
         self.start_btn.config(state="normal")
         self.stop_btn.config(state="disabled")
         self.status_var.set("Stopped")
         self.key_var.set("None")
+        self.latency_var.set("-")
         self.server = None
         self.thread = None
-
-    def _update_status(self):
-        if self.thread and self.thread.is_alive():
-            if self.server:
-                self.status_var.set("Running")
-                self.key_var.set(self.server.key)
-            else:
-                self.status_var.set("Starting...")
-            self.root.after(500, self._update_status)
-        else:
-            if self.server:
-                self.status_var.set("Stopped")
-            else:
-                self.status_var.set("Offline")
-            self.key_var.set("None")
+        self._clients = self._published = 0
+
+    @staticmethod
+    def make_server(port: int) -> WowServer:
+        server = WowServer(groups_path=APP_DIR / "groups.json")
+        server.port = port
+        return server
+
+    @staticmethod
+    def _format_latency(summary, links) -> str:
+        lines = []
+        for client, segs in summary.items():
+            total = segs.get("total")
+            line = f"{client}: "
+            if total:
+                line += f"{total['p50_ms']:.0f}/{total['p95_ms']:.0f}/{total['p99_ms']:.0f} ms"
+            link = links.get(client)
+            if link and link["rtt_ms"]:
+                line += (f" (RTT {link['rtt_ms']:.1f} ms, jitter {link['jitter_ms']:.1f} ms, "
+                         f"offset {link['offset_ms']:+.1f} ms)")
+            lines.append(line)
+        return "\n".join(lines) or "-"
 
 def main():
+    setup_logging(logging.INFO)
     root = tk.Tk()
     app = FormServerApp(root)
     root.mainloop()
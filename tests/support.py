@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from wowprotocol import FrameDecoder, encode_frame, CHANNEL, GROUPS, KEY, POLL, SUBSCRIBE
+from wowserver import WowServer
+
+KEYS = "123456"
+
+
+class FakeKeyEvent:
+    """Stands in for a keyboard library event."""
+
+    def __init__(self, name, event_type):
+        self.name = name
+        self.event_type = event_type
+
+
+async def start_server(**kwargs) -> WowServer:
+    """A listening WowServer on a free port, fed by submit_key() instead of the keyboard."""
+    srv = WowServer(capture_keys=False, **kwargs)
+    srv.port = 0
+    await srv.listen()
+    return srv
+
+
+async def stop_server(srv: WowServer):
+    server = srv._server
+    srv.stop()
+    srv.stop_metrics()
+    if srv.udp is not None:
+        srv.udp.transport.close()
+    if srv.recorder is not None:
+        srv.recorder.close()
+    await server.wait_closed()
+
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the condition")
+        await asyncio.sleep(0.005)
+
+
+async def follower(port, frames, stop, mode="push", groups=None, channel=None):
+    """Follower that records every KEY frame it receives until stop is set."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+    try:
+        if channel is not None:
+            writer.write(encode_frame(CHANNEL, payload=channel.encode("utf-8")))
+        if groups:
+            writer.write(encode_frame(GROUPS, payload=",".join(groups).encode("utf-8")))
+        writer.write(encode_frame(SUBSCRIBE if mode == "push" else POLL))
+        await writer.drain()
+        while not stop.is_set():
+            data = await reader.read(65536)
+            if not data:
+                break
+            frames.extend(f for f in decoder.feed(data) if f.type == KEY)
+            if mode == "poll":
+                writer.write(encode_frame(POLL))
+                await writer.drain()
+    finally:
+        writer.close()
+
+
+async def stop_followers(stop, tasks):
+    stop.set()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def submit_keys(srv: WowServer, count: int, rate: float):
+    """Key source for a thread, like the keyboard hook: count keys paced at rate per second."""
+    start = time.perf_counter()
+    for i in range(count):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        srv.submit_key(KEYS[i % len(KEYS)])
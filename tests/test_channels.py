@@ -0,0 +1,35 @@
+import asyncio
+
+from support import follower, stop_followers, wait_until
+from wowchannels import Channel, ChannelServer
+from wowserver import WowServer
+
+
+def test_channels_are_isolated_and_unknown_ones_refused():
+    async def run():
+        hub = ChannelServer([Channel("main", WowServer(capture_keys=False)),
+                             Channel("alt", WowServer(capture_keys=False))], port=0)
+        server = await hub.listen()
+        main, alt = hub.channels["main"].server, hub.channels["alt"].server
+        stop = asyncio.Event()
+        named, default, other, unknown = [], [], [], []
+        tasks = [asyncio.create_task(follower(hub.port, named, stop, channel="main")),
+                 asyncio.create_task(follower(hub.port, default, stop)),  # an older client: first channel
+                 asyncio.create_task(follower(hub.port, other, stop, channel="alt")),
+                 asyncio.create_task(follower(hub.port, unknown, stop, channel="nope"))]
+        await wait_until(lambda: len(main.clients) == 2 and len(alt.clients) == 1 and tasks[3].done())
+        await asyncio.sleep(0.05)  # let the SUBSCRIBEs arrive
+        for key in "123":
+            main.publish_key(key)
+        for key in "45":
+            alt.publish_key(key)
+        await wait_until(lambda: len(named) == len(default) == 3 and len(other) == 2)
+        await stop_followers(stop, tasks)
+        hub.stop()
+        await server.wait_closed()
+        return named, default, other, unknown
+
+    named, default, other, unknown = asyncio.run(run())
+    assert [f.key for f in named] == [f.key for f in default] == ["1", "2", "3"]
+    assert [f.key for f in other] == ["4", "5"]
+    assert unknown == []
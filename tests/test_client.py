@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+
+from support import KEYS, follower, start_server, stop_followers, stop_server, wait_until
+from wowbench import scrape
+from wowclient import WowClient, DEFAULT_POSITIONS
+from wowinput import VirtualInputBackend
+from wowmetrics import LinkHealth
+from wowprotocol import Frame, LINK, PING, PONG, STAMPS, FrameDecoder, encode_frame
+from wowserver import ClientState, WowServer
+
+
+def test_reload_swaps_whole_layouts_and_ignores_bad_edits(tmp_path):
+    cfg = tmp_path / "windows.json"
+    edits, keys_per_edit = 8, 4
+
+    def write(windows, broken=False):
+        text = json.dumps({"windows": [DEFAULT_POSITIONS[i % len(DEFAULT_POSITIONS)] for i in range(windows)]})
+        cfg.write_text(text[:-5] if broken else text)
+
+    async def run():
+        write(2)
+        client = WowClient(cfg_path=cfg, backend=VirtualInputBackend())
+        client.config_interval = 0.005
+        client.key_interval = 0.0
+        client.inputs = asyncio.Queue()
+        client.worker.start()
+        # presses per batch = windows of the layout that batch was built from
+        sizes = []
+        run_batch = client.worker.run_batch
+
+        async def counting(batch):
+            sizes.append(sum(op[0] == "press" for op in batch))
+            return await run_batch(batch)
+
+        client.worker.run_batch = counting
+        tasks = [asyncio.create_task(client.bot_loop()), asyncio.create_task(client.config_loop())]
+        loop = asyncio.get_running_loop()
+        good = bad = kept = 0
+        for i in range(edits):
+            for k in range(keys_per_edit):
+                client.inputs.put_nowait((KEYS[k % len(KEYS)], loop.time(), 0, 0))
+            before = client.layout
+            broken = i % 4 == 3
+            write(2 + i % 3, broken)
+            await asyncio.sleep(0.03)
+            if broken:
+                bad += 1
+                kept += client.layout is before
+            else:
+                good += 1
+        await wait_until(lambda: client.worker.batches >= edits * keys_per_edit)
+        client.stop()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        client.worker.stop()
+        return client.layout_stats(), sizes, good, bad, kept
+
+    stats, sizes, good, bad, kept = asyncio.run(run())
+    assert stats["layout_version"] == good + 1
+    assert stats["reload_errors"] == bad == kept
+    assert set(sizes) <= {2, 3, 4}
+
+
+def test_relay_chain_forwards_every_key_unchanged():
+    depth, followers, keys = 2, 3, 30
+
+    async def run():
+        srv = await start_server()
+        stop = asyncio.Event()
+        relays, tasks = [], []
+        upstream = srv.port
+        for _ in range(depth):
+            relay = WowClient("127.0.0.1", upstream, cfg_path="", backend=VirtualInputBackend(), relay_port=0)
+            relay.key_interval = 0.0
+            relays.append(relay)
+            tasks.append(asyncio.create_task(relay.run()))
+            await wait_until(lambda: relay.relay is not None)
+            upstream = relay.relay_port
+        direct = []
+        received = [[] for _ in range(followers)]
+        followers_tasks = [asyncio.create_task(follower(srv.port, direct, stop))]
+        followers_tasks += [asyncio.create_task(follower(upstream, got, stop)) for got in received]
+        await wait_until(lambda: len(relays[-1].relay.clients) == followers and len(srv.clients) == 2)
+        await asyncio.sleep(0.2)  # every relay has its WELCOME and subscription in place
+        for i in range(keys):
+            srv.submit_key(KEYS[i % len(KEYS)])
+            await asyncio.sleep(0.005)
+        await wait_until(lambda: all(len(got) >= keys for got in received) and len(direct) >= keys)
+        leader_connections = len(srv.clients)
+        await stop_followers(stop, followers_tasks)
+        for relay in relays:
+            relay.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_server(srv)
+        return leader_connections, direct, received
+
+    leader_connections, direct, received = asyncio.run(run())
+    assert leader_connections == 2  # the first relay and the direct follower
+    for got in received:
+        assert [(f.seq, f.key, f.ts) for f in got] == [(f.seq, f.key, f.ts) for f in direct]
+        assert [f.seq for f in got] == list(range(1, keys + 1))
+
+
+def test_metrics_of_server_and_followers_add_up():
+    followers, keys = 3, 30
+
+    async def run():
+        srv = await start_server(metrics_port=0)
+        clients = [WowClient("127.0.0.1", srv.port, cfg_path="", backend=VirtualInputBackend(), metrics_port=0)
+                   for _ in range(followers)]
+        for c in clients:
+            c.key_interval = 0.0
+        tasks = [asyncio.create_task(c.run()) for c in clients]
+        await wait_until(lambda: len(srv.clients) == followers and all(c.metrics_port for c in clients))
+        await asyncio.sleep(0.05)  # let the SUBSCRIBEs arrive
+        for i in range(keys):
+            srv.submit_key(KEYS[i % len(KEYS)])
+            await asyncio.sleep(0.001)
+        await wait_until(lambda: all(c.worker.batches >= keys for c in clients))
+        status, server_samples = await scrape(srv.metrics_port)
+        follower_samples = [(await scrape(c.metrics_port))[1] for c in clients]
+        not_found, _ = await scrape(srv.metrics_port, "/nothing")
+        for c in clients:
+            c.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_server(srv)
+        return status, server_samples, follower_samples, not_found
+
+    status, server_samples, follower_samples, not_found = asyncio.run(run())
+    assert status.endswith("200 OK")
+    assert not_found.endswith("404 Not Found")
+    assert server_samples["wowserver_keys_published_total"] == keys
+    assert server_samples['wowserver_clients{mode="push"}'] == followers
+    assert sum(v for k, v in server_samples.items() if k.startswith("wowserver_client_keys_sent_total")) \
+        == keys * followers
+    assert [f["wowclient_presses_total"] for f in follower_samples] == [keys] * followers
+
+
+def test_stop_before_run_is_kept():
+    async def run():
+        client = WowClient("127.0.0.1", 1, cfg_path="", backend=VirtualInputBackend())
+        client.stop_threadsafe()  # before run() has bound a loop, as a quick Stop click in the GUI
+        await asyncio.wait_for(client.run(), 2.0)
+
+    asyncio.run(run())
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+
+def test_link_health_math_and_the_heartbeat_that_carries_it():
+    us = 1_000
+    link = LinkHealth()
+    # follower clock 5 ms ahead of the leader; 1 ms each way, the server holds the ping 0.5 ms
+    link.add_sample(0, -4000 * us, -3500 * us, 2500 * us)
+    assert (link.rtt_ns, link.offset_ns, link.jitter_ns) == (2000 * us, 5000 * us, 0)
+    # a slower, lopsided sample (3 ms out, 1 ms back) moves rtt and jitter but not the offset,
+    # which comes from the fastest recent sample
+    link.add_sample(10000 * us, 8000 * us, 8500 * us, 14500 * us)
+    assert link.rtt_ns == 2250 * us
+    assert link.jitter_ns == 250 * us
+    assert link.offset_ns == 5000 * us
+    assert link.summary() == {"rtt_ms": 2.25, "jitter_ms": 0.25, "offset_ms": 5.0, "samples": 2}
+
+    # the follower's estimates reach the server with the next heartbeat, which is answered with a PONG
+    state = ClientState(("127.0.0.1", 1), RecordingWriter(), 0)
+    payload = LINK.pack(int(link.rtt_ns), link.offset_ns, int(link.jitter_ns))
+    WowServer(capture_keys=False)._on_ping(state, Frame(PING, 3, 0, 123, payload), 456)
+    assert (state.rtt_ns, state.offset_ns, state.jitter_ns) == (2250 * us, 5000 * us, 250 * us)
+    (pong,) = FrameDecoder().feed(state.writer.data)
+    assert (pong.type, pong.seq, pong.ts) == (PONG, 3, 123)
+    assert STAMPS.unpack(pong.payload)[0] == 456
+
+
+def test_client_reconnects_when_the_server_stalls():
+    link_timeout = 0.3
+
+    async def run():
+        connects = []
+
+        async def stalled_server(reader, writer):
+            # accepts the follower, then reads its heartbeats without ever answering
+            connects.append(time.perf_counter())
+            while await reader.read(1024):
+                pass
+            writer.close()
+
+        server = await asyncio.start_server(stalled_server, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = WowClient("127.0.0.1", port, cfg_path="", backend=VirtualInputBackend(),
+                           heartbeat_interval=0.05, link_timeout=link_timeout)
+        task = asyncio.create_task(client.run())
+        await wait_until(lambda: len(connects) >= 3)
+        client.stop()
+        await task
+        server.close()
+        await server.wait_closed()
+        return connects
+
+    connects = asyncio.run(run())
+    gaps = [b - a for a, b in zip(connects, connects[1:])]
+    # the heartbeats keep the socket busy, yet silence from the server ends the link after link_timeout
+    assert all(link_timeout * 0.9 <= gap < link_timeout + 0.25 for gap in gaps), gaps
@@ -0,0 +1,91 @@
+import pytest
+
+from wowinput import InputPlan, InputWorker, MacroProgram, VirtualInputBackend, WindowTimings, LOW_LATENCY_TIMINGS
+
+POSITIONS = [(100, 100), (200, 100), (300, 100)]
+
+
+def run(batch):
+    """Execute one batch on the virtual clock; returns the backend with every op and its time."""
+    backend = VirtualInputBackend()
+    InputWorker(backend)._execute(batch)
+    return backend
+
+
+def times(backend, name):
+    return [op[0] for op in backend.ops if op[1] == name]
+
+
+@pytest.mark.parametrize("overlap, presses", [(False, [0.16, 0.39, 0.62]), (True, [0.16, 0.32, 0.48])])
+def test_plan_presses_every_window_on_schedule(overlap, presses):
+    tm = WindowTimings()  # move 70 ms, click 90 ms, hold 50 ms, gap 20 ms
+    plan = InputPlan([(x, y, tm) for x, y in POSITIONS], overlap=overlap)
+    backend = run(plan.ops("1"))
+
+    assert times(backend, "press") == pytest.approx(presses)
+    assert plan.press_offsets == pytest.approx(presses)
+    assert plan.spread == pytest.approx(presses[-1] - presses[0])
+    assert [op[2] for op in backend.ops if op[1] == "move"] == [x for x, _ in POSITIONS]
+    assert {op[2] for op in backend.ops if op[1] in ("press", "release")} == {"1"}
+    # a window is clicked only after the previous one has released its key
+    releases, clicks = times(backend, "release"), times(backend, "click")
+    assert all(click >= release + tm.gap - 1e-9 for release, click in zip(releases, clicks[1:]))
+    if overlap:
+        # the mouse is already on its way while the key is still held
+        moves = times(backend, "move")
+        assert all(move < release for move, release in zip(moves[1:], releases))
+
+
+def test_overlap_beats_the_serial_sum():
+    timings = [WindowTimings(), WindowTimings(key_hold=0.1), WindowTimings(move_settle=0.02, gap=0.0)]
+    windows = [(x, y, tm) for (x, y), tm in zip(POSITIONS, timings)]
+    serial = sum(tm.move_settle + tm.click_settle + tm.key_hold + tm.gap for tm in timings)
+
+    sequential = InputPlan(windows)
+    overlapped = InputPlan(windows, overlap=True)
+    assert sequential.duration == pytest.approx(serial)
+    assert overlapped.duration < serial
+    # the worker spends exactly the planned time on the virtual clock
+    assert run(sequential.ops("1")).now() == pytest.approx(sequential.duration)
+    assert run(overlapped.ops("1")).now() == pytest.approx(overlapped.duration)
+
+
+def holds(backend):
+    """Seconds each press was held, in press order."""
+    return [r - p for p, r in zip(times(backend, "press"), times(backend, "release"))]
+
+
+def test_macro_compiles_its_steps_onto_overlapping_windows():
+    windows = [(x, y, WindowTimings()) for x, y in POSITIONS[:2]]
+    macro = MacroProgram("burst", [("1", 0.0), ("2", 0.1)], repeat=2, every=1.0)
+    batch = macro.compile(windows, WindowTimings(), overlap=True)
+
+    plan = InputPlan(windows, overlap=True)  # presses at 0.16 and 0.32, done at 0.39
+    # the second step is due at 0.1 but waits for the first step's windows; the repeat starts at 1.0
+    assert batch[:2 * len(plan.ops("1"))] == plan.ops("1") + plan.ops("2")
+    backend = run(batch)
+    assert times(backend, "press") == pytest.approx([0.16, 0.32, 0.55, 0.71, 1.16, 1.32, 1.55, 1.71])
+    assert [op[2] for op in backend.ops if op[1] == "press"] == ["1", "1", "2", "2"] * 2
+    assert backend.now() == pytest.approx(1.78)
+
+
+def test_macro_window_timings_apply_to_their_window_only():
+    windows = [(x, y, WindowTimings()) for x, y in POSITIONS]
+    macro = MacroProgram("slow", [("1", 0.0)], timings={"key_hold": 0.1}, window_timings={1: {"key_hold": 0.25}})
+    backend = run(macro.compile(windows, WindowTimings()))
+    assert holds(backend) == pytest.approx([0.1, 0.25, 0.1])
+    # the layout's own timings are left alone
+    assert [tm.key_hold for _, _, tm in windows] == [0.05] * 3
+
+
+def test_macro_timings_override_low_latency_timings():
+    macro = MacroProgram("hold", [("1", 0.0), ("2", 0.0)], timings={"key_hold": 0.08})
+    # single window mode: press, hold, release per step, back to back
+    assert macro.compile([], LOW_LATENCY_TIMINGS) == [("press", "1"), ("wait", 0.08), ("release", "1"),
+                                                       ("press", "2"), ("wait", 0.08), ("release", "2")]
+    windows = [(x, y, LOW_LATENCY_TIMINGS) for x, y in POSITIONS[:2]]
+    backend = run(macro.compile(windows, LOW_LATENCY_TIMINGS, overlap=True))
+    assert holds(backend) == pytest.approx([0.08] * 4)
+    # everything not overridden keeps its low-latency value: move 20 ms -> click 30 ms -> press
+    assert times(backend, "press")[0] == pytest.approx(0.05)
+    assert times(backend, "click")[0] == pytest.approx(0.02)
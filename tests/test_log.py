@@ -0,0 +1,57 @@
+import logging
+
+import wowlog
+from wowlog import RingBufferHandler, log_every, ring, setup_logging, stop_logging
+
+
+def test_ring_buffer_keeps_the_last_lines():
+    handler = RingBufferHandler(capacity=3)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.getLogger("test_ring_buffer")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(5):
+            logger.warning("line %d", i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.recent() == ["line 2", "line 3", "line 4"]
+    assert handler.recent(2) == ["line 3", "line 4"]
+    assert handler.total == 5
+
+
+def test_stopping_the_listener_flushes_every_queued_record():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    lines = 200
+    try:
+        assert setup_logging(logging.INFO, ring_size=lines) is ring
+        assert setup_logging(logging.DEBUG) is ring  # already running: nothing changes
+        assert root.level == logging.INFO and len(root.handlers) == 1
+        total = ring.total
+        for i in range(lines):
+            logging.info("record %d", i)
+        logging.debug("below the level")
+        stop_logging()  # returns once the writer thread has handled everything queued
+        assert ring.total - total == lines
+        assert [line.split(": ", 1)[1] for line in ring.recent()] == [f"record {i}" for i in range(lines)]
+    finally:
+        stop_logging()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+
+def test_log_every_rate_limits_per_key(monkeypatch, caplog):
+    now = [100.0]
+    monkeypatch.setattr(wowlog.time, "monotonic", lambda: now[0])
+    caplog.set_level(logging.INFO)
+    for t in (100.0, 100.5, 100.9, 101.2, 101.3, 103.0):
+        now[0] = t
+        log_every(1.0, "test-a", logging.INFO, "poll from %s", "a")
+    now[0] = 101.3
+    log_every(1.0, "test-b", logging.INFO, "poll from %s", "b")  # another key has its own budget
+    assert caplog.messages == ["poll from a", "poll from a (2 similar suppressed)",
+                               "poll from a (1 similar suppressed)", "poll from b"]
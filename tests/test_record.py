@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+
+from support import follower, start_server, stop_followers, stop_server, wait_until
+from wowbench import write_sample_log
+from wowrecord import KeyRecorder, read_log, replay
+
+
+def test_log_round_trip_skips_a_partial_record(tmp_path):
+    path = tmp_path / "session.keys"
+    write_sample_log(path, 50, 0.1)
+    with open(path, "ab") as f:
+        f.write(b"\x01\x00\x00")  # a record cut short by a crash
+    records = list(read_log(path, chunk_size=64))  # records straddle chunk boundaries
+    assert [r.seq for r in records] == list(range(1, 51))
+    assert {r.group for r in records} == {"", "healer", "tank", "dps"}
+
+
+def test_session_appended_after_a_torn_record_reads_back(tmp_path):
+    path = tmp_path / "session.keys"
+    write_sample_log(path, 20, 0.1)
+    first = list(read_log(path))
+    with open(path, "ab") as f:
+        f.write(b"\x01\x00\x00\x00")  # the crash cut the last record short
+    recorder = KeyRecorder(path)
+    for seq, (key, group) in enumerate([("1", ""), ("2", "healer"), ("3", "tank")], 1):
+        recorder.record(seq, seq, key, group)
+    recorder.close()
+
+    records = list(read_log(path))
+    assert records[:20] == first
+    assert [(r.seq, r.key, r.group) for r in records[20:]] == [(1, "1", ""), (2, "2", "healer"), (3, "3", "tank")]
+
+
+def test_recorder_flushes_without_another_key(tmp_path):
+    path = tmp_path / "session.keys"
+
+    async def run():
+        recorder = KeyRecorder(path)
+        recorder.FLUSH_INTERVAL = 0.05
+        recorder.record(time.time_ns(), 1, "1")
+        recorder.record(time.time_ns(), 2, "2")
+        await asyncio.sleep(0.2)
+        # the file is still open: only the timer can have written these
+        seqs = [r.seq for r in read_log(path)]
+        recorder.close()
+        return seqs
+
+    assert asyncio.run(run()) == [1, 2]
+
+
+def test_replay_reaches_every_follower_and_records_the_same_keys(tmp_path):
+    source = tmp_path / "session.keys"
+    again = tmp_path / "again.keys"
+    write_sample_log(source, 100, 0.1)
+    followers = 3
+
+    async def run():
+        srv = await start_server(record_path=again)
+        stop = asyncio.Event()
+        received = [[] for _ in range(followers)]
+        tasks = [asyncio.create_task(follower(srv.port, got, stop)) for got in received]
+        await wait_until(lambda: sum(s.mode == "push" for s in srv.clients.values()) == followers)
+        count = await replay(srv, source, 0)
+        await wait_until(lambda: all(len(got) >= count for got in received))
+        await stop_followers(stop, tasks)
+        await stop_server(srv)
+        return count, received
+
+    count, received = asyncio.run(run())
+    keys = [r.key for r in read_log(source)]
+    assert count == len(keys)
+    for got in received:
+        assert [f.key for f in got] == keys
+    assert [r.key for r in read_log(again)] == keys
+
+
+def test_paced_replay_keeps_the_recorded_gaps(tmp_path):
+    source = tmp_path / "session.keys"
+    write_sample_log(source, 20, 0.1)
+    records = list(read_log(source))
+    speed = 10.0
+
+    async def run():
+        srv = await start_server()
+        start = time.perf_counter()
+        await replay(srv, source, speed)
+        elapsed = time.perf_counter() - start
+        await stop_server(srv)
+        return elapsed
+
+    planned = (records[-1].ts - records[0].ts) / 1e9 / speed
+    assert asyncio.run(run()) >= planned * 0.95
+
+
+def test_replay_renumbers_and_routes_by_the_replaying_servers_groups(tmp_path):
+    groups = tmp_path / "groups.json"
+    groups.write_text(json.dumps({"groups": {"healer": ["1", "2"], "tank": ["3"]}}))
+    source = tmp_path / "session.keys"
+    again = tmp_path / "again.keys"
+    recorder = KeyRecorder(source)
+    keys = "1234123"
+    tags = {"1": "healer", "2": "healer", "3": "tank"}
+    # seq 4 never reached this log (a relay that gave up on it), and the groups are as recorded
+    for seq, key in zip([1, 2, 3, 5, 6, 7, 8], keys):
+        recorder.record(time.time_ns(), seq, key, tags.get(key, ""))
+    recorder.close()
+
+    async def run():
+        srv = await start_server(groups_path=groups, record_path=again)
+        stop = asyncio.Event()
+        healer, tank = [], []
+        tasks = [asyncio.create_task(follower(srv.port, healer, stop, groups=["healer"])),
+                 asyncio.create_task(follower(srv.port, tank, stop, groups=["tank"]))]
+        await wait_until(lambda: sum(s.mode == "push" for s in srv.clients.values()) == 2)
+        await replay(srv, source, 0)
+        await wait_until(lambda: len(healer) == 5 and len(tank) == 3)
+        await stop_followers(stop, tasks)
+        await stop_server(srv)
+        return healer, tank
+
+    healer, tank = asyncio.run(run())
+    assert [(f.seq, f.key) for f in healer] == [(1, "1"), (2, "2"), (4, "4"), (5, "1"), (6, "2")]
+    assert [(f.seq, f.key) for f in tank] == [(3, "3"), (4, "4"), (7, "3")]
+    replayed = list(read_log(again))
+    assert [r.seq for r in replayed] == list(range(1, len(keys) + 1))
+    assert [(r.key, r.group) for r in replayed] == [(r.key, r.group) for r in read_log(source)]
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import socket
+from pathlib import Path
+
+import pytest
+
+from support import (KEYS, FakeKeyEvent, follower, start_server, stop_followers, stop_server, submit_keys,
+                     wait_until)
+from wowprotocol import FrameDecoder, encode_frame, encode_report, now_ns, KEY, POLL, SUBSCRIBE
+from wowserver import ClientState, KeyQueue, WowServer, load_groups
+from wowclient import WowClient
+from wowinput import VirtualInputBackend
+
+
+@pytest.mark.parametrize("mode", ["push", "poll", "mixed"])
+def test_every_follower_gets_every_key_once_in_order(mode):
+    clients, keys = 12, 60
+
+    async def run():
+        srv = await start_server()
+        stop = asyncio.Event()
+        received = [[] for _ in range(clients)]
+        modes = [("push", "poll")[i % 2] if mode == "mixed" else mode for i in range(clients)]
+        tasks = [asyncio.create_task(follower(srv.port, got, stop, m)) for m, got in zip(modes, received)]
+        await wait_until(lambda: len(srv.clients) == clients)
+        await asyncio.sleep(0.05)  # let the SUBSCRIBEs arrive
+        await asyncio.to_thread(submit_keys, srv, keys, 500.0)
+        await wait_until(lambda: all(len(got) >= keys for got in received))
+        await stop_followers(stop, tasks)
+        await stop_server(srv)
+        return received
+
+    for got in asyncio.run(run()):
+        assert [f.seq for f in got] == list(range(1, keys + 1))
+
+
+def test_key_queue_overflow_policies():
+    oldest = KeyQueue(maxsize=2, policy="drop-oldest")
+    for i, key in enumerate("123"):
+        oldest.put(key, i, i)
+    assert [k for k, _, _ in oldest.take_all()] == ["2", "3"]
+    assert oldest.dropped == 1
+
+    coalesce = KeyQueue(maxsize=2, policy="coalesce")
+    for i, key in enumerate("1223"):
+        coalesce.put(key, i, i)
+    assert [k for k, _, _ in coalesce.take_all()] == ["2", "3"]
+    assert (coalesce.coalesced, coalesce.dropped) == (1, 1)
+
+    block = KeyQueue(maxsize=1, policy="block", block_timeout=0.01)
+    block.put("1", 0, 0)
+    block.put("2", 1, 1)  # nobody takes: gives up after block_timeout
+    assert [k for k, _, _ in block.take_all()] == ["1"]
+    assert block.dropped == 1
+
+
+def test_groups_route_keys_to_their_members(tmp_path):
+    path = tmp_path / "groups.json"
+    path.write_text(json.dumps({"groups": {"healer": ["1", "2"], "tank": ["3"], "dps": ["4", "5"]}}))
+    tags = [["healer"], ["tank"], ["dps"], ["healer", "tank"], []]
+    clients, keys = 10, 30
+
+    async def run():
+        srv = await start_server(groups_path=path)
+        stop = asyncio.Event()
+        setups = [(("push", "poll")[i % 2], tags[i % len(tags)]) for i in range(clients)]
+        received = [[] for _ in range(clients)]
+        tasks = [asyncio.create_task(follower(srv.port, got, stop, mode, groups))
+                 for (mode, groups), got in zip(setups, received)]
+        await wait_until(lambda: len(srv.clients) == clients
+                         and sum(s.mode == "push" for s in srv.clients.values()) == clients // 2)
+        await asyncio.sleep(0.1)
+        for i in range(keys):
+            srv.submit_key(KEYS[i % len(KEYS)])
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.5)
+        await stop_followers(stop, tasks)
+        await stop_server(srv)
+        return srv, setups, received
+
+    srv, setups, received = asyncio.run(run())
+    for (mode, groups), got in zip(setups, received):
+        wanted = [KEYS[i % len(KEYS)] for i in range(keys)]
+        if groups:
+            wanted = [k for k in wanted if k not in srv.key_groups or srv.key_groups[k] & set(groups)]
+        assert [f.key for f in got] == wanted, (mode, groups)
+
+
+def test_gui_server_routes_by_the_groups_file_next_to_it(tmp_path, monkeypatch):
+    import formserver
+
+    assert formserver.APP_DIR == Path(formserver.__file__).resolve().parent
+    monkeypatch.setattr(formserver, "APP_DIR", tmp_path)
+    (tmp_path / "groups.json").write_text(json.dumps({"groups": {"healer": ["1"], "tank": ["2"]}}))
+
+    async def run():
+        srv = formserver.FormServerApp.make_server(0)  # as the Start button builds it
+        await srv.listen()
+        stop = asyncio.Event()
+        healer, tank = [], []
+        tasks = [asyncio.create_task(follower(srv.port, healer, stop, groups=["healer"])),
+                 asyncio.create_task(follower(srv.port, tank, stop, groups=["tank"]))]
+        await wait_until(lambda: sum(s.mode == "push" for s in srv.clients.values()) == 2)
+        for key in "123":
+            srv.submit_key(key)
+        await wait_until(lambda: len(healer) == len(tank) == 2)
+        await stop_followers(stop, tasks)
+        await stop_server(srv)
+        return healer, tank
+
+    healer, tank = asyncio.run(run())
+    assert [f.key for f in healer] == ["1", "3"]
+    assert [f.key for f in tank] == ["2", "3"]
+
+
+def test_groups_skip_keys_a_frame_cannot_carry(tmp_path):
+    path = tmp_path / "groups.json"
+    path.write_text(json.dumps({"groups": {"healer": ["1", "f1", ","]}}))
+    assert load_groups(path) == {"1": frozenset({"healer"})}
+
+
+def test_one_bad_key_does_not_drop_its_batch():
+    async def run():
+        srv = await start_server()
+        published = []
+        srv.on_event = lambda kind, value: published.append(value) if kind == "key" else None
+        for key in ("1", "f1", "2"):
+            srv.keys.put(key, srv.capture_ns(), srv.capture_ns())
+        srv._drain_keys()
+        await stop_server(srv)
+        return published
+
+    assert asyncio.run(run()) == ["1", "2"]
+
+
+def test_reports_fill_stage_histograms_that_outlive_the_connection():
+    stages = ["capture->enqueue", "enqueue->send", "send->receive", "receive->schedule", "schedule->click",
+              "click->press", "total"]
+
+    async def report_one_key(srv):
+        reader, writer = await asyncio.open_connection("127.0.0.1", srv.port)
+        writer.write(encode_frame(SUBSCRIBE))
+        await wait_until(lambda: any(s.mode == "push" for s in srv.clients.values()))
+        (state,) = srv.clients.values()
+        srv.submit_key("1")
+        decoder = FrameDecoder()
+        keys = []
+        while not keys:
+            keys = [f for f in decoder.feed(await reader.read(1024)) if f.type == KEY]
+        received = now_ns()
+        writer.write(encode_report(keys[0].seq, {"receive": received, "schedule": received + 1000,
+                                                 "click": received + 2000, "press": received + 3000}))
+        await wait_until(lambda: "total" in state.latency.segments)
+        writer.close()
+        await wait_until(lambda: not srv.clients)
+        _, captured, enqueued, _ = srv._events[-1]
+        return state, captured, enqueued, state.sent_at[keys[0].seq]
+
+    async def run():
+        srv = await start_server()
+        first = await report_one_key(srv)
+        second = await report_one_key(srv)  # the same follower, reconnected
+        # the enqueue stamp is the one taken on the hook thread, not the publish time
+        srv.keys.put("2", 1000, 2000)
+        srv._drain_keys()
+        await stop_server(srv)
+        return srv, first, second
+
+    srv, first, second = asyncio.run(run())
+    assert srv._events[-1][1:] == (1000, 2000, "2")
+    for state, captured, enqueued, sent in (first, second):
+        assert captured <= enqueued <= sent
+        assert list(state.latency.segments) == stages
+        assert all(h.count == 1 for h in state.latency.segments.values())
+    assert list(srv.stage_latency.segments) == stages
+    assert all(h.count == 2 for h in srv.stage_latency.segments.values())
+
+
+@pytest.mark.parametrize("policy", WowServer.SLOW_POLICIES)
+def test_stalled_follower_does_not_hold_up_the_others(policy):
+    clients, keys = 5, 2000
+
+    async def run():
+        srv = await start_server(queue_size=keys, send_high_water=4096, slow_policy=policy, stale_after=0.5,
+                                 max_lag=0.5)
+        stop = asyncio.Event()
+        # the stalled follower subscribes and then never reads again
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", srv.port))
+        sock.sendall(encode_frame(SUBSCRIBE))
+        stalled = sock.getsockname()[1]
+        received = [[] for _ in range(clients)]
+        tasks = [asyncio.create_task(follower(srv.port, got, stop)) for got in received]
+        await wait_until(lambda: len(srv.clients) == clients + 1
+                         and all(s.mode == "push" for s in srv.clients.values()))
+        for state in srv.clients.values():
+            if state.addr[1] == stalled:
+                # keep the kernel from absorbing the whole test in its socket buffers
+                state.writer.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                                                           4096)
+        await asyncio.to_thread(submit_keys, srv, keys, 4000.0)
+        await wait_until(lambda: all(len(got) >= keys for got in received))
+        await stop_followers(stop, tasks)
+        sock.close()
+        await stop_server(srv)
+        return received
+
+    for got in asyncio.run(run()):
+        assert [f.seq for f in got] == list(range(1, keys + 1))
+
+
+@pytest.mark.parametrize("mode", ["push", "poll"])
+def test_follower_resumes_without_losing_keys(mode):
+    drops, keys_per_drop = 4, 3
+
+    async def run():
+        srv = await start_server()
+        backend = VirtualInputBackend()
+        client = WowClient("127.0.0.1", srv.port, cfg_path="", mode=mode, backend=backend)
+        client.key_interval = 0.0
+        task = asyncio.create_task(client.run())
+        await wait_until(lambda: srv.clients)
+        keys = 0
+        for _ in range(drops):
+            for _ in range(keys_per_drop):
+                srv.submit_key(KEYS[keys % len(KEYS)])
+                keys += 1
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.25 if mode == "poll" else 0.02)
+            (state,) = srv.clients.values()
+            state.writer.transport.abort()
+            # a key captured while the follower is away
+            srv.submit_key(KEYS[keys % len(KEYS)])
+            keys += 1
+            await wait_until(lambda: srv.clients and next(iter(srv.clients.values())) is not state)
+        await wait_until(lambda: client.worker.batches >= keys)
+        client.stop()
+        await task
+        await stop_server(srv)
+        return keys, client, backend
+
+    keys, client, backend = asyncio.run(run())
+    assert sum(1 for op in backend.ops if op[1] == "press") == keys
+    assert client.duplicates == 0
+
+
+def test_capture_filters_repeats_and_keys_outside_the_set():
+    presses, repeats = 300, 3
+
+    async def run():
+        srv = await start_server(queue_size=presses)  # the hook below is not paced
+        published = []
+        srv.on_event = lambda kind, value: published.append(value) if kind == "key" else None
+
+        def hook_thread():
+            # like the OS: key-down, auto-repeat key-downs while held, key-up; plus keys we don't follow
+            for i in range(presses):
+                key = KEYS[i % len(KEYS)]
+                for _ in range(1 + repeats):
+                    srv.on_key_event(FakeKeyEvent(key, "down"))
+                for noise in ("w", "."):
+                    srv.on_key_event(FakeKeyEvent(noise, "down"))
+                    srv.on_key_event(FakeKeyEvent(noise, "up"))
+                srv.on_key_event(FakeKeyEvent(key, "up"))
+
+        await asyncio.to_thread(hook_thread)
+        await wait_until(lambda: len(published) >= presses)
+        await asyncio.sleep(0.05)
+        await stop_server(srv)
+        return srv, published
+
+    srv, published = asyncio.run(run())
+    assert published == [KEYS[i % len(KEYS)] for i in range(presses)]
+    stats = srv.capture_stats()
+    assert stats["filtered_repeat"] == presses * repeats
+    assert stats["filtered_key"] == presses * 2
+
+
+def test_keys_added_to_the_table_later_are_captured():
+    async def run():
+        srv = await start_server()
+        published = []
+        srv.on_event = lambda kind, value: published.append(value) if kind == "key" else None
+        srv.on_key_event(FakeKeyEvent("z", "down"))
+        srv.table.add("z")  # e.g. a key a groups file routes
+        srv.on_key_event(FakeKeyEvent("z", "up"))
+        srv.on_key_event(FakeKeyEvent("z", "down"))
+        srv.submit_key("z")
+        await wait_until(lambda: len(published) >= 2)
+        await stop_server(srv)
+        return srv, published
+
+    srv, published = asyncio.run(run())
+    assert published == ["z", "z"]
+    assert srv.capture_stats()["filtered_key"] == 1
+
+
+class GoneWriter:
+    """StreamWriter whose follower has gone away: every drain fails like one on a reset socket."""
+
+    def __init__(self):
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 1)
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        raise BrokenPipeError(32, "Broken pipe")
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def test_follower_gone_while_sending_is_a_plain_disconnect():
+    async def run():
+        srv = await start_server()
+        # poll client: the answer's drain fails
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_frame(POLL))
+        await asyncio.wait_for(srv.handle_client(reader, GoneWriter()), 2.0)
+        assert not srv.clients
+        # push client: its sender task ends instead of dying with the error
+        state = ClientState(("127.0.0.1", 2), GoneWriter(), 0)
+        state.wake = asyncio.Event()
+        state.outbox.append((1, encode_frame(POLL), now_ns()))
+        state.wake.set()
+        await asyncio.wait_for(srv._sender(state), 2.0)
+        await stop_server(srv)
+
+    asyncio.run(run())
+
+
+def test_stop_closes_the_port_and_a_stop_before_start_is_kept():
+    async def run():
+        srv = WowServer(capture_keys=False)
+        srv.port = 0
+        task = asyncio.create_task(srv.start())
+        await wait_until(lambda: srv._server is not None)
+        port = srv.port
+        srv.stop()
+        await asyncio.wait_for(task, 2.0)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("0.0.0.0", port))
+
+        early = WowServer(capture_keys=False)
+        early.port = 0
+        early.stop_threadsafe()  # before start() has bound a loop, as a quick Stop click in the GUI
+        await asyncio.wait_for(early.start(), 2.0)
+
+    asyncio.run(run())
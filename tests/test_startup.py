@@ -0,0 +1,47 @@
+import subprocess
+import sys
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent.parent
+BACKENDS = ("keyboard", "mouse", "pynput")
+
+# Runs in a fresh interpreter: a finder first on sys.meta_path sees every import attempt, so an
+# import of a backend is recorded whether or not that backend is installed here.
+PROBE = """
+import sys
+
+class Recorder:
+    seen = []
+
+    def find_spec(self, name, path=None, target=None):
+        if name.split(".")[0] in {backends!r}:
+            self.seen.append(name)
+        return None
+
+sys.meta_path.insert(0, Recorder())
+try:
+{body}
+finally:
+    print(*Recorder.seen)
+"""
+
+
+def imported_backends(*statements, check=True):
+    body = "\n".join("    " + s for s in statements)
+    probe = PROBE.format(backends=BACKENDS, body=body)
+    out = subprocess.run([sys.executable, "-c", probe], cwd=HERE, check=check, capture_output=True, text=True)
+    return out.stdout.split()
+
+
+def test_importing_loads_no_input_or_hook_backend():
+    assert imported_backends(
+        "import wowserver, wowclient, wowchannels, wowrecord, wowbench",
+        "from wowinput import NullInputBackend",
+        "wowserver.WowServer(capture_keys=False)",
+        "wowclient.WowClient(cfg_path='', backend=NullInputBackend())",
+    ) == []
+
+
+def test_probe_sees_a_backend_import():
+    # the desktop backend does import them; not installed here, so the probe fails after recording it
+    assert "mouse" in imported_backends("import wowinput", "wowinput.RealInputBackend()", check=False)
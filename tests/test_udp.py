@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+from support import KEYS, start_server, stop_server, wait_until
+from wowclient import WowClient
+from wowinput import VirtualInputBackend
+from wowprotocol import KEY
+from wowudp import decode_datagram, open_receiver
+
+
+class LossyTransport:
+    """Stands in for the fanout's socket and loses or holds back the datagrams a test picks.
+
+    A datagram is picked by the seq of its first frame: `drop` loses it once, `lost` every time
+    (resends included), `delay` ({seq: seconds}) holds it back once so later keys overtake it.
+    """
+
+    def __init__(self, transport, drop=(), lost=(), delay=None):
+        self.transport = transport
+        self.drop = set(drop)
+        self.lost = set(lost)
+        self.delay = dict(delay or {})
+
+    def sendto(self, data, addr):
+        frames = decode_datagram(data)
+        seq = frames[0].seq if frames and frames[0].type == KEY else None
+        if seq in self.lost:
+            return
+        if seq in self.drop:
+            self.drop.discard(seq)
+            return
+        if seq in self.delay:
+            asyncio.get_running_loop().call_later(self.delay.pop(seq), self.transport.sendto, data, addr)
+            return
+        self.transport.sendto(data, addr)
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+
+async def datagram_session(keys, copies=1, max_resend=64, reorder_wait=0.03, **loss):
+    """Publish keys to one UdpReceiver through a lossy fanout; returns delivered seqs and both ends."""
+    srv = await start_server(udp_port=0, udp_copies=copies)
+    srv.udp.max_resend = max_resend
+    delivered = []
+
+    def on_frames(frames):
+        delivered.extend(f.seq for f in frames if f.type == KEY)
+
+    receiver = await open_receiver(("127.0.0.1", srv.udp_port), on_frames, join_interval=0.05,
+                                   reorder_wait=reorder_wait)
+    await wait_until(lambda: receiver._next is not None)
+    srv.udp.transport = LossyTransport(srv.udp.transport, **loss)
+    for i in range(keys):
+        srv.publish_key(KEYS[i % len(KEYS)])
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(reorder_wait + 0.2)  # gaps are filled or given up on, trailing keys are asked for
+    receiver.close()
+    await stop_server(srv)
+    return delivered, receiver, srv.udp
+
+
+def test_reordered_datagram_is_held_back_and_delivered_in_order():
+    # no resends: only holding seq 4 back until seq 3 turns up can put them in order
+    delivered, receiver, fanout = asyncio.run(datagram_session(8, max_resend=0, reorder_wait=0.2, delay={3: 0.02}))
+    assert delivered == list(range(1, 9))
+    assert (receiver.missing, receiver.duplicates) == (0, 0)
+    assert receiver.nacks == 1 and fanout.resent == 0
+
+
+def test_lost_datagram_is_nacked_and_resent():
+    delivered, receiver, fanout = asyncio.run(datagram_session(10, drop={5}))
+    assert delivered == list(range(1, 11))
+    assert receiver.nacks == fanout.nacks == 1
+    assert fanout.resent == 1
+    assert receiver.missing == 0
+
+
+def test_gap_that_stays_lost_is_given_up_on():
+    delivered, receiver, fanout = asyncio.run(datagram_session(10, lost={4}))
+    assert delivered == [seq for seq in range(1, 11) if seq != 4]
+    assert receiver.missing == 1
+    assert receiver.nacks == fanout.nacks == 1
+    assert fanout.resent == 1  # and lost again
+
+
+def test_lost_last_key_is_recovered_through_welcome():
+    # nothing comes after seq 6 to reveal the gap; the WELCOME answering the next JOIN does
+    delivered, receiver, fanout = asyncio.run(datagram_session(6, drop={6}))
+    assert delivered == list(range(1, 7))
+    assert receiver.nacks == fanout.nacks == 1
+    assert receiver.missing == 0
+
+
+def test_copies_are_delivered_once():
+    delivered, receiver, fanout = asyncio.run(datagram_session(10, copies=3))
+    assert delivered == list(range(1, 11))
+    assert receiver.duplicates == 20
+    assert receiver.nacks == 0
+
+
+def test_datagram_follower_presses_only_its_groups_keys(tmp_path):
+    path = tmp_path / "groups.json"
+    path.write_text(json.dumps({"groups": {"healer": ["1", "2"], "tank": ["3"]}}))
+    keys = 12
+
+    async def run():
+        srv = await start_server(udp_port=0, groups_path=path)
+        backend = VirtualInputBackend()
+        client = WowClient("127.0.0.1", srv.port, cfg_path="", mode="udp", backend=backend,
+                           udp_port=srv.udp_port, groups=["healer"])
+        client.key_interval = 0.0
+        task = asyncio.create_task(client.run())
+        await wait_until(lambda: client.route_keys is not None and client._udp is not None
+                         and client._udp._next is not None)
+        for i in range(keys):
+            srv.publish_key(KEYS[i % len(KEYS)])
+            await asyncio.sleep(0.005)
+        wanted = [KEYS[i % len(KEYS)] for i in range(keys) if KEYS[i % len(KEYS)] != "3"]
+        await wait_until(lambda: client.worker.batches >= len(wanted))
+        await asyncio.sleep(0.05)
+        client.stop()
+        await task
+        await stop_server(srv)
+        return client, [op[2] for op in backend.ops if op[1] == "press"], wanted
+
+    client, pressed, wanted = asyncio.run(run())
+    assert pressed == wanted
+    assert client.filtered == keys // len(KEYS)  # the tank's "3" reaches us and is dropped here
+
+
+def test_follower_falls_back_to_tcp_when_no_datagrams_arrive():
+    link_timeout = 0.3
+
+    async def run():
+        srv = await start_server()  # no datagram port: JOINs over UDP go nowhere
+        backend = VirtualInputBackend()
+        client = WowClient("127.0.0.1", srv.port, cfg_path="", mode="udp", backend=backend, udp_port=9,
+                           heartbeat_interval=0.05, link_timeout=link_timeout)
+        client.key_interval = 0.0
+        task = asyncio.create_task(client.run())
+        await wait_until(lambda: any(s.mode == "udp" for s in srv.clients.values()))
+        loop = asyncio.get_running_loop()
+        joined = loop.time()
+        await wait_until(lambda: any(s.mode == "push" for s in srv.clients.values()))
+        fell_back = loop.time() - joined
+        for i in range(6):
+            srv.publish_key(KEYS[i])
+        await wait_until(lambda: client.worker.batches >= 6)
+        client.stop()
+        await task
+        await stop_server(srv)
+        return client, backend, fell_back
+
+    client, backend, fell_back = asyncio.run(run())
+    assert client.mode == "push" and client._udp is None
+    assert link_timeout <= fell_back < link_timeout + 1.0
+    assert [op[2] for op in backend.ops if op[1] == "press"] == list(KEYS[:6])
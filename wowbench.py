@@ -0,0 +1,909 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from wowchannels import Channel, ChannelServer, fake_source
+from wowclient import WowClient, WindowLayout, DEFAULT_POSITIONS
+from wowinput import MacroProgram, VirtualInputBackend, WindowTimings, LOW_LATENCY_TIMINGS
+from wowmetrics import LatencyHistogram
+from wowprotocol import FrameDecoder, encode_frame, CHANNEL, KEY, POLL, SUBSCRIBE
+from wowrecord import KeyRecorder, read_log, replay
+from wowserver import WowServer
+from wowudp import open_receiver
+
+
+# multicast group for the datagram benchmarks (loopback, TTL 1)
+UDP_BENCH_GROUP_SPEC = "239.255.42.99:5002"
+UDP_BENCH_GROUP = ("239.255.42.99", 5002)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(samples):
+    ms = [s * 1000.0 for s in samples]
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.mean(ms), 3) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+async def poll_client(port, received, stop):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+    try:
+        while not stop.is_set():
+            writer.write(encode_frame(POLL))
+            await writer.drain()
+            data = await reader.read(1024)
+            if not data:
+                break
+            now = time.perf_counter()
+            for frame in decoder.feed(data):
+                if frame.type == KEY:
+                    received.append(now)
+            await asyncio.sleep(0.2)
+    finally:
+        writer.close()
+
+
+async def push_client(port, received, stop):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+    try:
+        writer.write(encode_frame(SUBSCRIBE))
+        await writer.drain()
+        while not stop.is_set():
+            data = await reader.read(1024)
+            if not data:
+                break
+            now = time.perf_counter()
+            for frame in decoder.feed(data):
+                if frame.type == KEY:
+                    received.append(now)
+    finally:
+        writer.close()
+
+
+async def bench_latency(mode, keys, interval):
+    """Keypress-to-client-receive latency for one follower in push or poll mode."""
+    srv = WowServer(capture_keys=False)
+    srv.port = 0
+    server = await srv.listen()
+    received = []
+    stop = asyncio.Event()
+    client = poll_client if mode == "poll" else push_client
+    task = asyncio.create_task(client(srv.port, received, stop))
+    await asyncio.sleep(0.3)
+
+    sent = []
+
+    def key_source():
+        # stands in for the keyboard hook thread
+        for i in range(keys):
+            sent.append(time.perf_counter())
+            srv.submit_key("123456"[i % 6])
+            time.sleep(interval)
+
+    await asyncio.to_thread(key_source)
+    stop.set()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.sleep(0.3)  # let handle_client notice the disconnect
+    server.close()
+    await server.wait_closed()
+
+    # a key's latency runs to the first arrival after it was sent (a poll answer can carry several keys)
+    latencies = []
+    bounds = sent[1:] + [float("inf")]
+    for t_sent, t_next in zip(sent, bounds):
+        arrivals = [t for t in received if t_sent <= t < t_next]
+        if arrivals:
+            latencies.append(arrivals[0] - t_sent)
+    return summarize(latencies)
+
+
+async def bench_input(keys, windows, op_cost, dispatch="sequential"):
+    """Run bot_loop headless against the recording backend and report input timing per key."""
+    backend = VirtualInputBackend(op_cost=op_cost)
+    client = WowClient(cfg_path="", backend=backend)
+    positions = [dict(DEFAULT_POSITIONS[i % len(DEFAULT_POSITIONS)]) for i in range(windows)]
+    if dispatch == "low-latency":
+        client.layout = WindowLayout(positions, LOW_LATENCY_TIMINGS, "overlap")
+    else:
+        client.layout = WindowLayout(positions, WindowTimings(), dispatch)
+    client.key_interval = 0.0
+    client.inputs = asyncio.Queue()
+    client.worker.start()
+    task = asyncio.create_task(client.bot_loop())
+
+    loop = asyncio.get_running_loop()
+    wall_start = time.perf_counter()
+    for i in range(keys):
+        client.inputs.put_nowait(("123456"[i % 6], loop.time(), 0, 0))
+    while client.worker.batches < keys:
+        await asyncio.sleep(0.001)
+    wall = time.perf_counter() - wall_start
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    client.worker.stop()
+
+    # group press timestamps per key sequence: one press per window
+    presses = [op[0] for op in backend.ops if op[1] == "press"]
+    spreads = [presses[i + windows - 1] - presses[i] for i in range(0, len(presses), windows)]
+    virtual = backend.clock.now()
+    return {
+        "keys": keys,
+        "windows": windows,
+        "dispatch": dispatch,
+        "virtual_ms_per_key": round(1000 * virtual / keys, 3),
+        "keys_per_s": round(keys / virtual, 2) if virtual else 0.0,
+        "window_spread": summarize(spreads),
+        "wall_overhead_ms_per_key": round(1000 * wall / keys, 3),
+    }
+
+
+async def bench_macro(windows, steps, repeat, op_cost):
+    """Trigger one macro through bot_loop on the virtual backend; compare press times with the plan."""
+    backend = VirtualInputBackend(op_cost=op_cost)
+    client = WowClient(cfg_path="", backend=backend)
+    positions = [dict(DEFAULT_POSITIONS[i % len(DEFAULT_POSITIONS)]) for i in range(windows)]
+    sequence = [("123456"[i % 6], 0.4 * i) for i in range(steps)]
+    macros = {"m": MacroProgram("bench", sequence, repeat=repeat, every=0.4 * steps + 0.5)}
+    compile_start = time.perf_counter()
+    client.layout = WindowLayout(positions, macros=macros)
+    compile_ms = 1000 * (time.perf_counter() - compile_start)
+    batch = client.layout.macro_ops["m"]
+    client.inputs = asyncio.Queue()
+    client.worker.start()
+    task = asyncio.create_task(client.bot_loop())
+    # one KEY frame from the server instead of steps * repeat of them
+    client.inputs.put_nowait(("m", asyncio.get_running_loop().time(), 0, 0))
+    while client.worker.batches < 1:
+        await asyncio.sleep(0.001)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    client.worker.stop()
+
+    planned = []
+    t = 0.0
+    for op in batch:
+        if op[0] == "wait":
+            t += op[1]
+        elif op[0] == "press":
+            planned.append(t)
+    start = backend.ops[0][0]
+    actual = [op[0] - start for op in backend.ops if op[1] == "press"]
+    errors = [a - p for a, p in zip(actual, planned)]
+    return {
+        "windows": windows,
+        "keys_pressed": len(actual),
+        "frames_needed": 1,
+        "frames_without_macro": steps * repeat,
+        "operations": len(batch),
+        "compile_ms": round(compile_ms, 3),
+        "duration_ms": round(1000 * (backend.clock.now() - start), 3),
+        "timing_error": summarize(errors),
+    }
+
+
+async def scrape(port, path="/metrics"):
+    """GET path; returns (status line, {sample name with labels: value})."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("ascii"))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = head.split(b"\r\n")[0].decode("ascii")
+    samples = {}
+    for line in body.decode("utf-8").splitlines() if status.endswith("200 OK") else ():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return status, samples
+
+
+async def bench_metrics(followers, keys, scrapes):
+    """Serve metrics from a server and its followers under load; reports what a scrape costs."""
+    srv = WowServer(capture_keys=False, metrics_port=0)
+    srv.port = 0
+    server = await srv.listen()
+    clients = [WowClient("127.0.0.1", srv.port, cfg_path="", backend=VirtualInputBackend(), metrics_port=0)
+               for _ in range(followers)]
+    for c in clients:
+        c.key_interval = 0.0
+    tasks = [asyncio.create_task(c.run()) for c in clients]
+    while len(srv.clients) < followers or any(c.metrics_port == 0 for c in clients):
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.05)  # let the SUBSCRIBEs arrive
+    for i in range(keys):
+        srv.submit_key("123456"[i % 6])
+        await asyncio.sleep(0.001)
+    deadline = time.perf_counter() + 5.0
+    while any(c.worker.batches < keys for c in clients) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+    times = []
+    for _ in range(scrapes):
+        start = time.perf_counter()
+        status, server_samples = await scrape(srv.metrics_port)
+        times.append(time.perf_counter() - start)
+    follower_samples = [(await scrape(c.metrics_port))[1] for c in clients]
+
+    for c in clients:
+        c.running = False
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    srv.stop_metrics()
+    server.close()
+    await server.wait_closed()
+    return {
+        "followers": followers,
+        "keys": keys,
+        "status": status,
+        "samples": len(server_samples),
+        "loop_lag_p99_s": server_samples.get('wowserver_loop_lag_seconds{quantile="0.99"}'),
+        "batch_p50_s": follower_samples[0].get('wowclient_input_batch_seconds{quantile="0.5"}'),
+        "scrape": summarize(times),
+    }
+
+
+async def relay_follower(port, arrivals, stop):
+    """Push follower that records (seq, leader timestamp, receive time) of every key."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+    try:
+        writer.write(encode_frame(SUBSCRIBE))
+        await writer.drain()
+        while not stop.is_set():
+            data = await reader.read(4096)
+            if not data:
+                break
+            now = time.time_ns()
+            arrivals.extend((f.seq, f.ts, now) for f in decoder.feed(data) if f.type == KEY)
+    finally:
+        writer.close()
+
+
+async def bench_relay(depth, followers, keys, interval):
+    """Leader -> chain of `depth` relaying WowClients -> followers on the last relay.
+
+    Reports leader-to-follower latency through the chain and what each hop adds. One follower
+    on the leader is the no-relay baseline.
+    """
+    srv = WowServer(capture_keys=False)
+    srv.port = 0
+    server = await srv.listen()
+    stop = asyncio.Event()
+
+    relays = []
+    tasks = []
+    upstream = srv.port
+    for _ in range(depth):
+        relay = WowClient("127.0.0.1", upstream, cfg_path="", backend=VirtualInputBackend(), relay_port=0)
+        relay.key_interval = 0.0
+        relays.append(relay)
+        tasks.append(asyncio.create_task(relay.run()))
+        while relay.relay is None:
+            await asyncio.sleep(0.005)
+        upstream = relay.relay_port
+
+    direct = []
+    received = [[] for _ in range(followers)]
+    tasks.append(asyncio.create_task(relay_follower(srv.port, direct, stop)))
+    tasks += [asyncio.create_task(relay_follower(upstream, arrivals, stop)) for arrivals in received]
+    last = relays[-1].relay if relays else srv
+    while len(last.clients) < followers + (0 if relays else 1) or len(srv.clients) < (2 if relays else 1):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)  # every relay has its WELCOME and subscription in place
+
+    for i in range(keys):
+        srv.submit_key("123456"[i % 6])
+        await asyncio.sleep(interval)
+    deadline = time.perf_counter() + 5.0
+    while time.perf_counter() < deadline and any(len(a) < keys for a in received):
+        await asyncio.sleep(0.05)
+    leader_connections = len(srv.clients)
+
+    stop.set()
+    for relay in relays:
+        relay.running = False
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(0.3)  # let handle_client notice the disconnects
+    server.close()
+    await server.wait_closed()
+
+    def latency(arrivals):
+        return summarize([(now - ts) / 1e9 for _, ts, now in arrivals])
+
+    return {
+        "depth": depth,
+        "followers": followers,
+        "keys": keys,
+        "leader_connections": leader_connections,
+        "direct": latency(direct),
+        "through_relays": latency([a for arrivals in received for a in arrivals]),
+        "hops": [relay.hop.summary() for relay in relays],
+    }
+
+
+def write_sample_log(path, keys, mean_interval, seed=1):
+    """Synthetic session: keys with human-like, exponentially distributed gaps."""
+    rng = random.Random(seed)
+    recorder = KeyRecorder(path)
+    ts = time.time_ns()
+    groups = ["", "healer", "tank", "dps"]
+    for seq in range(1, keys + 1):
+        ts += int(rng.expovariate(1 / mean_interval) * 1e9)
+        recorder.record(ts, seq, "123456"[rng.randrange(6)], groups[seq % len(groups)])
+    recorder.close()
+
+
+async def bench_replay(followers, keys, speeds, mean_interval, read_records):
+    """Replay a recorded session to followers at several speeds, recording it again as it goes.
+
+    For paced runs the gaps between arrivals are compared with the recorded gaps divided by the
+    speed; a long log is then read back to measure streaming read speed and memory.
+    """
+    tmp = tempfile.mkdtemp()
+    source = os.path.join(tmp, "session.keys")
+    write_sample_log(source, keys, mean_interval)
+    recorded = list(read_log(source))
+    runs = []
+    for speed in speeds:
+        again = os.path.join(tmp, f"replay-{speed:g}.keys")
+        srv = WowServer(capture_keys=False, record_path=again)
+        srv.port = 0
+        server = await srv.listen()
+        stop = asyncio.Event()
+        received = [[] for _ in range(followers)]
+        tasks = [asyncio.create_task(relay_follower(srv.port, arrivals, stop)) for arrivals in received]
+        while sum(s.mode == "push" for s in srv.clients.values()) < followers:
+            await asyncio.sleep(0.01)
+
+        start = time.perf_counter()
+        count = await replay(srv, source, speed)
+        deadline = time.perf_counter() + 5.0
+        while time.perf_counter() < deadline and any(len(a) < count for a in received):
+            await asyncio.sleep(0.01)
+        wall = time.perf_counter() - start
+
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.3)  # let handle_client notice the disconnect
+        srv.recorder.close()
+        server.close()
+        await server.wait_closed()
+
+        errors = []
+        if speed:
+            arrivals = received[0]
+            for i in range(1, len(arrivals)):
+                planned = (recorded[i].ts - recorded[i - 1].ts) / 1e9 / speed
+                errors.append(abs((arrivals[i][2] - arrivals[i - 1][2]) / 1e9 - planned))
+        runs.append({
+            "speed": speed or "max",
+            "keys": count,
+            "wall_s": round(wall, 3),
+            "keys_per_s": round(count / wall, 1) if wall else 0.0,
+            "pacing_error": summarize(errors) if errors else None,
+        })
+
+    # streaming read of a long log: memory must not grow with the number of records
+    big = os.path.join(tmp, "long.keys")
+    write_sample_log(big, read_records, 0.1)
+    tracemalloc.start()
+    read_start = time.perf_counter()
+    n = sum(1 for _ in read_log(big))
+    read_s = time.perf_counter() - read_start
+    heap_kb = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    size = os.path.getsize(big)
+    for name in os.listdir(tmp):
+        os.unlink(os.path.join(tmp, name))
+    os.rmdir(tmp)
+    return {
+        "runs": runs,
+        "read": {"records": n, "bytes_per_record": round(size / max(1, n), 2),
+                 "records_per_s": round(n / read_s), "heap_peak_kb": round(heap_kb, 1)},
+    }
+
+
+async def load_follower(port, mode, keys, hist, counts, idx, deadline, channel=None):
+    """Minimal follower: receives keys and records capture->receive latency."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+    try:
+        if channel is not None:
+            writer.write(encode_frame(CHANNEL, payload=channel.encode("utf-8")))
+        if mode == "push":
+            writer.write(encode_frame(SUBSCRIBE))
+            await writer.drain()
+        while counts[idx] < keys and time.monotonic() < deadline:
+            if mode == "poll":
+                writer.write(encode_frame(POLL))
+                await writer.drain()
+            try:
+                data = await asyncio.wait_for(reader.read(65536), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            now = time.time_ns()
+            for f in decoder.feed(data):
+                if f.type == KEY:
+                    counts[idx] += 1
+                    hist.add((now - f.ts) / 1e9)
+            if mode == "poll":
+                await asyncio.sleep(0.2)
+    finally:
+        writer.close()
+
+
+async def udp_load_follower(port, group, keys, hist, counts, idx, deadline):
+    """Datagram follower: no TCP connection at all, just a receiver joined to the server."""
+    done = asyncio.Event()
+
+    def on_frames(frames):
+        now = time.time_ns()
+        for f in frames:
+            if f.type == KEY:
+                counts[idx] += 1
+                hist.add((now - f.ts) / 1e9)
+        if counts[idx] >= keys:
+            done.set()
+
+    receiver = await open_receiver(("127.0.0.1", port), on_frames, group)
+    try:
+        await asyncio.wait_for(done.wait(), deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        receiver.close()
+
+
+async def run_load_followers(port, clients, mode, keys, timeout, channels=0):
+    hist = LatencyHistogram()
+    counts = [0] * clients
+    deadline = time.monotonic() + timeout
+    tasks = []
+    for i in range(clients):
+        if mode in ("udp", "multicast"):
+            group = UDP_BENCH_GROUP if mode == "multicast" else None
+            follower = udp_load_follower(port, group, keys, hist, counts, i, deadline)
+        else:
+            channel = f"ch{i % channels}" if channels else None
+            follower = load_follower(port, mode, keys, hist, counts, i, deadline, channel)
+        tasks.append(asyncio.create_task(follower))
+        if i % 50 == 49:
+            await asyncio.sleep(0.01)  # don't overflow the listen backlog
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {"received": sum(counts), "complete": sum(1 for c in counts if c >= keys),
+            "latency": hist.summary(), "cpu_s": time.process_time()}
+
+
+def load_followers_process(port, clients, mode, keys, timeout, results, channels=0):
+    # followers live in their own process so the server's CPU time is measured on its own
+    results.put(asyncio.run(run_load_followers(port, clients, mode, keys, timeout, channels)))
+
+
+async def bench_load(clients, mode, rate, duration, trace_memory=False, udp_copies=2):
+    """One load-test run: in-process server, fake key source, followers in a child process.
+
+    mode "udp" and "multicast" followers receive datagrams instead of holding a TCP connection.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    datagrams = mode in ("udp", "multicast")
+    srv = WowServer(capture_keys=False, udp_port=0 if datagrams else None,
+                    udp_group=UDP_BENCH_GROUP_SPEC if mode == "multicast" else None, udp_copies=udp_copies)
+    srv.port = 0
+    server = await srv.listen()
+    keys = max(1, int(rate * duration))
+
+    def connections():
+        return len(srv.udp.members) if datagrams else len(srv.clients)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    port = srv.udp_port if datagrams else srv.port
+    child = ctx.Process(target=load_followers_process,
+                        args=(port, clients, mode, keys, duration + 30.0, results), daemon=True)
+    child.start()
+    connect_deadline = time.monotonic() + 30.0
+    while connections() < clients and time.monotonic() < connect_deadline:
+        await asyncio.sleep(0.05)
+    connected = connections()
+    await asyncio.sleep(0.5)  # let poll clients subscribe / settle
+
+    def key_source():
+        # stands in for the keyboard hook thread, paced against absolute deadlines
+        start = time.perf_counter()
+        for i in range(keys):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            srv.submit_key("123456"[i % 6])
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await asyncio.to_thread(key_source)
+    followers = await asyncio.to_thread(results.get)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    await asyncio.to_thread(child.join, 5)
+
+    heap_kb = None
+    if trace_memory:
+        heap_kb = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    if srv.udp is not None:
+        srv.udp.transport.close()
+    server.close()
+    await server.wait_closed()
+    return {
+        "clients": clients,
+        "connected": connected,
+        "mode": mode,
+        "udp": srv.udp.stats() if srv.udp is not None else None,
+        "keys_sent": keys,
+        "keys_delivered": followers["received"],
+        "clients_complete": followers["complete"],
+        "delivered_per_s": round(followers["received"] / wall, 1) if wall else 0.0,
+        "latency": followers["latency"],
+        "wall_s": round(wall, 3),
+        "server_cpu_s": round(cpu, 3),
+        "server_cpu_ms_per_connection": round(1000 * cpu / max(1, connected), 3),
+        "follower_process_cpu_s": round(followers["cpu_s"], 3),
+        "server_rss_kb": max_rss_kb(),
+        "server_heap_peak_kb": heap_kb,
+    }
+
+
+async def bench_channels(channels, followers, rate, duration):
+    """One ChannelServer with `channels` fake-source channels and `followers` push followers on
+    each, the followers in a child process. Reports the server's CPU share of one core."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    hub = ChannelServer([Channel(f"ch{i}", WowServer(capture_keys=False)) for i in range(channels)], port=0)
+    channel_kb = (tracemalloc.get_traced_memory()[0] - before) / 1024 / channels
+    tracemalloc.stop()
+    server = await hub.listen()
+    keys = max(1, int(rate * duration))
+    clients = channels * followers
+
+    def connections():
+        return sum(len(c.server.clients) for c in hub.channels.values())
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    child = ctx.Process(target=load_followers_process,
+                        args=(hub.port, clients, "push", keys, duration + 30.0, results, channels), daemon=True)
+    child.start()
+    connect_deadline = time.monotonic() + 30.0
+    while connections() < clients and time.monotonic() < connect_deadline:
+        await asyncio.sleep(0.05)
+    connected = connections()
+    await asyncio.sleep(0.5)  # let the SUBSCRIBEs arrive
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    # every channel's key source runs on the server's loop, as it would with replay or fake channels
+    await asyncio.gather(*(fake_source(c.server, rate, keys, list("123456")) for c in hub.channels.values()))
+    followers_result = await asyncio.to_thread(results.get)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    await asyncio.to_thread(child.join, 5)
+    hub.stop()
+    await server.wait_closed()
+    busy = cpu / wall if wall else 0.0
+    return {
+        "channels": channels,
+        "followers_per_channel": followers,
+        "connected": connected,
+        "keys_per_channel": keys,
+        "keys_expected": keys * clients,
+        "keys_delivered": followers_result["received"],
+        "latency": followers_result["latency"],
+        "server_cpu_s": round(cpu, 3),
+        "server_core_share": round(busy, 3),
+        "server_cpu_us_per_delivery": round(1e6 * cpu / max(1, followers_result["received"]), 2),
+        "channel_kb": round(channel_kb, 1),
+        "server_rss_kb": max_rss_kb(),
+    }
+
+
+def compare_transports(clients, rate, duration, modes, udp_copies):
+    """Same load over TCP push and over datagrams, one table row per transport."""
+    rows = []
+    for mode in modes:
+        run = asyncio.run(bench_load(clients, mode, rate, duration, udp_copies=udp_copies))
+        rows.append(run)
+        lat = run["latency"]
+        print(f"{mode:9s} {run['connected']:4d} followers  delivered {run['keys_delivered']:6d}/"
+              f"{run['keys_sent'] * clients:<6d}  p50 {lat['p50_ms']:7.3f} ms  p99 {lat['p99_ms']:7.3f} ms  "
+              f"server cpu {run['server_cpu_s']:.3f} s")
+    return rows
+
+
+HERE = Path(__file__).resolve().parent
+BACKEND_MODULES = ("keyboard", "mouse", "pynput")
+IMPORT_PROBE = ("import sys, time; t = time.perf_counter(); import {module}; t = time.perf_counter() - t; "
+                "print(t, *sorted(m for m in {backends!r} if m in sys.modules))")
+
+
+def _stderr_lines(proc):
+    """Lines the process logs, read on a thread so waiting for one can time out."""
+    lines = queue.SimpleQueue()
+
+    def pump():
+        for line in proc.stderr:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=pump, daemon=True).start()
+    return lines
+
+
+def _wait_for(lines, text, deadline):
+    while True:
+        line = lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+        if line is None:
+            raise RuntimeError(f"process exited before logging {text!r}")
+        if text in line:
+            return
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_startup(runs, timeout=20.0):
+    """Fresh interpreters: import time of each module, whether an input or hook backend got loaded
+    on the way, and time from process start to the server listening / the client connected."""
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    python = [sys.executable, "-c", "pass"]
+    interpreter = []
+    imports = {m: [] for m in ("wowprotocol", "wowserver", "wowclient", "wowrecord", "wowbench")}
+    loaded = {}
+    listening, connected = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        missing = str(Path(tmp) / "none.json")
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(python, cwd=HERE, env=env, check=True)
+            interpreter.append(time.perf_counter() - start)
+            for module, times in imports.items():
+                probe = IMPORT_PROBE.format(module=module, backends=BACKEND_MODULES)
+                out = subprocess.run([sys.executable, "-c", probe], cwd=HERE, env=env, check=True,
+                                     capture_output=True, text=True).stdout.split()
+                times.append(float(out[0]))
+                loaded[module] = out[1:]
+
+            # replaying an empty key log keeps the keyboard hook out of the server
+            keys = Path(tmp) / "empty.wowkeys"
+            KeyRecorder(keys).close()
+            port = _free_port()
+            start = time.perf_counter()
+            server = subprocess.Popen([sys.executable, "-m", "wowserver", "--port", str(port), "--mode", "replay",
+                                       "--replay", str(keys), "--config", missing],
+                                      cwd=HERE, env=env, stderr=subprocess.PIPE, text=True)
+            client = None
+            try:
+                lines = _stderr_lines(server)
+                _wait_for(lines, "Serving on", start + timeout)
+                listening.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                client = subprocess.Popen([sys.executable, "-m", "wowclient", "--host", "127.0.0.1", "--port",
+                                           str(port), "--config", missing, "--no-input"],
+                                          cwd=HERE, env=env, stderr=subprocess.DEVNULL)
+                _wait_for(lines, "Connection from", start + timeout)
+                connected.append(time.perf_counter() - start)
+            finally:
+                for proc in (client, server):
+                    if proc is not None:
+                        proc.terminate()
+                        proc.wait(timeout)
+    return {
+        "runs": runs,
+        "interpreter": summarize(interpreter),
+        "import": {m: summarize(t) for m, t in imports.items()},
+        "backends_loaded": {m: b for m, b in loaded.items() if b},
+        "server_to_listening": summarize(listening),
+        "client_to_connected": summarize(connected),
+    }
+
+
+def max_rss_kb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WowServer benchmarks")
+    sub = parser.add_subparsers(dest="command")
+
+    lat = sub.add_parser("latency", help="keypress-to-receive latency, push vs poll")
+    lat.add_argument("--mode", choices=["push", "poll", "both"], default="both")
+    lat.add_argument("--keys", type=int, default=10)
+    lat.add_argument("--interval", type=float, default=1.5, help="seconds between keys")
+
+    inp = sub.add_parser("input", help="bot_loop input timing on the virtual backend (headless)")
+    inp.add_argument("--keys", type=int, default=100)
+    inp.add_argument("--windows", type=int, default=4)
+    inp.add_argument("--op-cost", type=float, default=0.001, help="modelled seconds per mouse/keyboard call")
+    inp.add_argument("--dispatch", choices=["sequential", "overlap", "low-latency"], default="sequential")
+
+    load = sub.add_parser("load", help="load test WowServer with many simulated followers, JSON results")
+    load.add_argument("--clients", default="10,50,200", help="comma separated connection counts")
+    load.add_argument("--mode", choices=["push", "poll", "udp", "multicast"], default="push")
+    load.add_argument("--rate", type=float, default=20.0, help="captured keys per second")
+    load.add_argument("--duration", type=float, default=5.0, help="seconds of key capture per run")
+    load.add_argument("--trace-memory", action="store_true", help="measure Python heap peak (slows the run)")
+    load.add_argument("--out", help="write results to this JSON file")
+
+    tr = sub.add_parser("transport", help="latency and server CPU of TCP push vs UDP unicast vs multicast")
+    tr.add_argument("--clients", type=int, default=20)
+    tr.add_argument("--rate", type=float, default=50.0, help="captured keys per second")
+    tr.add_argument("--duration", type=float, default=5.0, help="seconds of key capture per run")
+    tr.add_argument("--modes", default="push,udp,multicast", help="comma separated transports")
+    tr.add_argument("--copies", type=int, default=2, help="times each datagram is sent")
+    tr.add_argument("--out", help="write results to this JSON file")
+
+    rel = sub.add_parser("relay", help="chain of relaying clients: latency through the chain and per hop")
+    rel.add_argument("--depth", type=int, default=2, help="relays between the leader and the followers")
+    rel.add_argument("--followers", type=int, default=10)
+    rel.add_argument("--keys", type=int, default=100)
+    rel.add_argument("--interval", type=float, default=0.01, help="seconds between keys")
+
+    mac = sub.add_parser("macro", help="run one compiled macro on the virtual backend and measure its timing")
+    mac.add_argument("--windows", type=int, default=4)
+    mac.add_argument("--steps", type=int, default=4)
+    mac.add_argument("--repeat", type=int, default=2)
+    mac.add_argument("--op-cost", type=float, default=0.001, help="modelled seconds per mouse/keyboard call")
+
+    chn = sub.add_parser("channels", help="many channels in one server: CPU share of one core, latency, memory")
+    chn.add_argument("--channels", default="1,4,16,64", help="comma separated channel counts")
+    chn.add_argument("--followers", type=int, default=4, help="followers per channel")
+    chn.add_argument("--rate", type=float, default=20.0, help="keys per second per channel")
+    chn.add_argument("--duration", type=float, default=5.0, help="seconds")
+
+    st = sub.add_parser("startup", help="import time and time to listening/connected of fresh processes")
+    st.add_argument("--runs", type=int, default=5)
+
+    met = sub.add_parser("metrics", help="cost of scraping the Prometheus endpoints of a server and its followers under load")
+    met.add_argument("--followers", type=int, default=5)
+    met.add_argument("--keys", type=int, default=100)
+    met.add_argument("--scrapes", type=int, default=50)
+
+    rpl = sub.add_parser("replay", help="replay a session to followers at several speeds: pacing error, log read speed")
+    rpl.add_argument("--followers", type=int, default=10)
+    rpl.add_argument("--keys", type=int, default=200)
+    rpl.add_argument("--speeds", default="10,0", help="comma separated replay speeds, 0 = as fast as possible")
+    rpl.add_argument("--mean-interval", type=float, default=0.1, help="mean recorded seconds between keys")
+    rpl.add_argument("--read-records", type=int, default=200000, help="size of the streaming read test log")
+
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.WARNING, datefmt="%H:%M:%S")
+
+    if args.command == "replay":
+        speeds = [float(x) for x in args.speeds.split(",")]
+        result = asyncio.run(bench_replay(args.followers, args.keys, speeds, args.mean_interval,
+                                          args.read_records))
+        print(f"replay: {result}")
+        return
+
+    if args.command == "relay":
+        result = asyncio.run(bench_relay(args.depth, args.followers, args.keys, args.interval))
+        print(f"relay: {result}")
+        return
+
+    if args.command == "load":
+        runs = []
+        for n in (int(c) for c in args.clients.split(",")):
+            run = asyncio.run(bench_load(n, args.mode, args.rate, args.duration, args.trace_memory))
+            print(f"load: {json.dumps(run)}")
+            runs.append(run)
+        report = {
+            "benchmark": "load",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rate": args.rate,
+            "duration": args.duration,
+            "runs": runs,
+        }
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+        return
+
+    if args.command == "transport":
+        runs = compare_transports(args.clients, args.rate, args.duration, args.modes.split(","), args.copies)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"benchmark": "transport", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                           "python": platform.python_version(), "platform": platform.platform(),
+                           "runs": runs}, f, indent=2)
+        return
+
+    if args.command == "channels":
+        runs = []
+        for n in (int(c) for c in args.channels.split(",")):
+            result = asyncio.run(bench_channels(n, args.followers, args.rate, args.duration))
+            runs.append(result)
+            print(json.dumps(result))
+        # deliveries cost about the same whatever the channel they belong to, so scale the
+        # largest run to a full core
+        last = runs[-1]
+        if last["server_core_share"]:
+            per_core = last["keys_delivered"] / last["server_core_share"] / args.duration
+            print(f"channels: about {per_core:.0f} deliveries/s per core, i.e. "
+                  f"{per_core / args.rate / args.followers:.0f} channels of {args.followers} followers "
+                  f"at {args.rate:g} keys/s")
+        return
+
+    if args.command == "startup":
+        result = bench_startup(args.runs)
+        print(f"startup: {result}")
+        return
+
+    if args.command == "metrics":
+        result = asyncio.run(bench_metrics(args.followers, args.keys, args.scrapes))
+        print(f"metrics: {result}")
+        return
+
+    if args.command == "macro":
+        result = asyncio.run(bench_macro(args.windows, args.steps, args.repeat, args.op_cost))
+        print(f"macro: {result}")
+        return
+
+    if args.command == "input":
+        result = asyncio.run(bench_input(args.keys, args.windows, args.op_cost, args.dispatch))
+        print(f"input: {result}")
+        return
+
+    if args.command is None:
+        args = parser.parse_args(["latency"])
+    modes = ["push", "poll"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        result = asyncio.run(bench_latency(mode, args.keys, args.interval))
+        print(f"{mode:5s} keypress->receive latency: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import socket
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from wowlog import setup_logging
+from wowprotocol import FrameDecoder, HEADER, LENGTH, CHANNEL
+from wowserver import WowServer
+
+SOURCES = ("keyboard", "replay", "fake", "none")
+
+
+class Channel:
+    """One named key stream hosted by a ChannelServer.
+
+    server is a WowServer that never listens itself: it keeps the channel's history, sequence,
+    epoch, groups and followers, and gets its connections handed over by the ChannelServer.
+    source is where its keys come from:
+      "keyboard" - the shared keyboard hook, while `modifier` is held (None = no modifier held)
+      "replay"   - a key log, like WowServer's replay_path
+      "fake"     - random keys from the key set at `rate` per second (load tests)
+      "none"     - only publish_key() / submit_key() calls
+    """
+
+    def __init__(self, name: str, server: WowServer, source: str = "none", modifier: Optional[str] = None,
+                 rate: float = 1.0):
+        if source not in SOURCES:
+            raise ValueError(f"unknown key source {source!r} for channel {name!r}")
+        if source == "replay" and server.replay_path is None:
+            raise ValueError(f"channel {name!r} replays but has no log")
+        self.name = name
+        self.server = server
+        self.source = source
+        self.modifier = modifier
+        self.rate = rate
+
+
+async def fake_source(server: WowServer, rate: float, count: Optional[int] = None,
+                      keys: Optional[List[str]] = None) -> int:
+    """Publish random keys through server at `rate` per second, paced against absolute deadlines;
+    stops after count keys (None = never). Returns the number published."""
+    loop = asyncio.get_running_loop()
+    keys = sorted(keys or server.table)
+    start = loop.time()
+    published = 0
+    while count is None or published < count:
+        delay = start + published / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        server.publish_key(random.choice(keys))
+        published += 1
+    return published
+
+
+def load_channels(path: Union[str, Path]) -> List[Channel]:
+    """Read a channels file:
+
+        {"channels": {"main": {"source": "keyboard"},
+                      "alt": {"source": "keyboard", "modifier": "alt", "groups": "groups-alt.json"},
+                      "raid": {"source": "replay", "replay": "raid.wowkeys", "speed": 1},
+                      "test": {"source": "fake", "rate": 5}}}
+
+    Every channel may also set "record" (a key log path). The first channel is the default one,
+    for followers that do not name a channel.
+    """
+    data = json.loads(Path(path).read_text())
+    channels = []
+    for name, c in data.get("channels", {}).items():
+        server = WowServer(capture_keys=False, groups_path=c.get("groups"), record_path=c.get("record"),
+                           replay_path=c.get("replay"), replay_speed=float(c.get("speed", 1.0)))
+        channels.append(Channel(str(name), server, c.get("source", "none"), c.get("modifier"),
+                                float(c.get("rate", 1.0))))
+    if not channels:
+        raise ValueError(f"{path} defines no channels")
+    return channels
+
+
+class ChannelServer:
+    """Several leaders in one process: one listening socket, one keyboard hook, many channels.
+
+    A follower names its channel in a CHANNEL frame before anything else; one that does not
+    (an older client) gets the first channel. Everything per channel lives in that channel's
+    WowServer, so a channel costs one small object graph and no thread, socket or process.
+    """
+
+    def __init__(self, channels: List[Channel], host: str = "0.0.0.0", port: int = 5000,
+                 link_timeout: float = 3.0):
+        if not channels:
+            raise ValueError("a ChannelServer needs at least one channel")
+        self.channels: Dict[str, Channel] = {c.name: c for c in channels}
+        self.default = channels[0]
+        self.host = host
+        self.port = port
+        self.link_timeout = link_timeout
+        self.running = True
+        # keyboard layers: modifier -> channel; the channel without a modifier gets the rest
+        self._layers = [(c.modifier, c) for c in channels if c.source == "keyboard" and c.modifier]
+        self._base = next((c for c in channels if c.source == "keyboard" and not c.modifier), None)
+        self._held: Dict[str, bool] = {}  # modifier -> down, written by the hook thread only
+        self._down: Dict[str, Channel] = {}  # key -> channel that got its key-down, for the key-up
+        self._server = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop = None
+        self._stop_requested = False
+
+    def on_key_event(self, event):
+        # keyboard hook thread: pick the layer, then the channel's own capture stage takes over
+        name = event.name
+        down = event.event_type == "down"
+        if any(name == mod for mod, _ in self._layers):
+            self._held[name] = down
+            return
+        if down:
+            channel = next((c for mod, c in self._layers if self._held.get(mod)), self._base)
+            if channel is None:
+                return
+            self._down[name] = channel
+        else:
+            channel = self._down.pop(name, None)
+            if channel is None:
+                return
+        channel.server.on_key_event(event)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # read exactly the first frame, so nothing meant for the channel is consumed here
+        try:
+            head = await asyncio.wait_for(reader.readexactly(LENGTH.size), self.link_timeout)
+            body = await asyncio.wait_for(reader.readexactly(LENGTH.unpack(head)[0]), self.link_timeout)
+            frame = FrameDecoder().feed(head + body)[0] if len(body) >= HEADER.size else None
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.info("Client %s left before choosing a channel: %s", writer.get_extra_info("peername"), e)
+            writer.close()
+            return
+        if frame is not None and frame.type == CHANNEL:
+            name = frame.payload.decode("utf-8", "replace")
+            channel, initial = self.channels.get(name), b""
+        else:
+            name, channel, initial = self.default.name, self.default, head + body
+        if channel is None:
+            logging.warning("Client %s asked for unknown channel %r", writer.get_extra_info("peername"), name)
+            writer.close()
+            return
+        await channel.server.handle_client(reader, writer, initial)
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {name: {"source": c.source, "clients": len(c.server.clients), "published": c.server.published}
+                for name, c in self.channels.items()}
+
+    def stop(self):
+        """Close the socket and every follower connection of every channel. Loop thread only."""
+        self.running = False
+        if self._server is not None:
+            self._server.close()
+        for c in self.channels.values():
+            c.server.stop()
+
+    def stop_threadsafe(self):
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.stop)
+
+    async def listen(self):
+        self._loop = asyncio.get_running_loop()
+        if self._stop_requested:
+            self.running = False
+        for c in self.channels.values():
+            c.server.prepare()
+            if c.source == "replay":
+                self._tasks.append(asyncio.create_task(c.server.run_replay()))
+            elif c.source == "fake":
+                self._tasks.append(asyncio.create_task(fake_source(c.server, c.rate)))
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port, family=socket.AF_INET)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Serving %d channel(s) on %s:%d: %s", len(self.channels), self.host, self.port,
+                     ", ".join(f"{n} ({c.source}{'+' + c.modifier if c.modifier else ''})"
+                               for n, c in self.channels.items()))
+        return self._server
+
+    async def start(self):
+        hook = None
+        if self._base is not None or self._layers:
+            import keyboard
+            hook = keyboard.hook(self.on_key_event)
+        server = await self.listen()
+        try:
+            async with server:
+                if self.running:
+                    await server.serve_forever()
+        except asyncio.CancelledError:
+            if self.running:
+                raise
+        finally:
+            for t in self._tasks:
+                t.cancel()
+            for c in self.channels.values():
+                if c.server.recorder is not None:
+                    c.server.recorder.close()
+            if hook is not None:
+                keyboard.unhook(hook)
+            self._server = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Several WoW leaders (channels) in one server process")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--config", default="channels.json", help="channels file")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+
+    setup_logging(logging.DEBUG if args.debug else logging.INFO)
+    hub = ChannelServer(load_channels(args.config), args.host, args.port)
+    try:
+        asyncio.run(hub.start())
+    except KeyboardInterrupt:
+        logging.info("Server shutting down")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
 # ...existing code...
+import argparse
 import asyncio
 import json
 import logging
+import random
+import time
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import Callable, List, Dict, Optional, Tuple, Union
 
-import mouse
-from pynput import keyboard as pynput_keyboard
+from wowlog import log_every, setup_logging
+from wowinput import (InputBackend, InputPlan, InputWorker, MacroProgram, NullInputBackend, RealInputBackend,
+                      WindowTimings, LOW_LATENCY_TIMINGS)
+from wowmetrics import LatencyHistogram, LinkHealth, LoopLag, MetricsText, serve_metrics
+from wowprotocol import (FrameDecoder, encode_frame, encode_report, CHANNEL, EPOCH, GROUPS, JOIN, KEY, LINK, PING,
+                         POLL, PONG, STAMPS, SUBSCRIBE, WELCOME)
+from wowserver import WowServer
+from wowudp import UdpReceiver, open_receiver, parse_group
 
 
+DEFAULT_HOST = "127.0.0.1"
+
 DEFAULT_POSITIONS = [
     {"x": 430, "y": 13},
     {"x": 1683, "y": 13},
@@ -17,149 +29,585 @@ DEFAULT_POSITIONS = [
 ]
 
 
+class WindowLayout:
+    """One validated windows.json, fully compiled and never changed afterwards.
+
+    Everything bot_loop needs per key is built here once per config version: the window list,
+    the multi-window InputPlan and every macro's batch. A reload builds a whole new layout and
+    swaps it in with one attribute assignment, so bot_loop reads `client.layout` once per key
+    and never sees a half-applied edit or takes a lock.
+    """
+
+    def __init__(self, windows=(), timings: Optional[WindowTimings] = None, dispatch: str = "sequential",
+                 macros: Optional[Dict[str, MacroProgram]] = None, groups: Optional[List[str]] = None,
+                 version: int = 0):
+        self.windows: Tuple[Dict[str, int], ...] = tuple(windows)
+        self.timings = timings if timings is not None else WindowTimings()
+        self.dispatch = dispatch
+        self.macros = dict(macros or {})
+        self.groups = groups
+        self.version = version
+        self.loaded_at = time.time()
+        overlap = dispatch == "overlap"
+        entries = [(w["x"], w["y"], self.timings.with_overrides(w.get("timings", {}))) for w in self.windows]
+        self.plan = InputPlan(entries, overlap=overlap) if entries else None
+        # trigger -> compiled batch
+        self.macro_ops = {trigger: m.compile(entries, self.timings, overlap=overlap)
+                          for trigger, m in self.macros.items()}
+
+
 class WowClient:
-    def __init__(self, host: str = "26.23.110.199", port: int = 5000, cfg_path: Union[str, Path] = "windows.json"):
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 5000, cfg_path: Union[str, Path] = "windows.json",
+                 mode: str = "push", backend: Optional[InputBackend] = None, udp_port: int = 5001,
+                 udp_group: Optional[str] = None, relay_port: Optional[int] = None,
+                 groups: Optional[List[str]] = None, metrics_port: Optional[int] = None,
+                 metrics_host: str = "127.0.0.1", channel: Optional[str] = None,
+                 heartbeat_interval: float = 1.0, link_timeout: float = 3.0):
         self.host = host
         self.port = port
+        # channel to follow on a multi-channel server (wowchannels.py); None = its default channel
+        self.channel = channel
+        # "push": server streams keys as they are captured; "poll": legacy request/response every 200 ms;
+        # "udp": keys arrive as datagrams on udp_port (or the multicast udp_group), TCP only carries
+        # heartbeats and reports, and the client falls back to "push" if the datagrams stop
+        self.mode = mode
+        self.udp_port = udp_port
+        self.udp_group = parse_group(udp_group) if udp_group else None
+        self._udp: Optional[UdpReceiver] = None
         self._writer = None
         self.cfg_path = Path(cfg_path)
-        self.windows: List[Dict[str, int]] = self.load_windows()
-        self.key = "."
-        self.kb = pynput_keyboard.Controller()
+        # windows.json is polled every config_interval seconds and a changed file is swapped in
+        # as a new layout; a file that does not load keeps the last good one
+        self.config_interval = 1.0
+        self._config_stamp = None  # (mtime ns, size) of the file the current layout came from
+        self.reloads = 0
+        self.reload_errors = 0
+        self.reload_ms = 0.0
+        # follower group tags (healer, tank, ...): the server only sends keys routed to them.
+        # Taken from windows.json "groups" unless given here.
+        self._fixed_groups = bool(groups)
+        self.groups = list(groups) if groups else None
+        self.route_keys = None  # keys the server routes to our groups, None = all
+        self.filtered = 0
+        self.layout = self.load_windows()
+        if not self._fixed_groups:
+            self.groups = self.layout.groups
+        self.key = "."  # last key received, for display
+        # all mouse/keyboard calls go through the backend, as batches on the worker thread. The
+        # real one (mouse, pynput) is only created by run(), so nothing else has to import them.
+        self.backend = backend
+        self.worker = InputWorker(backend)
         self.running = True
-        self._lock = asyncio.Lock()
+        # received keys waiting for bot_loop; created in run() so it binds to the right loop
+        self.inputs: Optional[asyncio.Queue] = None
+        self.key_interval = 0.05  # minimum spacing between the starts of two key sequences
+        self.queue_peak = 0
+        self.presses = 0
+        self.lateness = deque(maxlen=256)  # seconds each key sequence started after its target time
+        # highest server sequence number seen, kept across reconnects so the server can replay
+        # what we missed; only valid while the server's epoch stays the same
+        self._last_seq = 0
+        self._epoch = None
+        self.duplicates = 0
+        self.missing = 0
+        # reconnect: jittered exponential backoff from backoff_min up to backoff_max seconds
+        self.backoff_min = 0.02
+        self.backoff_max = 2.0
+        self._attempt = 0
+        self.reconnects = 0
+        # heartbeat: a PING every heartbeat_interval; nothing heard for link_timeout means the link is dead
+        self.heartbeat_interval = heartbeat_interval
+        self.link_timeout = link_timeout
+        self.link = LinkHealth()
+        # relay mode: downstream followers connect to us on relay_port and get every key we
+        # receive forwarded unchanged (same seq and leader timestamp), so machines can form a tree
+        self.relay_port = relay_port
+        self.relay: Optional[WowServer] = None
+        self._relay_server = None
+        self.hop = LatencyHistogram()  # seconds from receiving a key to having forwarded it
+        # optional Prometheus endpoint (http://metrics_host:metrics_port/metrics) on the client's loop
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.received = 0
+        self.batch_durations = LatencyHistogram()  # seconds each input batch took on the worker
+        self.loop_lag = LoopLag()
+        # called on the loop thread as on_event(kind, value): ("connected", "host:port"),
+        # ("disconnected", None) and ("key", key). A GUI passes something thread-safe, like a queue's put.
+        self.on_event: Optional[Callable[[str, object], None]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop = None
+        self._stop_requested = False  # stop_threadsafe() came before run() was ready for it
+
+    # the current layout's settings, for display and single-key callers
+    @property
+    def windows(self) -> Tuple[Dict[str, int], ...]:
+        return self.layout.windows
 
-    def load_windows(self) -> List[Dict[str, int]]:
+    @property
+    def timings(self) -> WindowTimings:
+        return self.layout.timings
+
+    @property
+    def dispatch(self) -> str:
+        return self.layout.dispatch
+
+    @property
+    def macros(self) -> Dict[str, MacroProgram]:
+        return self.layout.macros
+
+    def load_windows(self) -> WindowLayout:
+        """Layout at startup; single window mode when windows.json is missing or unusable."""
         try:
-            if not self.cfg_path.exists():
+            self._config_stamp = self._stat_config()
+            if self._config_stamp is None:
                 logging.info("No windows.json found - running in single window mode")
-                return []
-                
-            data = json.loads(self.cfg_path.read_text())
-            wins = data.get("windows", [])
-            
-            # validate entries - need at least 2 valid windows
+                return WindowLayout()
+            return self.read_layout(version=1)
+        except Exception as e:
+            logging.info(f"Error reading windows config: {e} - running in single window mode")
+            return WindowLayout()
+
+    def read_layout(self, version: int) -> WindowLayout:
+        """Parse, validate and compile windows.json; raises if the file cannot be used at all."""
+        data = json.loads(self.cfg_path.read_text())
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        wins = data.get("windows", [])
+        if not isinstance(wins, list):
+            raise ValueError('"windows" must be a list')
+        groups = None
+        if isinstance(data.get("groups"), list):
+            groups = [str(g) for g in data["groups"]] or None
+        macros = self.load_macros(data.get("macros", {}))
+
+        # multi-window dispatch: default timings ("timings") and whether the mouse may move on
+        # to the next window while a key is still held ("dispatch": "overlap")
+        dispatch = data.get("dispatch", "sequential")
+        if dispatch == "low-latency":
+            timings = LOW_LATENCY_TIMINGS.with_overrides(data.get("timings", {}))
+            dispatch = "overlap"
+        elif dispatch in ("sequential", "overlap"):
+            timings = WindowTimings().with_overrides(data.get("timings", {}))
+        else:
+            logging.info(f"Unknown dispatch mode {dispatch!r} - using sequential")
+            timings, dispatch = WindowTimings(), "sequential"
+
+        # validate entries - need at least 2 valid windows
+        validated = []
+        for w in wins:
+            if isinstance(w, dict) and "x" in w and "y" in w:
+                entry = {"x": int(w["x"]), "y": int(w["y"])}
+                if isinstance(w.get("timings"), dict):
+                    # per-window overrides of the default timings
+                    entry["timings"] = {k: float(v) for k, v in w["timings"].items() if k in WindowTimings.FIELDS}
+                validated.append(entry)
+
+        if len(validated) < 2:
+            logging.info("Less than 2 valid windows found - running in single window mode")
             validated = []
-            for w in wins:
-                if isinstance(w, dict) and "x" in w and "y" in w:
-                    validated.append({"x": int(w["x"]), "y": int(w["y"])})
-            
-            if len(validated) < 2:
-                logging.info("Less than 2 valid windows found - running in single window mode")
-                return []
-                
+        else:
             logging.info(f"Found {len(validated)} valid windows - running in multi-window mode")
-            return validated
-            
+
+        layout = WindowLayout(validated, timings, dispatch, macros, groups, version)
+        if layout.plan is not None:
+            logging.info("Built %s input plan for %d windows: %.0f ms spread, %.0f ms total", dispatch,
+                         len(validated), layout.plan.spread * 1000, layout.plan.duration * 1000)
+        for trigger, ops in layout.macro_ops.items():
+            logging.info("Compiled macro %s: %d operations", layout.macros[trigger].name, len(ops))
+        return layout
+
+    def _stat_config(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.cfg_path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size) if self.cfg_path.is_file() else None
+
+    def check_config(self) -> bool:
+        """Swap in a new layout if windows.json changed since the last look; True if one was swapped in.
+
+        A file that fails to parse or validate, or that disappeared, keeps the current layout;
+        it is tried again once it changes.
+        """
+        stamp = self._stat_config()
+        if stamp == self._config_stamp:
+            return False
+        self._config_stamp = stamp
+        current = self.layout
+        if stamp is None:
+            logging.warning("%s is gone - keeping layout version %d", self.cfg_path, current.version)
+            return False
+        start = time.perf_counter()
+        try:
+            layout = self.read_layout(current.version + 1)
         except Exception as e:
-            logging.info(f"Error reading windows config: {e} - running in single window mode")
-            return []
+            self.reload_errors += 1
+            logging.warning("Ignoring bad %s (%s) - keeping layout version %d", self.cfg_path, e, current.version)
+            return False
+        self.reload_ms = 1000 * (time.perf_counter() - start)
+        self.layout = layout
+        self.reloads += 1
+        logging.info("Reloaded %s as layout version %d in %.1f ms", self.cfg_path, layout.version, self.reload_ms)
+        if not self._fixed_groups and layout.groups != self.groups:
+            self.groups = layout.groups
+            writer = self._writer
+            if writer is not None and not writer.is_closing():
+                # an empty tag list puts us back on every key
+                writer.write(encode_frame(GROUPS, payload=",".join(self.groups or ()).encode("utf-8")))
+        return True
+
+    async def config_loop(self):
+        while self.running:
+            await asyncio.sleep(self.config_interval)
+            self.check_config()
+
+    def layout_stats(self) -> Dict[str, float]:
+        layout = self.layout
+        return {
+            "layout_version": layout.version,
+            "layout_windows": len(layout.windows),
+            "layout_loaded_at": round(layout.loaded_at, 3),
+            "reload_ms": round(self.reload_ms, 3),
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+    def load_macros(self, config: Dict[str, dict]) -> Dict[str, MacroProgram]:
+        macros = {}
+        for name, m in config.items():
+            try:
+                window_timings = {int(i): {k: float(v) for k, v in t.items() if k in WindowTimings.FIELDS}
+                                  for i, t in m.get("windows", {}).items()}
+                timings = {k: float(v) for k, v in m.get("timings", {}).items() if k in WindowTimings.FIELDS}
+                macro = MacroProgram(name, m["steps"], m.get("repeat", 1), m.get("every", 0.0),
+                                     timings, window_timings)
+                macros[str(m["trigger"])] = macro
+            except Exception as e:
+                logging.info(f"Skipping macro {name!r}: {e}")
+        if macros:
+            logging.info(f"Loaded {len(macros)} macro(s): {', '.join(m.name for m in macros.values())}")
+        return macros
+
+    async def _sleep_until(self, deadline: float) -> float:
+        """Sleep until loop.time() reaches deadline; returns how late we woke up."""
+        loop = asyncio.get_running_loop()
+        delay = deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return loop.time() - deadline
+
+    def key_ops(self, key: str, timings: Optional[WindowTimings] = None) -> list:
+        # More forceful press-release with longer duration
+        hold = (timings or self.timings).key_hold
+        return [("press", key), ("wait", hold), ("release", key)]
+
+    def click_ops(self, x: int, y: int) -> list:
+        return [("move", x, y), ("wait", self.timings.move_settle), ("click",), ("wait", self.timings.click_settle)]
 
     async def press_key(self, key: str):
-        logging.info(f"Pressing key: {key}")
+        logging.debug("Pressing key: %s", key)
         try:
-            # More forceful press-release with longer duration
-            kb = self.kb
-            await asyncio.to_thread(kb.press, key)
-            await asyncio.sleep(0.05)  # Hold longer
-            await asyncio.to_thread(kb.release, key)
+            await self.worker.run_batch(self.key_ops(key))
             
             # Verify the press happened
-            logging.info(f"Key {key} pressed and released")
+            logging.debug("Key %s pressed and released", key)
             return True
         except Exception as e:
-            logging.error(f"Key press failed for {key}: {e}")
+            logging.error("Key press failed for %s: %s", key, e)
             return False
 
     async def click_at(self, x: int, y: int):
-        # wrap mouse operations in thread to avoid blocking event loop
-        await asyncio.to_thread(lambda: mouse.move(x, y, absolute=True, duration=0.002))
-        await asyncio.sleep(0.07)
-        await asyncio.to_thread(mouse.click)
-        await asyncio.sleep(0.07)
+        await self.worker.run_batch(self.click_ops(x, y))
+
+    def input_stats(self) -> Dict[str, float]:
+        late = list(self.lateness)
+        return {
+            "queue_depth": self.inputs.qsize() if self.inputs else 0,
+            "queue_peak": self.queue_peak,
+            "presses": self.presses,
+            "late_ms_mean": round(1000 * sum(late) / len(late), 3) if late else 0.0,
+            "late_ms_max": round(1000 * max(late), 3) if late else 0.0,
+            **self.worker.stats(),
+            **self.layout_stats(),
+        }
 
     async def bot_loop(self):
         """
-        Consume whatever was last written into self.key (may be a chunk like "1" or "111").
-        For each character in that string (except '.'), perform exactly one press sequence.
-        After reading the value we immediately clear self.key to "." under the same lock so
-        the client will only act once per server request; if the server sends the same key
-        again later it will be processed again.
+        Take received keys from self.inputs in order and perform one press sequence for each.
+        The whole sequence (every window's click and key press) is built as one batch and run
+        by the input worker in a single handoff. Each sequence's target is the later of when
+        the key arrived and key_interval after the previous target, scheduled against
+        loop.time(); how late it actually started is kept in self.lateness.
         """
+        loop = asyncio.get_running_loop()
+        target = 0.0
         try:
             while self.running:
-                # grab and clear the latest server payload atomically
-                async with self._lock:
-                    key_chunk = self.key
-                    self.key = "."
-
-                    # snapshot windows so clicks use a stable list
-                    windows = list(self.windows)
-
-                if not key_chunk:
-                    await asyncio.sleep(0.05)
-                    continue
-
-                # process each character received in the chunk
-                for ch in key_chunk:
-                    if ch == ".":
-                        # server idle marker — ignore
-                        continue
-
-                    # perform one press for this request (single or multi-window mode)
-                    if not windows:
-                        logging.info(f"Single window - Processing requested key: {ch}")
-                        await self.press_key(ch)
-                    else:
-                        logging.info(f"Multi-window - Processing requested key: {ch} for {len(windows)} windows")
-                        for pos in windows:
-                            await self.click_at(pos["x"], pos["y"])
-                            await asyncio.sleep(0.02)
-                            await self.press_key(ch)
-                            await asyncio.sleep(0.02)
-
-                # small pause to yield and avoid busy loop
-                await asyncio.sleep(0.05)
+                ch, received, seq, received_ns = await self.inputs.get()
+
+                # one read per key: a reload swaps in a whole new layout, never edits this one
+                layout = self.layout
+                windows = layout.windows
+
+                target = max(received, target + self.key_interval)
+                late = await self._sleep_until(target)
+                scheduled_ns = time.time_ns()
+                self.lateness.append(late)
+                self.presses += 1
+                logging.debug("Key %s started %.1f ms late, %d queued", ch, late * 1000, self.inputs.qsize())
+
+                # perform one press for this request (single or multi-window mode), or run the
+                # whole macro program bound to this key
+                if ch in layout.macro_ops:
+                    logging.debug("Running macro %s for key: %s", layout.macros[ch].name, ch)
+                    batch = layout.macro_ops[ch]
+                elif not windows:
+                    logging.debug("Single window - Processing requested key: %s", ch)
+                    batch = self.key_ops(ch, layout.timings)
+                else:
+                    logging.debug("Multi-window - Processing requested key: %s for %d windows", ch, len(windows))
+                    batch = layout.plan.ops(ch)
+                try:
+                    result = await self.worker.run_batch(batch)
+                    self.batch_durations.add(result.elapsed)
+                    if logging.getLogger().isEnabledFor(logging.DEBUG):
+                        logging.debug("Key %s: batch took %.1f ms (%.1f ms per window), %.1f ms first-to-last window",
+                                      ch, result.elapsed * 1000, result.elapsed * 1000 / max(1, len(windows)),
+                                      self.worker.stats()["spread_ms_last"])
+                    self._report(seq, receive=received_ns, schedule=scheduled_ns,
+                                 click=result.click_ns, press=result.press_ns)
+                except Exception as e:
+                    logging.error("Key press failed for %s: %s", ch, e)
+                # the next key can't start before this one finished
+                target = max(target, loop.time() - self.key_interval)
         except asyncio.CancelledError:
             logging.debug("bot_loop cancelled")
             raise
 
+    def _report(self, seq: int, **stamps):
+        """Send this key's follower-side stage timestamps back to the server."""
+        writer = self._writer
+        if writer is not None and seq and not writer.is_closing():
+            writer.write(encode_report(seq, stamps))
+
+    def _accept_frames(self, frames):
+        received_ns = time.time_ns()
+        keys = []
+        for frame in frames:
+            if frame.type == WELCOME:
+                self._attempt = 0  # the link works, next loss starts backing off from the bottom
+                (epoch,) = EPOCH.unpack_from(frame.payload)
+                if self.relay is not None:
+                    self.relay.adopt_epoch(epoch, frame.seq)
+                if epoch != self._epoch:
+                    # new server run: its sequence numbers have nothing to do with ours, and
+                    # keys before this WELCOME were captured before we joined
+                    self._epoch = epoch
+                    self._last_seq = frame.seq
+                continue
+            if frame.type == GROUPS:
+                routed = frame.payload.decode("utf-8", "replace")
+                self.route_keys = set(routed.split(",")) if routed else None
+                continue
+            if frame.type == PONG:
+                t1, t2 = STAMPS.unpack_from(frame.payload)
+                self.link.add_sample(frame.ts, t1, t2, received_ns)
+                continue
+            if frame.type != KEY:
+                continue
+            if frame.seq <= self._last_seq:
+                # already pressed this one
+                self.duplicates += 1
+                continue
+            # with groups, keys routed to other groups leave gaps on purpose
+            if self._last_seq and frame.seq > self._last_seq + 1 and not self.groups:
+                self.missing += frame.seq - self._last_seq - 1
+                log_every(1.0, "missed", logging.INFO, "Missed %d key(s) before seq %d",
+                          frame.seq - self._last_seq - 1, frame.seq)
+            self._last_seq = frame.seq
+            if self.relay is not None:
+                # encoding is deterministic, so this is byte for byte the frame we received
+                raw = encode_frame(KEY, frame.seq, frame.key, frame.ts, frame.payload)
+                self.relay.relay_key(frame.seq, frame.key, raw, received_ns)
+                self.hop.add((time.time_ns() - received_ns) / 1e9)
+            if self.route_keys is not None and frame.key not in self.route_keys:
+                # not for our groups; only datagrams to a whole multicast group get here
+                self.filtered += 1
+                continue
+            keys.append((frame.key, frame.seq))
+        if keys:
+            self.received += len(keys)
+            received = asyncio.get_running_loop().time()
+            for key, seq in keys:
+                # queued, never overwritten, so keys arriving while bot_loop is busy are kept
+                self.inputs.put_nowait((key, received, seq, received_ns))
+            self.key = keys[-1][0]
+            if self.on_event is not None:
+                self.on_event("key", self.key)
+            self.queue_peak = max(self.queue_peak, self.inputs.qsize())
+            log_every(1.0, "keys", logging.INFO, "Server Asked To Spam Key: ( %s )", "".join(k for k, _ in keys))
+
+    def metrics_text(self) -> str:
+        """Prometheus text for this follower; built on the loop thread per request."""
+        m = MetricsText("wowclient_")
+        m.gauge("connected", "1 while the TCP link to the server is up", int(self._writer is not None))
+        m.counter("reconnects_total", "Reconnects to the server", self.reconnects)
+        m.counter("keys_received_total", "Keys accepted for pressing", self.received)
+        m.counter("keys_duplicate_total", "Keys received more than once and ignored", self.duplicates)
+        m.counter("keys_missing_total", "Keys lost on the way (sequence gaps)", self.missing)
+        m.counter("keys_filtered_total", "Keys not routed to our groups", self.filtered)
+        m.counter("presses_total", "Key sequences started", self.presses)
+        m.gauge("input_queue_depth", "Keys waiting for bot_loop", self.inputs.qsize() if self.inputs else 0)
+        m.gauge("input_queue_peak", "Most keys ever waiting for bot_loop", self.queue_peak)
+        m.summary("input_batch_seconds", "How long one key's input batch took on the worker", self.batch_durations)
+        late = list(self.lateness)
+        m.gauge("schedule_late_seconds", "How late the latest key sequence started", late[-1] if late else 0.0)
+        m.gauge("link_rtt_seconds", "Smoothed heartbeat round trip", self.link.rtt_ns / 1e9)
+        m.gauge("link_jitter_seconds", "Heartbeat round trip jitter", self.link.jitter_ns / 1e9)
+        m.gauge("clock_offset_seconds", "Follower clock minus leader clock", self.link.offset_ns / 1e9)
+        m.gauge("layout_version", "Version of the active windows.json layout", self.layout.version)
+        m.gauge("layout_windows", "Windows in the active layout", len(self.layout.windows))
+        m.counter("layout_reloads_total", "windows.json edits applied", self.reloads)
+        m.counter("layout_reload_errors_total", "windows.json edits rejected", self.reload_errors)
+        if self._udp is not None:
+            udp = self._udp.stats()
+            m.counter("udp_nacks_total", "Resend requests sent", udp["nacks"])
+            m.counter("udp_duplicates_total", "Duplicate datagrams", udp["duplicates"])
+            m.counter("udp_missing_total", "Keys given up on", udp["missing"])
+        if self.relay is not None:
+            m.gauge("relay_followers", "Downstream followers of this relay", len(self.relay.clients))
+            m.summary("relay_hop_seconds", "Receive to forwarded", self.hop)
+        m.summary("loop_lag_seconds", "How late the event loop runs a timer", self.loop_lag.hist)
+        return m.render()
+
+    def relay_stats(self) -> Dict[str, object]:
+        """Downstream followers, the time this hop adds, and the link to our upstream."""
+        if self.relay is None:
+            return {}
+        return {
+            "followers": len(self.relay.clients),
+            "forwarded": self.hop.count,
+            "hop": self.hop.summary(),
+            "upstream_rtt_ms": round(self.link.rtt_ns / 1e6, 3),
+            "downstream": self.relay.latency_summary(["total"]),
+        }
+
+    async def start_relay(self):
+        relay = WowServer(capture_keys=False)
+        relay.port = self.relay_port
+        self._relay_server = await relay.listen()
+        self.relay_port = relay.port
+        self.relay = relay
+        if self._epoch is not None:
+            relay.adopt_epoch(self._epoch, self._last_seq)
+
+    async def stop_relay(self):
+        if self._relay_server is not None:
+            server, relay = self._relay_server, self.relay
+            self._relay_server = self.relay = None
+            server.close()
+            for state in list(relay.clients.values()):
+                state.writer.close()
+            await server.wait_closed()
+
+    def _hello(self, msg_type: int) -> bytes:
+        """First SUBSCRIBE/POLL of a connection; asks for a replay if we have been connected before."""
+        if self._epoch is None:
+            return encode_frame(msg_type)
+        return encode_frame(msg_type, self._last_seq, payload=EPOCH.pack(self._epoch))
+
+    def _next_backoff(self) -> float:
+        delay = min(self.backoff_max, self.backoff_min * 2 ** self._attempt)
+        self._attempt += 1
+        # "equal jitter": half fixed, half random, so reconnecting followers don't stampede
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def heartbeat_loop(self, writer: asyncio.StreamWriter):
+        while self.running and not writer.is_closing():
+            # our current estimates ride along so the server sees the same link health
+            payload = LINK.pack(int(self.link.rtt_ns), self.link.offset_ns, int(self.link.jitter_ns))
+            writer.write(encode_frame(PING, ts=time.time_ns(), payload=payload))
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _read(self, reader: asyncio.StreamReader) -> bytes:
+        try:
+            return await asyncio.wait_for(reader.read(1024), self.link_timeout)
+        except asyncio.TimeoutError:
+            logging.info("Nothing heard from server for %.1f s - link is dead", self.link_timeout)
+            return b""
+
+    async def push_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, decoder: FrameDecoder):
+        writer.write(self._hello(SUBSCRIBE))
+        await writer.drain()
+        while self.running:
+            try:
+                data = await self._read(reader)
+            except (ConnectionResetError, BrokenPipeError):
+                logging.info("Connection lost, retrying...")
+                return
+            if not data:
+                logging.info("Server closed connection")
+                return
+            self._accept_frames(decoder.feed(data))
+
+    async def datagram_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            decoder: FrameDecoder):
+        if self._udp is None:
+            # kept across TCP reconnects, so datagrams keep flowing while the control link recovers
+            self._udp = await open_receiver((self.host, self.udp_port), self._accept_frames, self.udp_group)
+        writer.write(encode_frame(JOIN))
+        await writer.drain()
+        while self.running:
+            try:
+                data = await self._read(reader)
+            except (ConnectionResetError, BrokenPipeError):
+                logging.info("Connection lost, retrying...")
+                return
+            if not data:
+                logging.info("Server closed connection")
+                return
+            self._accept_frames(decoder.feed(data))
+            if self._udp.silent_for() > self.link_timeout:
+                # UDP blocked or the server has no datagram port: resume over TCP instead
+                logging.warning("No datagrams from server for %.1f s - falling back to TCP push", self.link_timeout)
+                self._close_udp()
+                self.mode = "push"
+                return
+
+    def _close_udp(self):
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+
     async def network_loop(self):
         while self.running:
-            reader = writer = None
+            reader = writer = heartbeat = None
             try:
                 reader, writer = await asyncio.open_connection(self.host, self.port)
                 self._writer = writer
                 logging.info("Connected to server %s:%s", self.host, self.port)
-                message = "Check Server Alive"
-
-                while self.running:
-                    try:
-                        writer.write(message.encode())
-                        await writer.drain()
-                        data = await reader.read(1024)
-                        if not data:
-                            logging.info("Server closed connection")
-                            break
-                        resp = data.decode().strip()
-                        if resp:
-                            async with self._lock:
-                                self.key = resp
-                            logging.info("Server Asked To Spam Key: ( %s )", resp)
-                        await asyncio.sleep(0.2)
-                    except (ConnectionResetError, BrokenPipeError):
-                        logging.info("Connection lost, retrying...")
-                        break
-                    except asyncio.CancelledError:
-                        # make sure we propagate cancellation so run() can handle shutdown
-                        raise
+                if self.on_event is not None:
+                    self.on_event("connected", f"{self.host}:{self.port}")
+                if self.channel:
+                    # must be the first frame on the connection
+                    writer.write(encode_frame(CHANNEL, payload=self.channel.encode("utf-8")))
+                heartbeat = asyncio.create_task(self.heartbeat_loop(writer))
+                if self.groups:
+                    writer.write(encode_frame(GROUPS, payload=",".join(self.groups).encode("utf-8")))
+                decoder = FrameDecoder()
+                if self.mode == "push":
+                    await self.push_loop(reader, writer, decoder)
+                elif self.mode == "udp":
+                    await self.datagram_loop(reader, writer, decoder)
+                else:
+                    await self.poll_loop(reader, writer, decoder)
             except asyncio.CancelledError:
                 raise
             except Exception as e:
                 logging.error("Failed to connect: %s", e)
-                await asyncio.sleep(2)
-                continue
             finally:
+                if heartbeat is not None:
+                    heartbeat.cancel()
                 # always close writer/transport while the loop is still running
                 if writer is not None:
                     try:
@@ -170,11 +618,69 @@ class WowClient:
                     finally:
                         if self._writer is writer:
                             self._writer = None
+                        if self.on_event is not None:
+                            self.on_event("disconnected", None)
+            if self.running:
+                delay = self._next_backoff()
+                self.reconnects += 1
+                logging.info("Reconnecting in %.0f ms", delay * 1000)
+                await asyncio.sleep(delay)
+
+    async def poll_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, decoder: FrameDecoder):
+        message = self._hello(POLL)
+
+        while self.running:
+            try:
+                writer.write(message)
+                message = encode_frame(POLL)
+                await writer.drain()
+                data = await self._read(reader)
+                if not data:
+                    logging.info("Server closed connection")
+                    break
+                self._accept_frames(decoder.feed(data))
+                await asyncio.sleep(0.2)
+            except (ConnectionResetError, BrokenPipeError):
+                logging.info("Connection lost, retrying...")
+                break
+            except asyncio.CancelledError:
+                # make sure we propagate cancellation so run() can handle shutdown
+                raise
+
+    def stop(self):
+        """End run(): cancels its tasks, which closes the connection and stops the worker. Loop thread only."""
+        self.running = False
+        for t in self._tasks:
+            t.cancel()
+
+    def stop_threadsafe(self):
+        """stop() from any other thread (a GUI); returns at once, run() finishes shortly after.
+        Also works before run() has bound the loop or created its tasks: run() sees the request."""
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.stop)
 
     async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self.inputs = asyncio.Queue()
+        if self.backend is None:
+            self.backend = self.worker.backend = RealInputBackend()
+        self.worker.start()
+        if self.relay_port is not None:
+            await self.start_relay()
+        metrics = None
         bot = asyncio.create_task(self.bot_loop())
         net = asyncio.create_task(self.network_loop())
-        tasks = [bot, net]
+        config = asyncio.create_task(self.config_loop())
+        tasks = [bot, net, config]
+        if self.metrics_port is not None:
+            metrics = await serve_metrics(self.metrics_text, self.metrics_port, self.metrics_host)
+            self.metrics_port = metrics.sockets[0].getsockname()[1]
+            tasks.append(asyncio.create_task(self.loop_lag.run()))
+        self._tasks = tasks
+        if self._stop_requested:
+            self.stop()
         try:
             await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
         except asyncio.CancelledError:
@@ -189,6 +695,11 @@ class WowClient:
                 if not t.done():
                     t.cancel()
             await asyncio.gather(*tasks, return_exceptions=True)
+            self.worker.stop()
+            self._close_udp()
+            await self.stop_relay()
+            if metrics is not None:
+                metrics.close()
 
             # ensure any remaining writer is closed before loop ends
             if self._writer:
@@ -203,14 +714,42 @@ class WowClient:
             # allow scheduled cleanup callbacks to run
             await asyncio.sleep(0)
 
-if __name__ == "__main__":
-    format = "%(asctime)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")  # Changed to DEBUG level
-    
-    client = WowClient()
-    logging.info(f"Loaded windows configuration: {client.windows}")  # Added config logging
-    
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WoW follower: presses the keys the leader's server sends")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="server address")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--config", default="windows.json", help="window layout, reloaded when it changes")
+    parser.add_argument("--mode", choices=["push", "poll", "udp"], default="push")
+    parser.add_argument("--udp-port", type=int, default=5001, help="server datagram port for --mode udp")
+    parser.add_argument("--udp-group", help="multicast group addr:port for --mode udp")
+    parser.add_argument("--channel", help="channel to follow on a multi-channel server")
+    parser.add_argument("--groups", help="comma separated group tags, overrides the config's \"groups\"")
+    parser.add_argument("--relay-port", type=int, help="forward every key to followers connecting here")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    parser.add_argument("--heartbeat", type=float, default=1.0, help="seconds between heartbeats to the server")
+    parser.add_argument("--link-timeout", type=float, default=3.0,
+                        help="seconds of silence from the server before the link counts as dead")
+    parser.add_argument("--no-input", action="store_true",
+                        help="do not press anything (pure relay); mouse and pynput are not loaded")
+    parser.add_argument("--debug", action="store_true", help="log every key")
+    args = parser.parse_args(argv)
+
+    # logging goes through a background thread; per-key details are at DEBUG
+    setup_logging(logging.DEBUG if args.debug else logging.INFO)
+    client = WowClient(args.host, args.port, args.config, args.mode,
+                       backend=NullInputBackend() if args.no_input else None, udp_port=args.udp_port,
+                       udp_group=args.udp_group, relay_port=args.relay_port,
+                       groups=[g for g in args.groups.split(",") if g] if args.groups else None,
+                       metrics_port=args.metrics_port, metrics_host=args.metrics_host, channel=args.channel,
+                       heartbeat_interval=args.heartbeat, link_timeout=args.link_timeout)
+    logging.info("Loaded windows configuration: %s", client.windows)
+
     try:
         asyncio.run(client.run())
     except KeyboardInterrupt:
-        logging.info("Shutting down client")
\ No newline at end of file
+        logging.info("Shutting down client")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# One input operation is a tuple whose first item names it:
+#   ("move", x, y) | ("click",) | ("press", key) | ("release", key) | ("wait", seconds)
+Op = Tuple
+Batch = Sequence[Op]
+
+# what a batch returns: execution time in backend seconds and wall-clock time.time_ns()
+# of its first click and first key press (0 if the batch had none)
+BatchResult = namedtuple("BatchResult", ["elapsed", "click_ns", "press_ns"])
+
+
+class InputBackend:
+    """Where input operations end up. Subclasses implement the four operations and the clock."""
+
+    def move(self, x: int, y: int):
+        raise NotImplementedError
+
+    def click(self):
+        raise NotImplementedError
+
+    def press(self, key: str):
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class RealInputBackend(InputBackend):
+    """Drives the real mouse and keyboard (Windows desktop)."""
+
+    def __init__(self):
+        # imported here so headless tools can use the rest of the client without them
+        import mouse
+        from pynput import keyboard as pynput_keyboard
+        self._mouse = mouse
+        self.kb = pynput_keyboard.Controller()
+
+    def move(self, x: int, y: int):
+        self._mouse.move(x, y, absolute=True, duration=0.002)
+
+    def click(self):
+        self._mouse.click()
+
+    def press(self, key: str):
+        self.kb.press(key)
+
+    def release(self, key: str):
+        self.kb.release(key)
+
+
+class NullInputBackend(InputBackend):
+    """Drops every operation; for followers that only relay keys, and for headless runs."""
+
+    def move(self, x: int, y: int):
+        pass
+
+    def click(self):
+        pass
+
+    def press(self, key: str):
+        pass
+
+    def release(self, key: str):
+        pass
+
+
+class VirtualClock:
+    """Manually advanced clock; sleeping on it just moves time forward."""
+
+    def __init__(self, start: float = 0.0):
+        self.t = start
+
+    def now(self) -> float:
+        return self.t
+
+    def advance(self, seconds: float):
+        if seconds > 0:
+            self.t += seconds
+
+
+class VirtualInputBackend(InputBackend):
+    """Records every operation with its (virtual) timestamp instead of touching the desktop.
+
+    op_cost models how long a real mouse/keyboard call takes; each operation advances the
+    clock by that much. With the default VirtualClock no wall-clock time is spent waiting,
+    so bot_loop can be benchmarked and regression-tested on a headless machine.
+    """
+
+    def __init__(self, clock: Optional[VirtualClock] = None, op_cost: float = 0.0):
+        self.clock = clock or VirtualClock()
+        self.op_cost = op_cost
+        self.ops: List[Tuple] = []  # (timestamp, name, *args)
+
+    def _record(self, *op):
+        self.ops.append((self.clock.now(),) + op)
+        self.clock.advance(self.op_cost)
+
+    def move(self, x: int, y: int):
+        self._record("move", x, y)
+
+    def click(self):
+        self._record("click")
+
+    def press(self, key: str):
+        self._record("press", key)
+
+    def release(self, key: str):
+        self._record("release", key)
+
+    def now(self) -> float:
+        return self.clock.now()
+
+    def sleep(self, seconds: float):
+        self.clock.advance(seconds)
+
+
+class WindowTimings:
+    """Minimum delays in seconds around the input sent to one window.
+
+    The defaults reproduce the original sequence: move, 70 ms, click, 70 ms + 20 ms,
+    press, 50 ms hold, release, 20 ms.
+    """
+
+    FIELDS = ("move_settle", "click_settle", "key_hold", "gap")
+
+    def __init__(self, move_settle: float = 0.07, click_settle: float = 0.09, key_hold: float = 0.05,
+                 gap: float = 0.02):
+        self.move_settle = move_settle  # move -> click
+        self.click_settle = click_settle  # click -> press
+        self.key_hold = key_hold  # press -> release
+        self.gap = gap  # release -> next window's click
+
+    def with_overrides(self, overrides: Dict[str, float]) -> "WindowTimings":
+        values = {f: float(overrides.get(f, getattr(self, f))) for f in self.FIELDS}
+        return WindowTimings(**values)
+
+    def __repr__(self):
+        return "WindowTimings(%s)" % ", ".join(f"{f}={getattr(self, f)}" for f in self.FIELDS)
+
+
+LOW_LATENCY_TIMINGS = WindowTimings(move_settle=0.02, click_settle=0.03, key_hold=0.03, gap=0.005)
+
+
+class InputPlan:
+    """Pre-computed multi-window input schedule for one key.
+
+    Built once per window layout; only the key is filled in per use. With overlap=True the
+    mouse moves to the next window while the key is still held in the current one (moving
+    does not change focus, only the click does), which shortens every window after the first.
+    """
+
+    def __init__(self, windows: Sequence[Tuple[int, int, WindowTimings]], overlap: bool = False):
+        events = []  # (offset, window index, step, op)
+        t_move = 0.0
+        prev_release = None
+        for i, (x, y, tm) in enumerate(windows):
+            t_click = t_move + tm.move_settle
+            if prev_release is not None:
+                t_click = max(t_click, prev_release + tm.gap)
+            t_press = t_click + tm.click_settle
+            t_release = t_press + tm.key_hold
+            events += [(t_move, i, 0, ("move", x, y)), (t_click, i, 1, ("click",)),
+                       (t_press, i, 2, ("press", None)), (t_release, i, 3, ("release", None))]
+            prev_release = t_release
+            t_move = t_press if overlap else t_release + tm.gap
+        if windows:
+            events.append((prev_release + windows[-1][2].gap, len(windows), 0, ("wait_end",)))
+        events.sort(key=lambda e: e[:3])
+
+        self.press_offsets = [e[0] for e in events if e[3][0] == "press"]
+        self.duration = events[-1][0] if events else 0.0
+        # turn absolute offsets into the worker's relative waits
+        template = []
+        now = 0.0
+        for offset, _, _, op in events:
+            if offset > now:
+                template.append(("wait", offset - now))
+                now = offset
+            if op[0] != "wait_end":
+                template.append(op)
+        self._template = template
+        self._key_slots = [i for i, op in enumerate(template) if op[0] in ("press", "release")]
+
+    @property
+    def spread(self) -> float:
+        """Planned time between the first and the last window's key press."""
+        return self.press_offsets[-1] - self.press_offsets[0] if self.press_offsets else 0.0
+
+    def ops(self, key: str) -> List[Op]:
+        batch = list(self._template)
+        for i in self._key_slots:
+            batch[i] = (batch[i][0], key)
+        return batch
+
+
+class MacroProgram:
+    """A named key sequence that a follower runs locally when its trigger key arrives.
+
+    steps are (key, at) pairs, `at` seconds after the start of each repetition. A step starts
+    no earlier than the previous step's full window sequence has finished. The program repeats
+    `repeat` times, one repetition every `every` seconds at most. `timings` overrides the window
+    timings for the whole program, and `window_timings` ({window index: overrides}) overrides
+    them for single windows. The program is compiled once per window layout into one worker
+    batch. It then costs one handoff and runs with the worker's deadline-based timing.
+    """
+
+    def __init__(self, name: str, steps: Sequence[Tuple[str, float]], repeat: int = 1, every: float = 0.0,
+                 timings: Optional[Dict[str, float]] = None,
+                 window_timings: Optional[Dict[int, Dict[str, float]]] = None):
+        if not steps:
+            raise ValueError(f"macro {name!r} has no steps")
+        self.name = name
+        self.steps = [(str(key), float(at)) for key, at in steps]
+        self.repeat = max(1, int(repeat))
+        self.every = float(every)
+        self.timings = dict(timings or {})
+        self.window_timings = dict(window_timings or {})
+
+    def compile(self, windows: Sequence[Tuple[int, int, WindowTimings]], base: WindowTimings,
+                overlap: bool = False) -> List[Op]:
+        """One batch for the whole program; windows as for InputPlan, base for single window mode."""
+        if windows:
+            entries = [(x, y, tm.with_overrides(self.timings).with_overrides(self.window_timings.get(i, {})))
+                       for i, (x, y, tm) in enumerate(windows)]
+            plan = InputPlan(entries, overlap)
+            step_ops, duration = plan.ops, plan.duration
+        else:
+            hold = base.with_overrides(self.timings).key_hold
+            step_ops, duration = (lambda key: [("press", key), ("wait", hold), ("release", key)]), hold
+        batch = []
+        now = 0.0  # planned time reached by the batch so far
+        for rep in range(self.repeat):
+            for key, at in self.steps:
+                start = max(now, rep * self.every + at)
+                if start > now:
+                    batch.append(("wait", start - now))
+                batch.extend(step_ops(key))
+                now = start + duration
+        return batch
+
+
+class InputWorker:
+    """Single long-lived thread that runs whole batches of mouse/keyboard operations.
+
+    A batch is handed over once and executed back to back, so a multi-window key sequence
+    costs one thread handoff instead of one asyncio.to_thread() per move, click and press.
+    Waits inside a batch are measured from the batch start, so they do not accumulate drift.
+    """
+
+    def __init__(self, backend: InputBackend):
+        self.backend = backend
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+        self.batches = 0
+        self.batch_times = deque(maxlen=256)  # seconds each batch took to execute
+        self.spreads = deque(maxlen=256)  # seconds between first and last press of a batch
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="input-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def submit(self, batch: Batch) -> asyncio.Future:
+        """Queue a batch from the event loop; the future resolves to a BatchResult."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._jobs.put((list(batch), loop, fut))
+        return fut
+
+    async def run_batch(self, batch: Batch) -> BatchResult:
+        return await self.submit(batch)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            batch, loop, fut = job
+            try:
+                result = self._execute(batch)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, fut, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, fut, result)
+
+    def _execute(self, batch: List[Op]) -> BatchResult:
+        backend = self.backend
+        start = backend.now()
+        deadline = start
+        first_press = last_press = None
+        click_ns = press_ns = 0
+        for op in batch:
+            name = op[0]
+            if name == "wait":
+                deadline += op[1]
+                delay = deadline - backend.now()
+                if delay > 0:
+                    backend.sleep(delay)
+            elif name == "move":
+                backend.move(op[1], op[2])
+            elif name == "click":
+                if not click_ns:
+                    click_ns = time.time_ns()
+                backend.click()
+            elif name == "press":
+                last_press = backend.now()
+                if first_press is None:
+                    first_press = last_press
+                    press_ns = time.time_ns()
+                backend.press(op[1])
+            elif name == "release":
+                backend.release(op[1])
+            else:
+                raise ValueError(f"unknown input operation: {name}")
+        elapsed = backend.now() - start
+        self.batches += 1
+        self.batch_times.append(elapsed)
+        if first_press is not None:
+            self.spreads.append(last_press - first_press)
+        return BatchResult(elapsed, click_ns, press_ns)
+
+    def stats(self) -> Dict[str, float]:
+        # batch times are in the backend's clock (virtual seconds for VirtualInputBackend)
+        times = list(self.batch_times)
+        spreads = list(self.spreads)
+        return {
+            "batches": self.batches,
+            "batch_ms_last": round(1000 * times[-1], 3) if times else 0.0,
+            "batch_ms_mean": round(1000 * sum(times) / len(times), 3) if times else 0.0,
+            "batch_ms_max": round(1000 * max(times), 3) if times else 0.0,
+            "spread_ms_last": round(1000 * spreads[-1], 3) if spreads else 0.0,
+            "spread_ms_max": round(1000 * max(spreads), 3) if spreads else 0.0,
+        }
+
+
+def _set_result(fut: asyncio.Future, result):
+    if not fut.done():
+        fut.set_result(result)
+
+
+def _set_exception(fut: asyncio.Future, exc: BaseException):
+    if not fut.done():
+        fut.set_exception(exc)
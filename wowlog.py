@@ -0,0 +1,99 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+FORMAT = "%(asctime)s: %(message)s"
+DATEFMT = "%H:%M:%S"
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` formatted log lines in memory for the GUIs to show."""
+
+    def __init__(self, capacity: int = 500):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+        self.total = 0  # lines ever added, so a viewer can tell whether anything is new
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.lines.append(self.format(record))
+            self.total += 1
+        except Exception:
+            self.handleError(record)
+
+    def recent(self, n: Optional[int] = None) -> List[str]:
+        with self.lock:  # held by handle() around emit(), which runs on the logging thread
+            lines = list(self.lines)
+        return lines[-n:] if n else lines
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() formats the message in the calling thread, which is exactly the cost
+    we want off the event loop; our log arguments are plain values, so passing the record
+    through unformatted is safe.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+ring = RingBufferHandler()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: int = logging.INFO, ring_size: int = 500) -> RingBufferHandler:
+    """Send all logging through a queue to one background thread that writes the console and `ring`.
+
+    Logging calls then only create a record and queue it; formatting and console I/O happen
+    off the event loop and off the input worker.
+    """
+    global _listener
+    if _listener is not None:
+        return ring
+    formatter = logging.Formatter(FORMAT, DATEFMT)
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    ring.setFormatter(formatter)
+    ring.lines = deque(maxlen=ring_size)
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, console, ring)
+    _listener.start()
+    atexit.register(stop_logging)
+    return ring
+
+
+def stop_logging():
+    """Flush what is queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+_throttle: Dict[str, Tuple[float, int]] = {}  # key -> (time of last emitted message, suppressed since)
+
+
+def log_every(interval: float, key: str, level: int, msg: str, *args):
+    """Log msg at most once per interval seconds per key; the message that gets through says
+    how many were suppressed. For per-poll and per-key chatter that would otherwise flood."""
+    now = time.monotonic()
+    last, suppressed = _throttle.get(key, (0.0, 0))
+    if now - last < interval:
+        _throttle[key] = (last, suppressed + 1)
+        return
+    _throttle[key] = (now, 0)
+    if suppressed:
+        msg += " (%d similar suppressed)"
+        args += (suppressed,)
+    logging.log(level, msg, *args)
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import math
+import socket
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# stages a key passes through, in order; all timestamps are time.time_ns() values
+STAGES = ("capture", "enqueue", "send", "receive", "schedule", "click", "press")
+
+
+class LatencyHistogram:
+    """Fixed-size log-bucket histogram of durations in seconds.
+
+    Buckets grow by GROWTH from MIN_VALUE, so memory stays constant for long sessions and a
+    percentile is accurate to within one bucket (~25%) of the true value.
+    """
+
+    MIN_VALUE = 50e-6
+    GROWTH = 1.25
+    BUCKETS = 64  # up to ~75 s
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.MIN_VALUE:
+            return 0
+        idx = int(math.log(value / self.MIN_VALUE, self.GROWTH)) + 1
+        return min(idx, self.BUCKETS)
+
+    def add(self, value: float):
+        # negative durations only happen between unsynchronised clocks; count them as zero
+        value = max(0.0, value)
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = math.ceil(pct / 100.0 * self.count)
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                upper = self.MIN_VALUE * self.GROWTH ** idx
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class StageLatency:
+    """Per-segment histograms (capture->enqueue, enqueue->send, ...) plus capture->press total."""
+
+    def __init__(self):
+        self.segments: Dict[str, LatencyHistogram] = {}
+
+    def add(self, stamps: Dict[str, int], offset_ns: int = 0):
+        """Record one key's stage timestamps. Follower stamps (receive and later) are shifted by
+        offset_ns to bring them onto the leader's clock; missing stages are skipped."""
+        prev_name = prev_ts = None
+        first_ts = None
+        for name in STAGES:
+            ts = stamps.get(name)
+            if not ts:
+                continue
+            if STAGES.index(name) >= STAGES.index("receive"):
+                ts -= offset_ns
+            if prev_ts is not None:
+                self._hist(f"{prev_name}->{name}").add((ts - prev_ts) / 1e9)
+            else:
+                first_ts = ts
+            prev_name, prev_ts = name, ts
+        if first_ts is not None and prev_ts is not None and prev_ts != first_ts:
+            self._hist("total").add((prev_ts - first_ts) / 1e9)
+
+    def _hist(self, name: str) -> LatencyHistogram:
+        hist = self.segments.get(name)
+        if hist is None:
+            hist = self.segments[name] = LatencyHistogram()
+        return hist
+
+    def summary(self, names: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, float]]:
+        names = list(names) if names is not None else list(self.segments)
+        return {n: self.segments[n].summary() for n in names if n in self.segments}
+
+
+class LinkHealth:
+    """Round-trip time, jitter and clock offset from heartbeat exchanges (NTP style).
+
+    t0 client send, t1 server receive, t2 server send, t3 client receive. offset_ns is the
+    follower clock minus the leader clock, taken from the lowest-RTT recent sample because
+    that one has the least queueing asymmetry in it.
+    """
+
+    ALPHA = 0.125  # smoothing factor for rtt and jitter, as in TCP's SRTT
+
+    def __init__(self):
+        self.rtt_ns = 0.0
+        self.jitter_ns = 0.0
+        self.last_rtt_ns = 0
+        self.offset_ns = 0
+        self.samples = 0
+        self._recent = deque(maxlen=8)  # (rtt, offset)
+
+    def add_sample(self, t0: int, t1: int, t2: int, t3: int):
+        rtt = max(0, (t3 - t0) - (t2 - t1))
+        offset = ((t0 - t1) + (t3 - t2)) // 2
+        if self.samples:
+            self.jitter_ns += (abs(rtt - self.last_rtt_ns) - self.jitter_ns) * self.ALPHA
+            self.rtt_ns += (rtt - self.rtt_ns) * self.ALPHA
+        else:
+            self.rtt_ns = float(rtt)
+        self.last_rtt_ns = rtt
+        self.samples += 1
+        self._recent.append((rtt, offset))
+        self.offset_ns = min(self._recent)[1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "rtt_ms": round(self.rtt_ns / 1e6, 3),
+            "jitter_ms": round(self.jitter_ns / 1e6, 3),
+            "offset_ms": round(self.offset_ns / 1e6, 3),
+            "samples": self.samples,
+        }
+
+
+class LoopLag:
+    """How late the event loop runs a callback: sleeps `interval` and records the overshoot.
+
+    Anything that blocks the loop (a slow handler, a synchronous write, GC) shows up here as
+    lag, and every key published or received on that loop is delayed by the same amount.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.hist = LatencyHistogram()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.hist.add(loop.time() - start - self.interval)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Optional[Dict[str, object]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _value(value: float) -> str:
+    # counters stay exact integers; floats in full precision
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class MetricsText:
+    """Prometheus text exposition (format 0.0.4), built fresh for every scrape.
+
+    Samples are grouped per metric name, so one metric's samples (one per client, say) may be
+    added in any order. Counter names should end in _total, durations are in seconds.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}  # name -> (type, help, sample lines)
+
+    def _samples(self, name: str, kind: str, help: str) -> Tuple[str, List[str]]:
+        name = self.prefix + name
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, [])
+        return name, family[2]
+
+    def add(self, kind: str, name: str, help: str, value: float, labels: Optional[Dict[str, object]] = None):
+        name, samples = self._samples(name, kind, help)
+        samples.append(f"{name}{_labels(labels)} {_value(value)}")
+
+    def counter(self, name: str, help: str, value: float, labels: Optional[Dict[str, object]] = None):
+        self.add("counter", name, help, value, labels)
+
+    def gauge(self, name: str, help: str, value: float, labels: Optional[Dict[str, object]] = None):
+        self.add("gauge", name, help, value, labels)
+
+    def summary(self, name: str, help: str, hist: LatencyHistogram, labels: Optional[Dict[str, object]] = None):
+        """A LatencyHistogram as a summary: p50/p95/p99 plus _sum and _count."""
+        name, samples = self._samples(name, "summary", help)
+        labels = dict(labels or {})
+        for q in (0.5, 0.95, 0.99):
+            samples.append(f"{name}{_labels({**labels, 'quantile': q})} {_value(hist.percentile(q * 100))}")
+        samples.append(f"{name}_sum{_labels(labels)} {_value(hist.total)}")
+        samples.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(collect: Callable[[], str], port: int, host: str = "127.0.0.1"):
+    """Minimal HTTP server on the running loop answering GET /metrics with collect()'s text.
+
+    Meant for a Prometheus scraper; one request per connection, nothing else is served.
+    Returns the asyncio server, bound port in server.sockets[0].getsockname()[1].
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", collect().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            logging.exception("Metrics request failed")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, family=socket.AF_INET)
+    logging.info("Metrics on http://%s:%d/metrics", host, server.sockets[0].getsockname()[1])
+    return server
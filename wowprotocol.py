@@ -0,0 +1,107 @@
+import struct
+import time
+from collections import namedtuple
+from typing import Dict, List
+
+# Every frame on the wire is a 2 byte big-endian length followed by that many bytes:
+#   type (u8) | seq (u32) | key code (u16) | leader timestamp in ns (i64) | optional payload
+LENGTH = struct.Struct(">H")
+HEADER = struct.Struct(">BIHq")
+MAX_PAYLOAD = 0xFFFF - HEADER.size
+
+# message types
+POLL = 1        # client -> server: legacy "Check Server Alive" request
+KEY = 2         # server -> client: one captured key event
+IDLE = 3        # server -> client: poll answer when there is nothing to press
+SUBSCRIBE = 4   # client -> server: switch the connection to push mode
+REPORT = 5      # client -> server: follower stage timestamps for one key (seq = key seq)
+WELCOME = 6     # server -> client: first frame on a connection; seq = latest key seq, payload = epoch
+PING = 7        # client -> server: heartbeat; ts = client send time, payload = LINK (client's estimates)
+PONG = 8        # server -> client: heartbeat answer; ts = the ping's ts, payload = STAMPS (server recv, send)
+JOIN = 9        # client -> server (UDP): register / keep alive as a datagram follower; answered with WELCOME
+NACK = 10       # client -> server (UDP): resend keys; seq = first missing, payload = COUNT
+GROUPS = 11     # client -> server: group tags, comma separated; answered with the keys routed to them, comma
+                #   separated too (empty = all)
+CHANNEL = 12    # client -> server: first frame on a multi-channel server; payload = channel name (utf-8)
+
+NO_KEY = 0
+
+Frame = namedtuple("Frame", ["type", "seq", "key", "ts", "payload"])
+
+# WELCOME payload, and the payload of a resuming SUBSCRIBE/POLL (whose seq is the last key seen):
+# the server's epoch, random per server start, so sequence numbers are only resumed within one run
+EPOCH = struct.Struct(">I")
+
+# NACK payload: how many consecutive keys from seq on to resend
+COUNT = struct.Struct(">I")
+
+# PING payload: the client's link estimates (rtt ns, offset ns, jitter ns)
+LINK = struct.Struct(">qqq")
+
+# PONG payload: when the server received the PING and sent the answer, in ns
+STAMPS = struct.Struct(">qq")
+
+# REPORT payload: receive, schedule, click, press timestamps in ns on the follower clock (0 = n/a)
+REPORT_STAGES = ("receive", "schedule", "click", "press")
+REPORT_BODY = struct.Struct(">qqqq")
+
+
+def is_wire_key(key: str) -> bool:
+    """Whether a key fits in a frame's key code: a single character from the basic plane."""
+    return len(key) == 1 and ord(key) <= 0xFFFF
+
+
+def key_to_code(key: str) -> int:
+    return ord(key) if key else NO_KEY
+
+
+def code_to_key(code: int) -> str:
+    return chr(code) if code else ""
+
+
+def now_ns() -> int:
+    return time.time_ns()
+
+
+def encode_frame(msg_type: int, seq: int = 0, key: str = "", ts: int = 0, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"payload too large: {len(payload)} bytes")
+    body = HEADER.pack(msg_type, seq & 0xFFFFFFFF, key_to_code(key), ts) + payload
+    return LENGTH.pack(len(body)) + body
+
+
+def encode_report(seq: int, stamps: Dict[str, int]) -> bytes:
+    body = REPORT_BODY.pack(*(stamps.get(name, 0) for name in REPORT_STAGES))
+    return encode_frame(REPORT, seq, payload=body)
+
+
+def decode_report(payload: bytes) -> Dict[str, int]:
+    return dict(zip(REPORT_STAGES, REPORT_BODY.unpack_from(payload)))
+
+
+class FrameDecoder:
+    """Incremental parser: feed() whatever read() returned and get back the complete frames."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> List[Frame]:
+        buf = self._buf
+        buf.extend(data)
+        frames = []
+        pos = 0
+        end = len(buf)
+        while end - pos >= LENGTH.size:
+            (size,) = LENGTH.unpack_from(buf, pos)
+            if size < HEADER.size:
+                raise ValueError(f"malformed frame of {size} bytes")
+            if end - pos - LENGTH.size < size:
+                break
+            start = pos + LENGTH.size
+            msg_type, seq, code, ts = HEADER.unpack_from(buf, start)
+            payload = bytes(buf[start + HEADER.size:start + size])
+            frames.append(Frame(msg_type, seq, code_to_key(code), ts, payload))
+            pos = start + size
+        if pos:
+            del buf[:pos]
+        return frames
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import struct
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from wowprotocol import key_to_code, code_to_key
+
+# A key log is an 8 byte magic followed by records; every record starts with its type (u8):
+#   KEY_RECORD:   type | capture timestamp ns (i64) | seq (u32) | key code (u16) | group id (u16)
+#   GROUP_RECORD: type | group id (u16) | name length (u8) | name (utf-8)
+# Group ids are defined by a GROUP_RECORD before their first use; 0 means "every follower".
+# Files are only ever appended to and every record reaches the file within FLUSH_INTERVAL of being
+# written, so a crash loses at most the last second of keys. Readers skip a trailing partial record,
+# and a recorder opening the file cuts it off before appending.
+MAGIC = b"WOWKEYS1"
+KEY_RECORD = 1
+GROUP_RECORD = 2
+KEY_BODY = struct.Struct(">BqIHH")
+GROUP_HEAD = struct.Struct(">BHB")
+
+
+# one recorded key; group is "" when it went to every follower
+KeyRecord = namedtuple("KeyRecord", ["ts", "seq", "key", "group"])
+
+
+class KeyRecorder:
+    """Appends published keys to a key log; called on the event loop thread for every key.
+
+    The first record after a flush arms a FLUSH_INTERVAL timer on the loop, so a burst costs one
+    flush and its last keys are on disk a second later even if no further key ever comes.
+    """
+
+    FLUSH_INTERVAL = 1.0  # seconds a record may wait in the write buffer
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        else:
+            # records appended after half a record would be read from the wrong offset, so the
+            # new session starts where the last complete record ends
+            end = len(MAGIC)
+            try:
+                for _, end in _walk(self.path):
+                    pass
+            except ValueError:
+                self._file.close()
+                raise
+            if end < self._file.tell():
+                logging.warning("Cutting %d bytes of a partial record off %s", self._file.tell() - end, self.path)
+                self._file.truncate(end)
+        # group ids start over in every session appended to the file
+        self._groups: Dict[str, int] = {"": 0}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.records = 0
+
+    def record(self, ts: int, seq: int, key: str, group: str = ""):
+        gid = self._groups.get(group)
+        if gid is None:
+            gid = self._groups[group] = len(self._groups)
+            name = group.encode("utf-8")[:255]
+            self._file.write(GROUP_HEAD.pack(GROUP_RECORD, gid, len(name)) + name)
+        self._file.write(KEY_BODY.pack(KEY_RECORD, ts, seq & 0xFFFFFFFF, key_to_code(key), gid))
+        self.records += 1
+        if self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.FLUSH_INTERVAL, self.flush)
+            except RuntimeError:
+                self._file.flush()  # no loop to flush later from
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_log(path: Union[str, Path], chunk_size: int = 1 << 16) -> Iterator[KeyRecord]:
+    """Stream the records of a key log in order; memory use does not depend on the file size."""
+    for rec, _ in _walk(path, chunk_size):
+        if rec is not None:
+            yield rec
+
+
+def _walk(path: Union[str, Path], chunk_size: int = 1 << 16) -> Iterator[Tuple[Optional[KeyRecord], int]]:
+    """Every complete record with the file offset just past it; group records come as None."""
+    groups = {0: ""}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a key log")
+        buf = b""
+        pos = 0
+        base = len(MAGIC)  # file offset of buf[0]
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            base += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+            end = len(buf)
+            while pos < end:
+                rtype = buf[pos]
+                if rtype == KEY_RECORD:
+                    if end - pos < KEY_BODY.size:
+                        break
+                    _, ts, seq, code, gid = KEY_BODY.unpack_from(buf, pos)
+                    pos += KEY_BODY.size
+                    yield KeyRecord(ts, seq, code_to_key(code), groups.get(gid, "")), base + pos
+                elif rtype == GROUP_RECORD:
+                    if end - pos < GROUP_HEAD.size or end - pos < GROUP_HEAD.size + buf[pos + 3]:
+                        break
+                    _, gid, size = GROUP_HEAD.unpack_from(buf, pos)
+                    start = pos + GROUP_HEAD.size
+                    if gid == 1:
+                        groups = {0: ""}  # a new session was appended, its ids start over
+                    groups[gid] = buf[start:start + size].decode("utf-8", "replace")
+                    pos = start + size
+                    yield None, base + pos
+                else:
+                    raise ValueError(f"corrupt key log {path} at record type {rtype}")
+        if pos < len(buf):
+            logging.info("Ignoring %d trailing bytes of a partial record in %s", len(buf) - pos, path)
+
+
+async def replay(server, path: Union[str, Path], speed: Optional[float] = 1.0, batch: int = 256) -> int:
+    """Publish a key log through server at `speed` times real time (None or 0 = as fast as possible).
+
+    Keys are paced against absolute deadlines from the first record, so timing does not drift
+    over a long log. At full speed the loop yields every `batch` keys so sockets get drained.
+    Returns the number of keys published.
+
+    Replayed keys are new keys of this server: they are numbered with its own seq, without the
+    gaps a log may have, and routed by its own groups file. The recorded seq only marks where an
+    appended session starts and the recorded group is for reading the log, so replay to a server
+    with the groups.json that recorded it to deliver each key to the same followers again.
+    """
+    loop = asyncio.get_running_loop()
+    first_ts = start = None
+    prev_seq = 0
+    published = 0
+    for rec in read_log(path):
+        if speed:
+            if first_ts is None or rec.seq <= prev_seq:
+                # first record, or the first of a session appended later: pace from here
+                first_ts, start = rec.ts, loop.time()
+            prev_seq = rec.seq
+            delay = start + (rec.ts - first_ts) / 1e9 / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif published % batch == batch - 1:
+            await asyncio.sleep(0)
+        server.publish_key(rec.key)
+        published += 1
+    return published
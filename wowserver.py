@@ -1,73 +1,830 @@
 # ...existing code...
+import argparse
 import asyncio
+import json
 import socket
 import logging
+import random
+import struct
 import threading
-import keyboard
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from wowlog import log_every, setup_logging
+from wowmetrics import LatencyHistogram, LoopLag, MetricsText, StageLatency, serve_metrics
+from wowprotocol import (FrameDecoder, decode_report, encode_frame, is_wire_key, now_ns, EPOCH, GROUPS, KEY, IDLE,
+                         JOIN, LINK, PING, POLL, PONG, REPORT, STAMPS, SUBSCRIBE, WELCOME)
+from wowrecord import KeyRecorder, replay
+from wowudp import UdpFanout, parse_group
+
+
+class ClientState:
+    """Delivery state of one connected follower."""
+
+    def __init__(self, addr, writer: asyncio.StreamWriter, cursor: int):
+        self.addr = addr
+        self.writer = writer
+        self.mode = "poll"  # "poll", "push", or "udp" (keys go out as datagrams, TCP only carries control)
+        self.cursor = cursor  # seq of the last key delivered to this client
+        self.greeted = False  # first SUBSCRIBE/POLL seen (the only one that may resume)
+        self.sent = 0
+        self.polls = 0
+        self.skipped = 0  # keys that fell out of the history before this client polled
+        self.sent_at: Dict[int, int] = {}  # seq -> send timestamp, for matching latency reports
+        self.latency = StageLatency()
+        # push delivery: frames waiting for the socket to drain, as (seq, frame, published ns)
+        self.outbox = deque()
+        self.wake = None  # asyncio.Event for the sender task, created when push mode starts
+        self.dropped = 0  # stale or overflowing frames this client never got
+        # link health as measured by the client's heartbeats (offset = follower clock - leader clock)
+        self.heartbeats = False
+        self.rtt_ns = 0
+        self.offset_ns = 0
+        self.jitter_ns = 0
+        self.groups: Optional[FrozenSet[str]] = None  # group tags; None = receives every key
+
+    def lag_ns(self, now: int) -> int:
+        """How long the oldest frame still waiting for this client has been waiting."""
+        return now - self.outbox[0][2] if self.outbox else 0
+
+    def mark_sent(self, seq: int, ts: int):
+        self.sent_at[seq] = ts
+        if len(self.sent_at) > 512:
+            del self.sent_at[next(iter(self.sent_at))]
+
+
+def load_groups(path: Union[str, Path]) -> Dict[str, FrozenSet[str]]:
+    """Read a groups file ({"groups": {"healer": ["1", "2"], ...}}) into key -> groups that want it.
+
+    Keys listed under no group keep going to every follower. A missing or broken file means
+    no routing at all, which is how the server behaved before groups existed. Keys a frame
+    cannot carry (anything but a single character, like "f1") are skipped.
+    """
+    path = Path(path)
+    try:
+        if not path.exists():
+            logging.info("No %s found - every key goes to every follower", path)
+            return {}
+        data = json.loads(path.read_text())
+        routes: Dict[str, set] = {}
+        for group, keys in data.get("groups", {}).items():
+            for key in map(str, keys):
+                if not is_wire_key(key) or key == ",":
+                    logging.warning("Skipping key %r of group %s in %s: only single characters other than "
+                                    "',' can be routed", key, group, path)
+                    continue
+                routes.setdefault(key, set()).add(str(group))
+        logging.info("Loaded %d group(s) routing %d key(s) from %s",
+                     len(data.get("groups", {})), len(routes), path)
+        return {key: frozenset(groups) for key, groups in routes.items()}
+    except Exception as e:
+        logging.error("Error reading groups config %s: %s - every key goes to every follower", path, e)
+        return {}
+
+
+class KeyQueue:
+    """Bounded FIFO between the keyboard hook thread and the event loop.
+
+    When the queue is full the overflow policy decides what happens:
+      "drop-oldest" - discard the oldest queued key to make room
+      "coalesce"    - fold a key into an identical key at the tail, else drop the oldest
+      "block"       - make the hook thread wait up to block_timeout for room, then drop the new key
+
+    Only "block" takes a lock. The other policies use nothing but deque appends and poplefts,
+    which are atomic, so the hook thread never waits for the event loop.
+    """
+
+    POLICIES = ("drop-oldest", "coalesce", "block")
+
+    def __init__(self, maxsize: int = 256, policy: str = "drop-oldest", block_timeout: float = 0.05):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._items = deque()
+        self._cond = threading.Condition() if policy == "block" else None
+        self._wake_pending = False  # a drain is scheduled and has not started taking keys yet
+        self.captured = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, key: str, ts: int, enqueued: int) -> bool:
+        """Queue a key captured at ts and stamped enqueued on its way in; returns True if the
+        consumer needs waking (no drain is pending)."""
+        self.captured += 1
+        items = self._items
+        if len(items) >= self.maxsize:
+            if self.policy == "block":
+                with self._cond:
+                    if not self._cond.wait_for(lambda: len(items) < self.maxsize, self.block_timeout):
+                        self.dropped += 1
+                        logging.warning("Key queue full, dropped key %s", key)
+                        return False
+            else:
+                try:
+                    if self.policy == "coalesce" and items[-1][0] == key:
+                        self.coalesced += 1
+                        return False
+                    items.popleft()
+                    self.dropped += 1
+                    logging.warning("Key queue full, dropped oldest key")
+                except IndexError:
+                    pass  # the consumer emptied it meanwhile
+        items.append((key, ts, enqueued))
+        if self._wake_pending:
+            return False
+        self._wake_pending = True
+        return True
+
+    def take_all(self) -> List[Tuple[str, int, int]]:
+        # clear the flag first: a key appended from here on schedules a new drain, a key
+        # appended before is still picked up by the loop below
+        self._wake_pending = False
+        items = []
+        pop = self._items.popleft
+        try:
+            while True:
+                items.append(pop())
+        except IndexError:
+            pass
+        if self._cond is not None:
+            with self._cond:
+                self._cond.notify_all()
+        return items
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "queued": len(self._items),
+        }
+
+
+class KeyCapture:
+    """First stage of the leader pipeline, run on the keyboard hook thread for every OS key event.
+
+    Drops keys outside the key set, auto-repeat (further key-downs while a key is held) and
+    presses of the same key within debounce seconds. A held key that has been quiet for
+    repeat_timeout counts as released, in case its key-up got lost (focus change). The key set
+    is used as given, not copied, so keys the owner adds to it later are captured from then on.
+    Only the hook thread touches the rest of its state.
+    """
+
+    def __init__(self, keys, debounce: float = 0.0, suppress_repeat: bool = True, repeat_timeout: float = 1.0):
+        self.keys = keys
+        self.debounce_ns = int(debounce * 1e9)
+        self.suppress_repeat = suppress_repeat
+        self.repeat_timeout_ns = int(repeat_timeout * 1e9)
+        self._down: Dict[str, int] = {}  # held key -> monotonic ns of its latest key-down
+        self._last: Dict[str, int] = {}  # key -> monotonic ns of its last accepted press
+        self.events = 0
+        self.accepted = 0
+        self.filtered_key = 0
+        self.filtered_repeat = 0
+        self.filtered_debounce = 0
+
+    def accept(self, key: str, down: bool, stamp: int) -> bool:
+        """Whether a key event becomes a captured key; stamp is a monotonic ns timestamp."""
+        self.events += 1
+        if key not in self.keys:
+            if down:
+                self.filtered_key += 1
+            return False
+        if not down:
+            self._down.pop(key, None)
+            return False
+        if self.suppress_repeat:
+            held = self._down.get(key)
+            self._down[key] = stamp
+            if held is not None and stamp - held < self.repeat_timeout_ns:
+                self.filtered_repeat += 1
+                return False
+        if self.debounce_ns and stamp - self._last.get(key, -self.debounce_ns) < self.debounce_ns:
+            self.filtered_debounce += 1
+            return False
+        self._last[key] = stamp
+        self.accepted += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "events": self.events,
+            "accepted": self.accepted,
+            "filtered_key": self.filtered_key,
+            "filtered_repeat": self.filtered_repeat,
+            "filtered_debounce": self.filtered_debounce,
+        }
+
 
 class WowServer:
-    def __init__(self):
+    SLOW_POLICIES = ("drop-stale", "disconnect")
+
+    def __init__(self, capture_keys: bool = True, history: int = 1024,
+                 queue_size: int = 256, overflow: str = "drop-oldest", debounce: float = 0.0,
+                 suppress_repeat: bool = True,
+                 send_buffer: int = 256, send_high_water: int = 64 * 1024, drain_timeout: float = 0.5,
+                 slow_policy: str = "drop-stale", stale_after: float = 2.0, max_lag: float = 1.0,
+                 resume_staleness: float = 1.0, link_timeout: float = 3.0,
+                 udp_port: Optional[int] = None, udp_group: Optional[str] = None, udp_copies: int = 2,
+                 groups_path: Optional[Union[str, Path]] = None, record_path: Optional[Union[str, Path]] = None,
+                 replay_path: Optional[Union[str, Path]] = None, replay_speed: float = 1.0,
+                 metrics_port: Optional[int] = None, metrics_host: str = "127.0.0.1"):
         self.host = "0.0.0.0"  # Changed from socket.gethostname() to explicitly bind to all IPv4 interfaces
         self.port = 5000
         self.running = True
         self.key = "."
+        # "." was the idle filler of the old string protocol and followers ignored it, so it
+        # is not captured: IDLE frames took over that job. The capture stage reads this set
+        # live, so keys are added to it in place, never by assigning a new set.
         self.table = {
             "1","2","3","4","5","6","x","y","í","0","q","e","r","g",
-            "f","u","t",".",
+            "f","u","t",
         }
-        self._lock = threading.Lock()
-        self._send_limit = 3
-        self._current_key = None
-        self._send_count = 0
-        self._key_ready = True  # Flag to indicate if we're ready for a new key
-
-    def on_keypress(self, event):
-        with self._lock:
-            if event.name in self.table and self._key_ready:
-                # Only accept new key if we're ready
-                self.key = event.name
-                self._current_key = event.name
-                self._send_count = 0
-                self._key_ready = False  # Mark that we're processing this key
-
-    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.capture_keys = capture_keys  # False when keys come from submit_key() (benchmarks)
+        # recent (encoded KEY frame, capture ns, enqueue ns, key); _events[-1] has seq == self._seq.
+        # Only touched from the event loop thread, so no lock is needed.
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        # reconnecting followers get missed keys replayed from _events, except keys captured
+        # more than resume_staleness seconds ago (pressing those now would do more harm than good)
+        self.epoch = random.getrandbits(32)
+        self.resume_staleness = resume_staleness
+        self.resumes = 0
+        # a client that sends heartbeats and then goes silent this long is considered dead
+        self.link_timeout = link_timeout
+        self.clients: Dict[int, ClientState] = {}
+        self.keys = KeyQueue(queue_size, overflow)
+        # slow-follower isolation for push clients: each one gets at most send_buffer queued
+        # frames and send_high_water bytes in its transport. With "drop-stale" frames older than
+        # stale_after seconds are skipped; with "disconnect" a client more than max_lag seconds
+        # behind is dropped. Either way a stalled follower never delays the others.
+        if slow_policy not in self.SLOW_POLICIES:
+            raise ValueError(f"unknown slow consumer policy: {slow_policy}")
+        self.send_buffer = send_buffer
+        self.send_high_water = send_high_water
+        self.drain_timeout = drain_timeout
+        self.slow_policy = slow_policy
+        self.stale_after = stale_after
+        self.max_lag = max_lag
+        # optional datagram transport for LAN followers: unicast to each follower that JOINs on
+        # udp_port, or one multicast send to udp_group ("239.255.42.99:5002"). TCP stays available.
+        self.udp_port = udp_port
+        self.udp_group = parse_group(udp_group) if udp_group else None
+        self.udp_copies = udp_copies
+        self.udp: Optional[UdpFanout] = None
+        # follower groups: key -> groups it is routed to, from the groups file, and the push
+        # subscribers for each key, rebuilt whenever a subscriber joins, leaves or retags itself
+        self.key_groups: Dict[str, FrozenSet[str]] = load_groups(groups_path) if groups_path else {}
+        self.table |= set(self.key_groups)
+        # capture pipeline: hook thread -> KeyCapture filter -> KeyQueue -> event loop. Capture
+        # stamps come from the monotonic perf counter, shifted once onto the wall clock the
+        # wire timestamps use, so a clock adjustment mid-session cannot reorder them.
+        self.capture = KeyCapture(self.table, debounce, suppress_repeat)
+        self._clock_offset = time.time_ns() - time.perf_counter_ns()
+        self.capture_latency = LatencyHistogram()  # capture -> published, seconds
+        # every follower's latency reports together: unlike ClientState.latency this outlives
+        # a connection, so a follower that reconnects does not wipe the stage histograms
+        self.stage_latency = StageLatency()
+        self._routes: Dict[str, Tuple[ClientState, ...]] = {}
+        self._route_counts: Dict[str, Tuple[Tuple[str, int], ...]] = {}
+        self._broadcast: Tuple[ClientState, ...] = ()
+        self.group_stats: Dict[str, Dict[str, int]] = {g: {"members": 0, "keys": 0, "deliveries": 0}
+                                                       for gs in self.key_groups.values() for g in gs}
+        # record every published key to an append-only key log (wowrecord.py), and/or publish
+        # a recorded log instead of captured keys: replay_speed 1 = real time, 0 = flat out
+        self.record_path = record_path
+        self.recorder: Optional[KeyRecorder] = None
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        # optional Prometheus endpoint (http://metrics_host:metrics_port/metrics) on the same loop
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self._metrics_server = None
+        self.loop_lag = LoopLag()
+        self._lag_task = None
+        self.published = 0
+        self.connections = 0
+        # called on the loop thread as on_event(kind, value): ("listening", port), ("clients", count),
+        # ("key", key) and ("stopped", None). A GUI passes something thread-safe, like a queue's put.
+        self.on_event: Optional[Callable[[str, object], None]] = None
+        self._server = None
+        self._loop = None
+        self._stop_requested = False  # stop_threadsafe() came before the loop was bound
+
+    def capture_ns(self) -> int:
+        return time.perf_counter_ns() + self._clock_offset
+
+    def on_key_event(self, event):
+        # keyboard hook thread: every key-down and key-up the OS reports, auto-repeat included
+        stamp = time.perf_counter_ns()
+        if self.capture.accept(event.name, event.event_type == "down", stamp):
+            self._enqueue(event.name, stamp + self._clock_offset)
+
+    def submit_key(self, key: str):
+        # a key from another source (benchmarks, tools): only the key set filter applies
+        if key in self.capture.keys:
+            self._enqueue(key, self.capture_ns())
+
+    def _enqueue(self, key: str, ts: int):
+        loop = self._loop
+        if loop is None:
+            return
+        # only the first key of a burst schedules a drain, the rest ride along in order
+        if self.keys.put(key, ts, self.capture_ns()):
+            loop.call_soon_threadsafe(self._drain_keys)
+
+    def _drain_keys(self):
+        keys = self.keys.take_all()
+        now = self.capture_ns()
+        for key, ts, enqueued in keys:
+            self.capture_latency.add((now - ts) / 1e9)
+            try:
+                self._publish(key, ts, enqueued)
+            except (TypeError, ValueError, struct.error) as e:
+                # the batch is already off the queue: one key that cannot be encoded must not take the rest along
+                logging.error("Cannot publish key %r: %s", key, e)
+
+    def capture_stats(self) -> Dict[str, object]:
+        """Filter and queue counters of the capture pipeline plus capture -> published latency."""
+        return {**self.capture.stats(), **self.keys.stats(), "latency": self.capture_latency.summary()}
+
+    def publish_key(self, key: str):
+        """Publish a key from the event loop thread, bypassing the capture queue (replay)."""
+        ts = now_ns()
+        self._publish(key, ts, ts)
+
+    def _publish(self, key: str, ts: int, enqueued: int):
+        # encode once; the same bytes go to every client
+        self._deliver(self._seq + 1, key, encode_frame(KEY, self._seq + 1, key, ts), ts, enqueued)
+
+    def relay_key(self, seq: int, key: str, frame: bytes, received: int):
+        """Relay mode: forward a key from an upstream server unchanged, with its original seq.
+
+        Keys this relay never got (given up on upstream) leave empty slots in the history, so
+        a seq still maps to its position there. The relay's receive time stands in for the capture
+        time, so downstream latency reports measure what this hop and the ones after it add.
+        """
+        if seq <= self._seq:
+            return
+        while self._seq + 1 < seq:
+            self._seq += 1
+            self._events.append((b"", received, received, ""))
+        self._deliver(seq, key, frame, received, received)
+
+    def adopt_epoch(self, epoch: int, seq: int):
+        """Relay mode: take over the upstream server's epoch and position in its sequence."""
+        if epoch == self.epoch:
+            return
+        self.epoch = epoch
+        self._events.clear()
+        self._seq = seq
+        welcome = self.welcome_frame()
+        for state in self.clients.values():
+            # connected followers must forget the old numbering too
+            state.cursor = seq
+            state.outbox.clear()
+            if not state.writer.is_closing():
+                state.writer.write(welcome)
+
+    def _emit(self, kind: str, value: object = None):
+        if self.on_event is not None:
+            self.on_event(kind, value)
+
+    def _deliver(self, seq: int, key: str, frame: bytes, ts: int, enqueued: int):
+        self._seq = seq
+        self.key = key
+        self.published += 1
+        self._emit("key", key)
+        published = now_ns()
+        self._events.append((frame, ts, enqueued, key))
+        if self.recorder is not None:
+            groups = self.key_groups.get(key)
+            self.recorder.record(ts, seq, key, ",".join(sorted(groups)) if groups else "")
+        if self.udp is not None:
+            self.udp.publish(frame)
+        # push clients get the key immediately, poll clients pick it up from _events
+        for state in self._routes.get(key, self._broadcast):
+            self._queue_frame(state, seq, frame, published)
+        for group, n in self._route_counts.get(key, ()):
+            stats = self.group_stats[group]
+            stats["keys"] += 1
+            stats["deliveries"] += n
+
+    def wants(self, state: ClientState, key: str) -> bool:
+        if state.groups is None:
+            return True
+        groups = self.key_groups.get(key)
+        return groups is None or not groups.isdisjoint(state.groups)
+
+    def _rebuild_routes(self):
+        """Precompute key -> push subscribers, so publishing a key does no per-client matching."""
+        push = [s for s in self.clients.values() if s.mode == "push"]
+        self._broadcast = tuple(push)
+        self._routes = {key: tuple(s for s in push if self.wants(s, key)) for key in self.key_groups}
+        members = {g: 0 for g in self.group_stats}
+        for s in self.clients.values():
+            for g in s.groups or ():
+                if g in members:
+                    members[g] += 1
+        for g, n in members.items():
+            self.group_stats[g]["members"] = n
+        self._route_counts = {
+            key: tuple((g, sum(1 for s in self._routes[key] if s.groups and g in s.groups)) for g in groups)
+            for key, groups in self.key_groups.items()
+        }
+
+    def _set_groups(self, state: ClientState, frame):
+        tags = frame.payload.decode("utf-8", "replace")
+        state.groups = frozenset(t.strip() for t in tags.split(",") if t.strip()) or None
+        self._rebuild_routes()
+        # tell the follower which keys it will get, so it can filter keys that reach it anyway (multicast)
+        keys = "" if state.groups is None else ",".join(sorted(k for k in self.table if self.wants(state, k)))
+        state.writer.write(encode_frame(GROUPS, payload=keys.encode("utf-8")))
+        logging.info("Client %s joined group(s) %s", state.addr, ", ".join(sorted(state.groups or ())) or "-")
+
+    def _queue_frame(self, state: ClientState, seq: int, frame: bytes, published: int):
+        state.cursor = seq
+        writer = state.writer
+        if writer.is_closing():
+            return
+        if not state.outbox and writer.transport.get_write_buffer_size() < self.send_high_water:
+            # fast path: socket keeps up, write straight away
+            writer.write(frame)
+            state.sent += 1
+            state.mark_sent(seq, published)
+            return
+        if len(state.outbox) >= self.send_buffer:
+            state.outbox.popleft()
+            state.dropped += 1
+        state.outbox.append((seq, frame, published))
+        state.wake.set()
+
+    def welcome_frame(self) -> bytes:
+        return encode_frame(WELCOME, self._seq, payload=EPOCH.pack(self.epoch))
+
+    def history_frames(self, first: int, count: int) -> List[bytes]:
+        """Key frames first .. first+count-1 still in the history and not older than resume_staleness."""
+        oldest = self._seq - len(self._events) + 1
+        limit = now_ns() - int(self.resume_staleness * 1e9)
+        frames = []
+        for seq in range(max(first, oldest), min(first + count, self._seq + 1)):
+            frame, captured, _, _ = self._events[seq - oldest]
+            if frame and captured >= limit:
+                frames.append(frame)
+        return frames
+
+    def _prune_stale(self, state: ClientState, now: int):
+        limit = int(self.stale_after * 1e9)
+        while state.outbox and now - state.outbox[0][2] > limit:
+            state.outbox.popleft()
+            state.dropped += 1
+
+    async def _sender(self, state: ClientState):
+        """Drains one push client's outbox; only this client waits on its socket."""
+        writer = state.writer
+        while not writer.is_closing():
+            await state.wake.wait()
+            state.wake.clear()
+            while state.outbox:
+                try:
+                    await asyncio.wait_for(writer.drain(), self.drain_timeout)
+                except ConnectionError as e:
+                    # the follower went away; handle_client sees the same on its read and cleans up
+                    logging.info("Client %s dropped while sending: %s", state.addr, e)
+                    return
+                except asyncio.TimeoutError:
+                    now = now_ns()
+                    if self.slow_policy == "disconnect" and state.lag_ns(now) > self.max_lag * 1e9:
+                        logging.warning("Disconnecting slow client %s (%.0f ms behind)",
+                                        state.addr, state.lag_ns(now) / 1e6)
+                        # abort: close() would wait for a flush that is never going to happen
+                        writer.transport.abort()
+                        return
+                    if self.slow_policy == "drop-stale":
+                        self._prune_stale(state, now)
+                    continue
+                now = now_ns()
+                if self.slow_policy == "drop-stale":
+                    self._prune_stale(state, now)
+                frames = []
+                while state.outbox:
+                    seq, frame, _ = state.outbox.popleft()
+                    frames.append(frame)
+                    state.mark_sent(seq, now)
+                if frames:
+                    writer.write(b"".join(frames))
+                    state.sent += len(frames)
+
+    def client_stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-client delivery counters and current lag, keyed by "host:port"."""
+        now = now_ns()
+        oldest = self._seq - len(self._events) + 1
+        stats = {}
+        for s in list(self.clients.values()):
+            if s.mode == "push":
+                lag = s.lag_ns(now)
+                queued = len(s.outbox)
+            elif s.mode == "udp":
+                lag = queued = 0  # datagrams are never queued for a follower
+            else:
+                # a poll client is behind by everything after its cursor
+                nxt = max(s.cursor + 1, oldest)
+                lag = now - self._events[nxt - oldest][2] if nxt <= self._seq else 0
+                queued = self._seq - s.cursor
+            stats[f"{s.addr[0]}:{s.addr[1]}" if s.addr else "?"] = {
+                "mode": s.mode,
+                "sent": s.sent,
+                "dropped": s.dropped + s.skipped,
+                "queued": queued,
+                "lag_ms": round(lag / 1e6, 3),
+                "rtt_ms": round(s.rtt_ns / 1e6, 3),
+                "jitter_ms": round(s.jitter_ns / 1e6, 3),
+                "offset_ms": round(s.offset_ns / 1e6, 3),
+                "groups": ",".join(sorted(s.groups)) if s.groups else "",
+            }
+        return stats
+
+    def _take_pending(self, state: ClientState) -> bytes:
+        """Return every key frame the client has not received yet and advance its cursor."""
+        if state.cursor >= self._seq:
+            return b""
+        oldest = self._seq - len(self._events) + 1
+        if state.cursor + 1 < oldest:
+            state.skipped += oldest - state.cursor - 1
+            state.cursor = oldest - 1
+        first = state.cursor + 1 - oldest
+        frames = []
+        for i in range(first, len(self._events)):
+            frame, _, _, key = self._events[i]
+            if frame and self.wants(state, key):
+                frames.append(frame)
+                for group in self.key_groups.get(key, ()):
+                    if state.groups and group in state.groups:
+                        self.group_stats[group]["deliveries"] += 1
+        sent = now_ns()
+        for seq in range(state.cursor + 1, self._seq + 1):
+            state.mark_sent(seq, sent)
+        state.cursor = self._seq
+        state.sent += len(frames)
+        return b"".join(frames)
+
+    def _greet(self, state: ClientState, frame):
+        """Handle the first SUBSCRIBE/POLL of a connection; a resuming client gets its missed keys."""
+        state.greeted = True
+        if len(frame.payload) < EPOCH.size:
+            return
+        (epoch,) = EPOCH.unpack_from(frame.payload)
+        if epoch != self.epoch or frame.seq > self._seq:
+            return  # sequence numbers from a previous server run
+        oldest = self._seq - len(self._events) + 1
+        cursor = max(frame.seq, oldest - 1)
+        state.skipped += cursor - frame.seq
+        # skip what is too old to be worth pressing now
+        limit = now_ns() - int(self.resume_staleness * 1e9)
+        while cursor < self._seq and self._events[cursor + 1 - oldest][1] < limit:
+            cursor += 1
+            state.skipped += 1
+        state.cursor = cursor
+        self.resumes += 1
+        logging.info("Client %s resumed after seq %d: replaying %d key(s), skipped %d",
+                     state.addr, frame.seq, self._seq - cursor, cursor - frame.seq)
+
+    def _on_report(self, state: ClientState, seq: int, payload: bytes):
+        oldest = self._seq - len(self._events) + 1
+        if seq < oldest or seq > self._seq:
+            return
+        _, captured, enqueued, _ = self._events[seq - oldest]
+        stamps = decode_report(payload)
+        stamps.update(capture=captured, enqueue=enqueued, send=state.sent_at.get(seq, 0))
+        # follower timestamps are moved onto our clock with the heartbeat's offset estimate
+        state.latency.add(stamps, state.offset_ns)
+        self.stage_latency.add(stamps, state.offset_ns)
+
+    def _on_ping(self, state: ClientState, frame, received: int):
+        state.heartbeats = True
+        if len(frame.payload) >= LINK.size:
+            state.rtt_ns, state.offset_ns, state.jitter_ns = LINK.unpack_from(frame.payload)
+        state.writer.write(encode_frame(PONG, frame.seq, ts=frame.ts, payload=STAMPS.pack(received, now_ns())))
+
+    def _handle_control(self, state: ClientState, frames):
+        received = now_ns()
+        for f in frames:
+            if f.type == REPORT:
+                self._on_report(state, f.seq, f.payload)
+            elif f.type == PING:
+                self._on_ping(state, f, received)
+            elif f.type == GROUPS:
+                self._set_groups(state, f)
+
+    async def _read(self, reader: asyncio.StreamReader, state: ClientState) -> bytes:
+        if not state.heartbeats:
+            return await reader.read(1024)
+        try:
+            return await asyncio.wait_for(reader.read(1024), self.link_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("No heartbeat from %s for %.1f s, dropping it", state.addr, self.link_timeout)
+            return b""
+
+    def latency_summary(self, segments=None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Per-client latency percentiles, keyed by "host:port"."""
+        return {f"{s.addr[0]}:{s.addr[1]}" if s.addr else "?": s.latency.summary(segments)
+                for s in self.clients.values()}
+
+    async def _log_latency(self, interval: float = 30.0):
+        while True:
+            await asyncio.sleep(interval)
+            for client, segs in self.latency_summary(["total"]).items():
+                total = segs.get("total")
+                if total:
+                    logging.info("Latency %s: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms over %d keys", client,
+                                 total["p50_ms"], total["p95_ms"], total["p99_ms"], total["count"])
+            stages = self.stage_latency.summary()
+            if stages:
+                logging.info("Stage p99 over all followers: %s",
+                             ", ".join(f"{name} {st['p99_ms']:.1f} ms" for name, st in stages.items()))
+            cap = self.capture_stats()
+            if cap["events"]:
+                logging.info("Capture: %d of %d key events accepted (%d outside key set, %d repeats, %d debounced), "
+                             "capture->publish p99 %.2f ms", cap["accepted"], cap["events"], cap["filtered_key"],
+                             cap["filtered_repeat"], cap["filtered_debounce"], cap["latency"]["p99_ms"])
+            for client, st in self.client_stats().items():
+                if st["lag_ms"] or st["dropped"]:
+                    logging.info("Client %s is %.0f ms behind (%d queued, %d dropped)", client,
+                                 st["lag_ms"], st["queued"], st["dropped"])
+
+    def metrics_text(self) -> str:
+        """Everything worth scraping, in Prometheus text format; built on the loop thread per request."""
+        m = MetricsText("wowserver_")
+        modes = {"poll": 0, "push": 0, "udp": 0}
+        for s in self.clients.values():
+            modes[s.mode] = modes.get(s.mode, 0) + 1
+        for mode, n in modes.items():
+            m.gauge("clients", "Connected followers", n, {"mode": mode})
+        m.counter("connections_total", "Follower connections accepted", self.connections)
+        m.counter("resumes_total", "Reconnecting followers that resumed their key stream", self.resumes)
+        cap = self.capture.stats()
+        queue = self.keys.stats()
+        m.counter("key_events_total", "OS key events seen by the capture hook", cap["events"])
+        for reason in ("key", "repeat", "debounce"):
+            m.counter("key_events_filtered_total", "Key events the capture stage dropped", cap["filtered_" + reason],
+                      {"reason": reason})
+        m.counter("keys_captured_total", "Keys put on the capture queue", queue["captured"])
+        m.counter("keys_dropped_total", "Keys dropped or coalesced because the capture queue was full",
+                  queue["dropped"], {"reason": "overflow"})
+        m.counter("keys_dropped_total", "Keys dropped or coalesced because the capture queue was full",
+                  queue["coalesced"], {"reason": "coalesced"})
+        m.gauge("capture_queue_depth", "Keys waiting in the capture queue", queue["queued"])
+        m.counter("keys_published_total", "Keys published to followers (captured, replayed or relayed)",
+                  self.published)
+        m.gauge("key_seq", "Sequence number of the latest key", self._seq)
+        m.summary("capture_latency_seconds", "Capture to published", self.capture_latency)
+        for client, st in self.client_stats().items():
+            state = {"client": client, "mode": st["mode"]}
+            m.counter("client_keys_sent_total", "Keys sent to a follower", st["sent"], state)
+            m.counter("client_keys_dropped_total", "Keys a follower never got (stale, overflow, too old)",
+                      st["dropped"], state)
+            m.gauge("client_queued_keys", "Keys waiting to be sent to a follower", st["queued"], state)
+            m.gauge("client_lag_seconds", "How long the oldest unsent key has been waiting", st["lag_ms"] / 1000,
+                    state)
+            m.gauge("client_rtt_seconds", "Heartbeat round trip reported by the follower", st["rtt_ms"] / 1000,
+                    state)
+            m.gauge("client_jitter_seconds", "Heartbeat round trip jitter reported by the follower",
+                    st["jitter_ms"] / 1000, state)
+        for s in self.clients.values():
+            client = f"{s.addr[0]}:{s.addr[1]}" if s.addr else "?"
+            if s.mode == "poll":
+                m.counter("client_polls_total", "Poll requests answered", s.polls, {"client": client})
+            total = s.latency.segments.get("total")
+            if total is not None:
+                m.summary("client_key_latency_seconds", "Capture to press on a follower, from its reports",
+                          total, {"client": client})
+        for stage, hist in self.stage_latency.segments.items():
+            m.summary("key_stage_latency_seconds", "Time keys spend in each stage, over all followers' reports",
+                      hist, {"stage": stage})
+        for group, st in self.group_stats.items():
+            m.gauge("group_members", "Followers in a group", st["members"], {"group": group})
+            m.counter("group_deliveries_total", "Keys delivered to members of a group", st["deliveries"],
+                      {"group": group})
+        if self.udp is not None:
+            udp = self.udp.stats()
+            m.gauge("udp_members", "Datagram followers", udp["members"])
+            m.counter("udp_datagrams_sent_total", "Key datagrams sent, copies included", udp["sent"])
+            m.counter("udp_nacks_total", "Resend requests from datagram followers", udp["nacks"])
+            m.counter("udp_resent_total", "Keys resent after a NACK", udp["resent"])
+        m.summary("loop_lag_seconds", "How late the event loop runs a timer", self.loop_lag.hist)
+        return m.render()
+
+    async def start_metrics(self):
+        if self._metrics_server is None:
+            self._metrics_server = await serve_metrics(self.metrics_text, self.metrics_port, self.metrics_host)
+            self.metrics_port = self._metrics_server.sockets[0].getsockname()[1]
+            self._lag_task = asyncio.create_task(self.loop_lag.run())
+
+    def stop_metrics(self):
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._lag_task.cancel()
+            self._metrics_server = self._lag_task = None
+
+    def _poll_answer(self, state: ClientState) -> bytes:
+        pending = self._take_pending(state)
+        if pending:
+            logging.debug("Sending keys up to seq %d to %s", state.cursor, state.addr)
+            return pending
+        return encode_frame(IDLE)
+
+    async def _read_control(self, reader: asyncio.StreamReader, state: ClientState, decoder: FrameDecoder):
+        # push and udp clients only send heartbeats and latency reports; read them until it goes away
+        while True:
+            data = await self._read(reader, state)
+            if not data:
+                break
+            self._handle_control(state, decoder.feed(data))
+
+    async def handle_subscriber(self, reader: asyncio.StreamReader, state: ClientState, decoder: FrameDecoder):
+        # keys the client had not polled yet are delivered first
+        backlog = self._take_pending(state)
+        if backlog:
+            state.writer.write(backlog)
+        state.writer.transport.set_write_buffer_limits(high=self.send_high_water)
+        state.wake = asyncio.Event()
+        state.mode = "push"
+        self._rebuild_routes()
+        sender = asyncio.create_task(self._sender(state))
+        try:
+            await self._read_control(reader, state, decoder)
+        finally:
+            sender.cancel()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, initial: bytes = b""):
+        """Serve one follower connection; initial is data already read off it (by a ChannelServer)."""
         addr = writer.get_extra_info('peername')
         logging.info("Connection from: %s", addr)
+        # new followers only receive keys captured after they connected
+        state = ClientState(addr, writer, self._seq)
+        self.clients[id(state)] = state
+        self.connections += 1
+        self._emit("clients", len(self.clients))
+        writer.write(self.welcome_frame())
         try:
+            decoder = FrameDecoder()
+            data = initial
             while True:
-                data = await reader.read(1024)
                 if not data:
+                    data = await self._read(reader, state)
+                    if not data:
+                        break
+                frames = decoder.feed(data)
+                data = b""
+                log_every(5.0, "poll", logging.INFO, "from connected user %s: %d frame(s)", addr, len(frames))
+                self._handle_control(state, frames)
+                if not state.greeted:
+                    hello = next((f for f in frames if f.type in (SUBSCRIBE, POLL)), None)
+                    if hello is not None:
+                        self._greet(state, hello)
+
+                if any(f.type == JOIN for f in frames):
+                    # keys go out over UDP; missed ones are NACKed there, so no resume on this side
+                    logging.info("Client %s receives keys as datagrams", addr)
+                    state.greeted = True
+                    state.mode = "udp"
+                    await self._read_control(reader, state, decoder)
                     break
-                incoming = data.decode()
-                logging.info("from connected user: %s", incoming)
+
+                if any(f.type == SUBSCRIBE for f in frames):
+                    logging.info("Client %s switched to push mode", addr)
+                    await self.handle_subscriber(reader, state, decoder)
+                    break
+
+                polls = sum(1 for f in frames if f.type == POLL)
+                if not polls:
+                    continue
+                state.polls += polls
 
                 # small delay to mimic original behavior
                 await asyncio.sleep(0.2)
 
-                with self._lock:
-                    if self._current_key and not self._key_ready:
-                        if self._send_count < self._send_limit:
-                            send = self._current_key
-                            self._send_count += 1
-                            logging.info(f"Sending key: {send} (press {self._send_count}/3)")
-                            
-                            if self._send_count >= self._send_limit:
-                                self._key_ready = True  # Ready for next key
-                                self._current_key = None
-                                logging.info("3 presses complete - ready for next key")
-                        else:
-                            send = "."
-                    else:
-                        send = "."
-                        if self._key_ready:
-                            logging.info("Waiting for new key")
-                        
-                writer.write(send.encode())
-                await writer.drain()
-
-        except (asyncio.CancelledError, ConnectionResetError) as e:
+                writer.write(b"".join(self._poll_answer(state) for _ in range(polls)))
+                try:
+                    await asyncio.wait_for(writer.drain(), self.drain_timeout)
+                except asyncio.TimeoutError:
+                    logging.warning("Client %s is not reading, disconnecting", addr)
+                    break
+
+        except (asyncio.CancelledError, ConnectionError, ValueError) as e:
             logging.info("Client %s disconnected: %s", addr, e)
         finally:
+            self.clients.pop(id(state), None)
+            self._emit("clients", len(self.clients))
+            if state.mode == "push" or state.groups:
+                self._rebuild_routes()
             try:
                 writer.close()
                 await writer.wait_closed()
@@ -75,34 +832,138 @@ class WowServer:
                 pass
             logging.info("Closed connection: %s", addr)
 
+    def prepare(self):
+        """Bind to the running loop and open the key log. listen() does this; a ChannelServer,
+        which owns the socket instead, calls it for each of its channels."""
+        self._loop = asyncio.get_running_loop()
+        if self._stop_requested:
+            self.running = False  # start() then returns without serving
+        if self.record_path is not None and self.recorder is None:
+            self.recorder = KeyRecorder(self.record_path)
+            logging.info("Recording keys to %s", self.record_path)
+
+    async def listen(self):
+        self.prepare()
+        server = await asyncio.start_server(
+            self.handle_client, 
+            self.host, 
+            self.port,
+            family=socket.AF_INET  # Force IPv4
+        )
+        addr = server.sockets[0].getsockname()
+        self.port = addr[1]  # resolve port 0 to the one actually bound
+        logging.info("Serving on %s", addr)
+        if self.udp_port is not None:
+            transport, self.udp = await self._loop.create_datagram_endpoint(
+                lambda: UdpFanout(self, self.udp_group, self.udp_copies),
+                local_addr=(self.host, self.udp_port), family=socket.AF_INET)
+            self.udp_port = transport.get_extra_info("sockname")[1]
+            logging.info("Serving datagrams on port %d%s", self.udp_port,
+                         f" to group {self.udp_group[0]}:{self.udp_group[1]}" if self.udp_group else "")
+        if self.metrics_port is not None:
+            await self.start_metrics()
+        self._server = server
+        self._emit("listening", self.port)
+        return server
+
+    async def run_replay(self):
+        # followers are usually started after the server; give the first one a moment to connect
+        while not self.clients:
+            await asyncio.sleep(0.05)
+        logging.info("Replaying %s at %s", self.replay_path,
+                     f"{self.replay_speed:g}x" if self.replay_speed else "full speed")
+        start = self._loop.time()
+        count = await replay(self, self.replay_path, self.replay_speed)
+        logging.info("Replay finished: %d key(s) in %.1f s", count, self._loop.time() - start)
+
+    def stop(self):
+        """Stop serving: close the listening socket and every follower connection. Loop thread only."""
+        self.running = False
+        if self._server is not None:
+            self._server.close()  # also ends serve_forever() in start()
+        for state in list(self.clients.values()):
+            state.writer.close()
+
+    def stop_threadsafe(self):
+        """stop() from any other thread (a GUI); returns at once, start() finishes shortly after.
+        Also works before start() has bound the loop: prepare() sees the request."""
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.stop)
+
     async def start(self):
-        # register keyboard hook (keyboard lib runs its own thread)
-        keyboard.on_press(self.on_keypress)
+        hook = None
+        if self.capture_keys:
+            # register keyboard hook (keyboard lib runs its own thread)
+            import keyboard
+            hook = keyboard.hook(self.on_key_event)
         
         try:
-            server = await asyncio.start_server(
-                self.handle_client, 
-                self.host, 
-                self.port,
-                family=socket.AF_INET  # Force IPv4
-            )
-            addr = server.sockets[0].getsockname()
-            logging.info("Serving on %s", addr)
+            server = await self.listen()
+            stats = asyncio.create_task(self._log_latency())
+            replaying = asyncio.create_task(self.run_replay()) if self.replay_path else None
             
-            async with server:
-                await server.serve_forever()
+            try:
+                async with server:
+                    if self.running:  # stopped while listen() was still setting up
+                        await server.serve_forever()
+            except asyncio.CancelledError:
+                if self.running:
+                    raise
+                # stop() closed the server
+            finally:
+                stats.cancel()
+                if replaying is not None:
+                    replaying.cancel()
+                if self.udp is not None:
+                    self.udp.transport.close()
+                self.stop_metrics()
+                if self.recorder is not None:
+                    self.recorder.close()
+                if hook is not None:
+                    keyboard.unhook(hook)
+                self._server = None
+                self._emit("stopped")
         except Exception as e:
             logging.error("Server failed to start: %s", e)
             raise
 
 
-if __name__ == "__main__":
-    format = "%(asctime)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WoW leader: captures keys and sends them to followers")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--config", default="groups.json", help="follower groups file")
+    parser.add_argument("--mode", choices=["keyboard", "replay"], default="keyboard",
+                        help="key source: the keyboard hook or a --replay log (relays are wowclient --relay-port)")
+    parser.add_argument("--replay", help="key log to publish with --mode replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 = as fast as possible")
+    parser.add_argument("--record", help="append every published key to this key log")
+    parser.add_argument("--udp-port", type=int, help="also send keys as datagrams from this port")
+    parser.add_argument("--udp-group", help="multicast group addr:port for the datagrams")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+    if args.mode == "replay" and not args.replay:
+        parser.error("--mode replay needs --replay")
+
+    setup_logging(logging.DEBUG if args.debug else logging.INFO)
     logging.info("Starting Method")
 
-    srv = WowServer()
+    # the keyboard library (and its hook thread) is only loaded by start() in keyboard mode
+    srv = WowServer(capture_keys=args.mode == "keyboard", groups_path=args.config, record_path=args.record,
+                    replay_path=args.replay if args.mode == "replay" else None, replay_speed=args.speed,
+                    udp_port=args.udp_port, udp_group=args.udp_group, metrics_port=args.metrics_port,
+                    metrics_host=args.metrics_host)
+    srv.host = args.host
+    srv.port = args.port
     try:
         asyncio.run(srv.start())
     except KeyboardInterrupt:
-        logging.info("Server shutting down")
\ No newline at end of file
+        logging.info("Server shutting down")
+
+
+if __name__ == "__main__":
+    main()
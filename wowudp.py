@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import socket
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from wowprotocol import FrameDecoder, encode_frame, now_ns, COUNT, EPOCH, JOIN, KEY, NACK, WELCOME
+
+Address = Tuple[str, int]
+
+
+def parse_group(group: str) -> Address:
+    """ "239.255.42.99:5002" -> ("239.255.42.99", 5002)"""
+    host, _, port = group.rpartition(":")
+    return host, int(port)
+
+
+def decode_datagram(data: bytes):
+    # a datagram holds whole frames only, so a fresh decoder per datagram is enough
+    try:
+        return FrameDecoder().feed(data)
+    except ValueError:
+        return []
+
+
+def multicast_socket(group: Address, interface: str = "0.0.0.0") -> socket.socket:
+    """Socket bound to the group's port and joined to the group; followers on one host can share it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", group[1]))
+    mreq = struct.pack("4s4s", socket.inet_aton(group[0]), socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+
+class UdpFanout(asyncio.DatagramProtocol):
+    """Server side of the datagram transport, next to the TCP server on the same key stream.
+
+    Followers register by sending JOIN every second or so and are answered with a WELCOME
+    (epoch and latest seq), which also tells them about a lost trailing key. A key goes out as
+    one datagram per follower, or a single datagram to `group` for multicast, repeated `copies`
+    times repeat_gap seconds apart since the network never retries a lost datagram. Keys that
+    still go missing are asked for with NACK and resent from the server's key history.
+    """
+
+    def __init__(self, server, group: Optional[Address] = None, copies: int = 2, repeat_gap: float = 0.002,
+                 member_timeout: float = 5.0, max_resend: int = 64):
+        self.server = server
+        self.group = group
+        self.copies = max(1, copies)
+        self.repeat_gap = repeat_gap
+        self.member_timeout = member_timeout
+        self.max_resend = max_resend
+        self.members: Dict[Address, float] = {}  # follower address -> time.monotonic() of its last JOIN
+        self.transport = None
+        self._expired_at = 0.0
+        self.sent = 0
+        self.nacks = 0
+        self.resent = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.group:
+            sock = transport.get_extra_info("socket")
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)  # stay on the LAN
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    def datagram_received(self, data: bytes, addr: Address):
+        for f in decode_datagram(data):
+            if f.type == JOIN:
+                if addr not in self.members:
+                    logging.info("Datagram follower %s joined", addr)
+                self.members[addr] = time.monotonic()
+                self.transport.sendto(self.server.welcome_frame(), addr)
+            elif f.type == NACK:
+                self._resend(f, addr)
+
+    def _resend(self, frame, addr: Address):
+        self.nacks += 1
+        count = COUNT.unpack_from(frame.payload)[0] if len(frame.payload) >= COUNT.size else 1
+        frames = self.server.history_frames(frame.seq, min(count, self.max_resend))
+        if frames:
+            self.resent += len(frames)
+            self.transport.sendto(b"".join(frames), addr)
+
+    def _expire(self, now: float):
+        self._expired_at = now
+        for addr, seen in list(self.members.items()):
+            if now - seen > self.member_timeout:
+                del self.members[addr]
+                logging.info("Datagram follower %s timed out", addr)
+
+    def publish(self, frame: bytes):
+        if self.transport is None or self.transport.is_closing():
+            return
+        now = time.monotonic()
+        if now - self._expired_at > 1.0:
+            self._expire(now)
+        targets = [self.group] if self.group else list(self.members)
+        if not targets:
+            return
+        self._send(frame, targets)
+        loop = asyncio.get_running_loop()
+        for i in range(1, self.copies):
+            loop.call_later(self.repeat_gap * i, self._send, frame, targets)
+
+    def _send(self, frame: bytes, targets: List[Address]):
+        if self.transport.is_closing():
+            return
+        for addr in targets:
+            self.transport.sendto(frame, addr)
+        self.sent += len(targets)
+
+    def stats(self) -> Dict[str, int]:
+        return {"members": len(self.members), "sent": self.sent, "nacks": self.nacks, "resent": self.resent}
+
+
+class UdpReceiver(asyncio.DatagramProtocol):
+    """Follower side: turns datagrams from a UdpFanout back into an in-order, duplicate-free stream.
+
+    on_frames gets lists of frames in sequence order: a WELCOME whenever the server's epoch
+    changes, and KEY frames. When a gap opens, later keys are held back for up to reorder_wait
+    seconds while the missing ones are NACKed; after that the gap is given up on and counted.
+    """
+
+    def __init__(self, server_addr: Address, on_frames: Callable[[list], None], join_interval: float = 1.0,
+                 reorder_wait: float = 0.03):
+        self.server_addr = server_addr
+        self.on_frames = on_frames
+        self.join_interval = join_interval
+        self.reorder_wait = reorder_wait
+        self.transports = []  # [unicast socket for JOIN/NACK, multicast group socket]
+        self._epoch = None
+        self._next = None  # next seq to deliver; None until the first WELCOME
+        self._held = {}  # seq -> frame that arrived ahead of a gap
+        self._gap_timer = None
+        self._join_timer = None
+        self._asked = None  # trailing seq NACKed after a WELCOME, given up on if still missing next time
+        self.last_heard = time.monotonic()
+        self.duplicates = 0
+        self.missing = 0
+        self.nacks = 0
+
+    def connection_made(self, transport):
+        self.transports.append(transport)
+        if len(self.transports) == 1:
+            self._join()
+
+    def connection_lost(self, exc):
+        self._cancel_timers()
+
+    def close(self):
+        self._cancel_timers()
+        for t in self.transports:
+            t.close()
+
+    def _cancel_timers(self):
+        for timer in (self._join_timer, self._gap_timer):
+            if timer is not None:
+                timer.cancel()
+        self._join_timer = self._gap_timer = None
+
+    def silent_for(self) -> float:
+        return time.monotonic() - self.last_heard
+
+    def _sendto_server(self, frame: bytes):
+        transport = self.transports[0]
+        if not transport.is_closing():
+            transport.sendto(frame, self.server_addr)
+
+    def _join(self):
+        self._sendto_server(encode_frame(JOIN, ts=now_ns()))
+        self._join_timer = asyncio.get_running_loop().call_later(self.join_interval, self._join)
+
+    def _request(self, first: int, count: int):
+        self.nacks += 1
+        self._sendto_server(encode_frame(NACK, first, payload=COUNT.pack(count)))
+
+    def datagram_received(self, data: bytes, addr: Address):
+        self.last_heard = time.monotonic()
+        out = []
+        for f in decode_datagram(data):
+            if f.type == KEY:
+                self._accept(f, out)
+            elif f.type == WELCOME and len(f.payload) >= EPOCH.size:
+                self._on_welcome(f, out)
+        if out:
+            self.on_frames(out)
+
+    def _on_welcome(self, frame, out: list):
+        (epoch,) = EPOCH.unpack_from(frame.payload)
+        if epoch != self._epoch:
+            # first contact or a restarted server: deliver only keys captured from now on
+            self._epoch = epoch
+            self._next = frame.seq + 1
+            self._held.clear()
+            self._asked = None
+            out.append(frame)
+            return
+        if frame.seq < self._next or self._held:
+            self._asked = None
+            return
+        if self._asked == self._next:
+            # asked once already and nothing came (the server found them too old to resend)
+            self.missing += frame.seq + 1 - self._next
+            logging.info("Gave up on %d key(s) before seq %d", frame.seq + 1 - self._next, frame.seq + 1)
+            self._next = frame.seq + 1
+            self._asked = None
+            return
+        # the last key(s) before a pause got lost; there is no later key to reveal the gap
+        self._asked = self._next
+        self._request(self._next, frame.seq + 1 - self._next)
+
+    def _accept(self, frame, out: list):
+        if self._next is None:
+            return  # not joined yet, the epoch is unknown
+        if frame.seq < self._next or frame.seq in self._held:
+            self.duplicates += 1
+            return
+        if frame.seq > self._next:
+            self._held[frame.seq] = frame
+        else:
+            out.append(frame)
+            self._next += 1
+            self._flush(out)
+        self._check_gap()
+
+    def _flush(self, out: list):
+        while self._next in self._held:
+            out.append(self._held.pop(self._next))
+            self._next += 1
+
+    def _check_gap(self):
+        if not self._held:
+            if self._gap_timer is not None:
+                self._gap_timer.cancel()
+                self._gap_timer = None
+        elif self._gap_timer is None:
+            self._request(self._next, min(self._held) - self._next)
+            self._gap_timer = asyncio.get_running_loop().call_later(self.reorder_wait, self._give_up)
+
+    def _give_up(self):
+        self._gap_timer = None
+        if not self._held:
+            return
+        first = min(self._held)
+        self.missing += first - self._next
+        logging.info("Gave up on %d key(s) before seq %d", first - self._next, first)
+        self._next = first
+        out = []
+        self._flush(out)
+        self._check_gap()
+        if out:
+            self.on_frames(out)
+
+    def stats(self) -> Dict[str, int]:
+        return {"duplicates": self.duplicates, "missing": self.missing, "nacks": self.nacks,
+                "held": len(self._held)}
+
+
+async def open_receiver(server_addr: Address, on_frames: Callable[[list], None],
+                        group: Optional[Address] = None, **kwargs) -> UdpReceiver:
+    """Unicast socket towards the server, plus the group socket when the server multicasts."""
+    loop = asyncio.get_running_loop()
+    receiver = UdpReceiver(server_addr, on_frames, **kwargs)
+    await loop.create_datagram_endpoint(lambda: receiver, local_addr=("0.0.0.0", 0), family=socket.AF_INET)
+    if group:
+        try:
+            await loop.create_datagram_endpoint(lambda: receiver, sock=multicast_socket(group))
+        except Exception:
+            receiver.close()
+            raise
+    return receiver